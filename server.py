@@ -12,8 +12,23 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+# Serve with gevent instead of the thread pool of waitress. Swift requests
+# then run in greenlets, so slow or idle transfers don't hold an OS thread.
+# Requires gevent; set pool_max_connections below to bound the concurrent
+# requests to Swift.
+use_gevent = False
+
+if use_gevent:
+    from gevent import monkey
+    monkey.patch_all()
+
+import logging
+
+from swiftdav import contentcache
+from swiftdav import metrics
+from swiftdav import propfind
+from swiftdav import sqlstore
 from swiftdav import swiftdav
-import waitress
 from wsgidav import wsgidav_app
 
 # Settings for auth V1, for example tempauth or swauth
@@ -26,19 +41,71 @@ auth_version = 1
 
 insecure = False  # Set to True to disable SSL certificate validation
 
+# Maximum number of concurrent requests to each Swift proxy; None is unlimited
+pool_max_connections = None
+
+# Number of 1 MiB blocks downloads are read ahead of the client; 0 disables
+# read-ahead. All downloads together buffer at most readahead_budget bytes.
+readahead_window = 0
+readahead_budget = 256 * 1024 * 1024
+
+# Directory to cache the data of objects up to 64 MiB in; at most
+# content_cache_size bytes are used. None disables the cache.
+content_cache_path = None
+content_cache_size = 1024 * 1024 * 1024
+
+# SQLite database to store locks and dead properties in, so they are kept
+# across restarts and shared by several processes; None keeps them in memory
+lock_database = None
+
+# Adds X-Backend-Calls/X-Backend-Time response headers and logs every Swift
+# request
+debug = False
+
+logging.basicConfig(level=logging.DEBUG if debug else logging.INFO)
+
+content_cache = None
+if content_cache_path:
+    content_cache = contentcache.ContentCache(content_cache_path,
+                                              content_cache_size)
+
+provider = swiftdav.SwiftProvider(pool_max_connections=pool_max_connections,
+                                  readahead_window=readahead_window,
+                                  readahead_budget=readahead_budget,
+                                  content_cache=content_cache)
+domain_controller = swiftdav.WsgiDAVDomainController(
+    proxy, insecure, auth_version=auth_version)
+provider.metrics.add_collector('token_cache',
+                               domain_controller.token_cache.stats)
+
+locks_manager = props_manager = True
+if lock_database:
+    locks_manager = sqlstore.SQLiteLockStorage(lock_database)
+    props_manager = sqlstore.SQLitePropertyManager(lock_database)
+
 config = wsgidav_app.DEFAULT_CONFIG.copy()
 config.update({
-    "provider_mapping": {"": swiftdav.SwiftProvider()},
+    "provider_mapping": {"": provider},
     "verbose": 1,
-    "propsmanager": True,
-    "locksmanager": True,
+    "propsmanager": props_manager,
+    "locksmanager": locks_manager,
     "acceptbasic": True,
     "acceptdigest": False,
     "defaultdigest": False,
-    "domaincontroller": swiftdav.WsgiDAVDomainController(
-        proxy, insecure, auth_version=auth_version)
+    "domaincontroller": domain_controller,
+    "block_size": swiftdav.IO_BLOCK_SIZE,
+    "middleware_stack": [propfind.StreamingPropfind] +
+                        wsgidav_app.DEFAULT_CONFIG["middleware_stack"],
 })
-app = wsgidav_app.WsgiDAVApp(config)
+app = metrics.MetricsMiddleware(
+    propfind.ConnectionHeaderFilter(wsgidav_app.WsgiDAVApp(config)),
+    provider.metrics, debug=debug)
 
-waitress.serve(
-    app, host="0.0.0.0", port=8000, max_request_body_size=5*1024*1024*1024)
+if use_gevent:
+    from gevent import pywsgi
+    pywsgi.WSGIServer(("0.0.0.0", 8000), app).serve_forever()
+else:
+    import waitress
+    waitress.serve(
+        app, host="0.0.0.0", port=8000,
+        max_request_body_size=5*1024*1024*1024)
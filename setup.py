@@ -38,4 +38,7 @@ setuptools.setup(
         'Programming Language :: Python :: 2.6',
         'Environment :: No Input/Output (Daemon)'],
     install_requires=['waitress', 'wsgidav', 'python-swiftclient'],
+    extras_require={'gevent': ['gevent']},
+    entry_points={
+        'console_scripts': ['swiftdav-server = swiftdav.launcher:main']},
 )
@@ -0,0 +1,167 @@
+# Copyright 2013 Christian Schwede <info@cschwede.de>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# pylint:disable=E1101, C0103
+
+# time.strptime imports _strptime on its first call, which fails if several
+# threads do this at the same time (http://bugs.python.org/issue7980)
+import _strptime  # pylint:disable=W0611
+import calendar
+import collections
+import hashlib
+import json
+import threading
+import time
+
+from swiftclient import client
+
+
+def parse_expires(value):
+    """Parse a Keystone 'expires' timestamp into seconds since the epoch.
+
+    Keystone returns something like '2014-06-02T12:00:00Z', sometimes with
+    fractional seconds. Returns None if the value can't be parsed.
+    """
+    if not value:
+        return None
+    value = value.rstrip('Z').split('.')[0]
+    try:
+        return calendar.timegm(time.strptime(value, "%Y-%m-%dT%H:%M:%S"))
+    except ValueError:
+        return None
+
+
+def get_auth_1_0(auth_url, user, key, insecure=False):
+    """Authenticate against tempauth/swauth.
+
+    Same as client.get_auth_1_0, but also returns the token expiry time
+    (X-Auth-Token-Expires is the remaining lifetime in seconds).
+    """
+    parsed, conn = client.http_connection(auth_url, insecure=insecure)
+    conn.request('GET', parsed.path, '',
+                 {'X-Auth-User': user, 'X-Auth-Key': key})
+    resp = conn.getresponse()
+    body = resp.read()
+    storage_url = resp.getheader('x-storage-url')
+    if resp.status < 200 or resp.status >= 300 or (body and not storage_url):
+        raise client.ClientException('Auth GET failed',
+                                     http_scheme=parsed.scheme,
+                                     http_host=conn.host,
+                                     http_path=parsed.path,
+                                     http_status=resp.status,
+                                     http_reason=resp.reason)
+    token = resp.getheader('x-storage-token', resp.getheader('x-auth-token'))
+
+    expires = None
+    try:
+        expires = time.time() + int(resp.getheader('x-auth-token-expires'))
+    except (TypeError, ValueError):
+        pass
+    return storage_url, token, expires
+
+
+def get_auth_2_0(auth_url, user, key, tenant_name, insecure=False):
+    """Authenticate against Keystone v2.0.
+
+    Returns the publicURL of the first object-store endpoint, the token and
+    the token expiry time.
+    """
+    body = {'auth': {'tenantName': tenant_name,
+                     'passwordCredentials': {'username': user,
+                                             'password': key}}}
+    url = auth_url.rstrip('/') + '/tokens'
+    parsed, conn = client.http_connection(url, insecure=insecure)
+    conn.request('POST', parsed.path, json.dumps(body),
+                 {'Content-Type': 'application/json'})
+    resp = conn.getresponse()
+    body = resp.read()
+    if resp.status < 200 or resp.status >= 300:
+        raise client.ClientException('Auth POST failed',
+                                     http_scheme=parsed.scheme,
+                                     http_host=conn.host,
+                                     http_path=parsed.path,
+                                     http_status=resp.status,
+                                     http_reason=resp.reason)
+    try:
+        access = json.loads(body)['access']
+        token = access['token']['id']
+        expires = parse_expires(access['token'].get('expires'))
+        for service in access.get('serviceCatalog', []):
+            if service.get('type') == 'object-store':
+                storage_url = service['endpoints'][0]['publicURL']
+                break
+        else:
+            raise client.ClientException('Endpoint for object-store not found')
+    except (ValueError, KeyError, IndexError):
+        raise client.ClientException('Invalid Keystone response')
+    return storage_url, token, expires
+
+
+class TokenCache(object):
+    """In-process cache for Swift tokens.
+
+    Entries are keyed on (auth_url, user, password hash, tenant), so a wrong
+    password never returns a cached token. Tokens are considered stale
+    `refresh_margin` seconds before they expire; tokens without a known expiry
+    are kept for `default_ttl` seconds. At most `max_size` entries are kept,
+    the least recently used entry is evicted first.
+    """
+
+    def __init__(self, max_size=1024, default_ttl=3600, refresh_margin=60):
+        self.max_size = max_size
+        self.default_ttl = default_ttl
+        self.refresh_margin = refresh_margin
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(auth_url, user, password, tenant=None):
+        pwhash = hashlib.sha256(password or '').hexdigest()
+        return (auth_url, user, pwhash, tenant)
+
+    def get(self, key):
+        """Return (storage_url, token) or None if missing or stale."""
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is None or entry[2] - self.refresh_margin < time.time():
+                self.misses += 1
+                return None
+            # Re-insert to mark as most recently used
+            self._entries[key] = entry
+            self.hits += 1
+            return entry[0], entry[1]
+
+    def set(self, key, storage_url, token, expires=None):
+        if expires is None:
+            expires = time.time() + self.default_ttl
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (storage_url, token, expires)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def stats(self):
+        with self._lock:
+            return {'size': len(self._entries),
+                    'hits': self.hits,
+                    'misses': self.misses,
+                    'evictions': self.evictions}
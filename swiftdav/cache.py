@@ -0,0 +1,133 @@
+# Copyright 2013 Christian Schwede <info@cschwede.de>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# pylint:disable=E1101, C0103
+
+import collections
+import threading
+import time
+
+HEAD = 'head'
+LISTING = 'listing'
+
+
+class MetadataCache(object):
+    """In-process cache for listing pages and HEAD results.
+
+    Keys are (account, container, name, params) tuples as returned by
+    head_key() and listing_key(); account is the storage URL, so accounts
+    never share entries. Listing keys use the prefix as name. Listing pages
+    are kept for `listing_ttl` seconds and HEAD results for `head_ttl`
+    seconds; a TTL of 0 disables caching of that kind. At most `max_size`
+    entries are kept, the least recently used entry is evicted first.
+    """
+
+    def __init__(self, max_size=10000, listing_ttl=5, head_ttl=5):
+        self.max_size = max_size
+        self.ttls = {LISTING: listing_ttl, HEAD: head_ttl}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self._entries = collections.OrderedDict()
+        # (account, container) -> keys, used for invalidation
+        self._index = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def head_key(account, container, name=None):
+        return (account, container, name, HEAD)
+
+    @staticmethod
+    def listing_key(account, container=None, prefix=None, **params):
+        return (account, container, prefix or '',
+                (LISTING,) + tuple(sorted(params.items())))
+
+    @staticmethod
+    def kind(key):
+        return key[3] if key[3] == HEAD else LISTING
+
+    def get(self, key):
+        """Return the cached value or None if missing or expired."""
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is None or entry[1] < time.time():
+                if entry is not None:
+                    self._unindex(key)
+                self.misses += 1
+                return None
+            # Re-insert to mark as most recently used
+            self._entries[key] = entry
+            self.hits += 1
+            return entry[0]
+
+    def set(self, key, value):
+        ttl = self.ttls[self.kind(key)]
+        if not ttl:
+            return
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (value, time.time() + ttl)
+            self._index.setdefault(key[:2], set()).add(key)
+            while len(self._entries) > self.max_size:
+                old, _ = self._entries.popitem(last=False)
+                self._unindex(old)
+                self.evictions += 1
+
+    def _unindex(self, key):
+        keys = self._index.get(key[:2])
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._index[key[:2]]
+
+    def _drop(self, key):
+        if self._entries.pop(key, None) is not None:
+            self._unindex(key)
+            self.invalidations += 1
+
+    def invalidate(self, account, container, name=None, tree=False):
+        """Drop the entries affected by a change of an object or container.
+
+        For an object this is its HEAD result, the HEAD result of its
+        container and all listing pages of the container whose prefix
+        matches the object name. With tree=True name is a prefix whose
+        objects all changed, e.g. after a recursive delete; the HEAD results
+        of these objects and the listing pages below the prefix are dropped
+        as well. Without a name all entries of the container and the account
+        listings are dropped.
+        """
+        with self._lock:
+            keys = list(self._index.get((account, container), ()))
+            if name is None:
+                keys += self._index.get((account, None), ())
+            for key in keys:
+                if name is None or key[2] is None or \
+                        key == self.head_key(account, container, name) or \
+                        (key[3] != HEAD and name.startswith(key[2])) or \
+                        (tree and key[2].startswith(name)):
+                    self._drop(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._index.clear()
+
+    def stats(self):
+        with self._lock:
+            return {'size': len(self._entries),
+                    'hits': self.hits,
+                    'misses': self.misses,
+                    'evictions': self.evictions,
+                    'invalidations': self.invalidations}
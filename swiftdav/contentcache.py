@@ -0,0 +1,313 @@
+# Copyright 2013 Christian Schwede <info@cschwede.de>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# pylint:disable=E1101, C0103
+
+"""On-disk cache for the data of frequently read objects.
+
+Each object is stored in one file: a line with the JSON encoded response
+headers of Swift, followed by the object data. Files are named by the SHA1
+of the storage URL, container and object name and replaced atomically, so
+several processes can share a cache directory.
+
+The cache is only a copy: before an entry is served, its ETag is validated
+with a conditional GET (If-None-Match) to Swift, see
+ObjectCollection.get_download.
+"""
+
+import collections
+import errno
+import hashlib
+import json
+import logging
+import mmap
+import os
+import threading
+import time
+
+# Response headers that are not stored with the object
+UNCACHED_HEADERS = ('connection', 'date', 'transfer-encoding', 'x-trans-id',
+                    'x-openstack-request-id')
+
+# Headers of a 304 response that replace the stored ones; metadata can be
+# changed by a POST without changing the ETag
+UPDATED_HEADERS = ('etag', 'last-modified', 'x-timestamp')
+
+
+class ContentCache(object):
+    """Cache of object data in the directory `path`.
+
+    Objects up to max_object_size bytes are added while they are streamed
+    to the first client, see CacheFill. Only one process fills an entry at
+    a time; the others read from Swift meanwhile. If the entries take more
+    than max_bytes, the least recently used ones are removed.
+
+    Every process accounts the entries it added or used; with several
+    processes the directory can exceed max_bytes until an entry is used by
+    the process that evicts it.
+    """
+
+    # A fill without progress for this many seconds is considered dead
+    fill_timeout = 60
+
+    def __init__(self, path, max_bytes=1024 * 1024 * 1024,
+                 max_object_size=64 * 1024 * 1024):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.max_object_size = max_object_size
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.fills = 0
+        self.evictions = 0
+        self._entries = collections.OrderedDict()  # key -> size
+        self._lock = threading.Lock()
+        self.makedirs(path)
+        self.load()
+
+    @staticmethod
+    def make_key(account, container, name):
+        return hashlib.sha1('\0'.join((account, container, name))).hexdigest()
+
+    def filename(self, key):
+        return os.path.join(self.path, key[:2], key)
+
+    def load(self):
+        """Account the entries found in the directory, oldest first."""
+        found = []
+        for dirpath, _, filenames in os.walk(self.path):
+            for name in filenames:
+                filename = os.path.join(dirpath, name)
+                if name.endswith('.tmp'):
+                    continue
+                try:
+                    stat = os.stat(filename)
+                except OSError:
+                    continue
+                found.append((stat.st_mtime, name, stat.st_size))
+        with self._lock:
+            for _, key, size in sorted(found):
+                self._add(key, size)
+
+    def _add(self, key, size):
+        self.size += size - self._entries.pop(key, 0)
+        self._entries[key] = size
+        while self.size > self.max_bytes and self._entries:
+            old_key, old_size = self._entries.popitem(last=False)
+            self.size -= old_size
+            self.evictions += 1
+            try:
+                os.unlink(self.filename(old_key))
+            except OSError:
+                pass
+
+    def get(self, key):
+        """Return the CachedFile of key, or None."""
+        try:
+            entry = CachedFile(self.filename(key))
+        except (IOError, OSError, ValueError) as ex:
+            if getattr(ex, 'errno', None) != errno.ENOENT:
+                logging.warning('Content cache entry %s unusable: %s', key,
+                                ex)
+            with self._lock:
+                self.misses += 1
+            return None
+        entry.key = key
+        return entry
+
+    def use(self, entry, headers=None):
+        """Mark entry as validated; return its headers.
+
+        headers are the response headers of the conditional GET.
+        """
+        for name in UPDATED_HEADERS:
+            if headers and name in headers:
+                entry.headers[name] = headers[name]
+        try:
+            os.utime(entry.filename, None)
+        except OSError:
+            pass
+        with self._lock:
+            self.hits += 1
+            self._add(entry.key, entry.file_size)
+        return entry.headers
+
+    def discard(self, entry):
+        """Drop entry after Swift returned a different object."""
+        entry.close()
+        with self._lock:
+            self.misses += 1
+
+    def start_fill(self, key, headers):
+        """Return a CacheFill to store the object, or None.
+
+        Returns None if the object can't be cached or another fill of it is
+        running.
+        """
+        try:
+            length = int(headers.get('content-length'))
+        except (TypeError, ValueError):
+            return None
+        if not headers.get('etag') or not 0 < length <= self.max_object_size:
+            return None
+        filename = self.filename(key)
+        tmpname = filename + '.tmp'
+        for _ in range(2):
+            try:
+                fd = os.open(tmpname, os.O_WRONLY | os.O_CREAT | os.O_EXCL,
+                             0o600)
+                break
+            except OSError as ex:
+                if ex.errno == errno.ENOENT:
+                    self.makedirs(os.path.dirname(filename))
+                elif ex.errno != errno.EEXIST or not self.is_stale(tmpname):
+                    return None
+                else:
+                    self.unlink(tmpname)
+        else:
+            return None
+        header = json.dumps(dict((name, value)
+                                 for name, value in headers.items()
+                                 if name not in UNCACHED_HEADERS))
+        fill = CacheFill(self, key, os.fdopen(fd, 'wb'), tmpname, filename,
+                         length)
+        if not fill.write(header + '\n', header=True):
+            return None
+        return fill
+
+    def is_stale(self, tmpname):
+        try:
+            return os.stat(tmpname).st_mtime < time.time() - self.fill_timeout
+        except OSError:
+            return True
+
+    def makedirs(self, dirname):
+        try:
+            os.makedirs(dirname, 0o700)
+        except OSError as ex:
+            if ex.errno != errno.EEXIST:
+                raise
+
+    def unlink(self, filename):
+        try:
+            os.unlink(filename)
+        except OSError:
+            pass
+
+    def added(self, key, size):
+        with self._lock:
+            self.fills += 1
+            self._add(key, size)
+
+    def stats(self):
+        with self._lock:
+            return {'entries': len(self._entries), 'bytes': self.size,
+                    'hits': self.hits, 'misses': self.misses,
+                    'fills': self.fills, 'evictions': self.evictions}
+
+
+class CacheFill(object):
+    """Writes an object to the cache while it is downloaded.
+
+    write() is called with the object data in order; the entry is added
+    when all bytes are written. abort() drops an incomplete entry.
+    """
+
+    def __init__(self, cache, key, fileobj, tmpname, filename, length):
+        self.cache = cache
+        self.key = key
+        self.fileobj = fileobj
+        self.tmpname = tmpname
+        self.filename = filename
+        self.length = length
+        self.written = 0
+        self.done = False
+
+    def write(self, data, header=False):
+        """Write data; return False if the fill was aborted."""
+        if self.done:
+            return False
+        if not header and self.written + len(data) > self.length:
+            self.abort()
+            return False
+        try:
+            self.fileobj.write(data)
+        except (IOError, OSError) as ex:
+            logging.warning('Writing to the content cache failed: %s', ex)
+            self.abort()
+            return False
+        if not header:
+            self.written += len(data)
+            if self.written == self.length:
+                self.commit()
+        return True
+
+    def commit(self):
+        self.done = True
+        try:
+            self.fileobj.close()
+            size = os.path.getsize(self.tmpname)
+            os.rename(self.tmpname, self.filename)
+        except (IOError, OSError) as ex:
+            logging.warning('Adding to the content cache failed: %s', ex)
+            self.cache.unlink(self.tmpname)
+            return
+        self.cache.added(self.key, size)
+
+    def abort(self):
+        if not self.done:
+            self.done = True
+            self.fileobj.close()
+            self.cache.unlink(self.tmpname)
+
+
+class CachedFile(object):
+    """A cached object, a file-like object like DownloadFile.
+
+    The file is mapped into memory, so reads are served from the page cache
+    without a system call each. The file stays readable if the entry is
+    replaced or evicted meanwhile.
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.key = None
+        with open(filename, 'rb') as fileobj:
+            self.headers = dict(
+                (name.encode('utf-8'), value.encode('utf-8'))
+                for name, value in json.loads(fileobj.readline()).items())
+            self.offset = fileobj.tell()
+            self.file_size = os.fstat(fileobj.fileno()).st_size
+            if self.file_size <= self.offset:
+                raise ValueError('Empty cache entry')
+            self.map = mmap.mmap(fileobj.fileno(), 0, access=mmap.ACCESS_READ)
+        self.etag = self.headers.get('etag')
+        self.position = self.offset
+
+    def read(self, size=-1):
+        if self.map is None:
+            raise ValueError('I/O operation on closed file')
+        if size < 0:
+            size = len(self.map)
+        data = self.map[self.position:self.position + size]
+        self.position += len(data)
+        return data
+
+    def seek(self, position):
+        self.position = self.offset + position
+
+    def close(self):
+        if self.map is not None:
+            self.map.close()
+            self.map = None
@@ -0,0 +1,440 @@
+# Copyright 2013 Christian Schwede <info@cschwede.de>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# pylint:disable=E1101, C0103
+
+"""Multi-process launcher for swiftdav (the swiftdav-server command).
+
+The master forks --workers processes serving the same port. If the kernel
+supports SO_REUSEPORT every worker binds its own socket and the kernel
+balances the connections, otherwise the workers share the socket of the
+master. Workers touch a heartbeat file; the master restarts workers that
+exit or stop updating it for --timeout seconds.
+
+Signals to the master:
+
+    SIGHUP          start new workers, then stop the old ones gracefully
+    SIGTERM/SIGINT  stop gracefully, waiting up to --graceful-timeout
+                    seconds for running requests
+
+With --shared-cache the master also runs a CacheServer on this unix socket,
+which holds the token and metadata caches of all workers.
+
+The swiftdav modules are only imported after gevent monkey patched the
+standard library (--gevent), and the WSGI app is created in each worker
+after the fork, so workers never share connections.
+"""
+
+from __future__ import absolute_import
+
+import errno
+import logging
+import optparse
+import os
+import signal
+import socket
+import sys
+import tempfile
+import time
+
+# Exit status of a worker that failed to start; the master gives up then
+WORKER_BOOT_ERROR = 3
+
+# Not defined by the socket module of Python 2
+SO_REUSEPORT = getattr(socket, 'SO_REUSEPORT',
+                       15 if sys.platform.startswith('linux') else None)
+
+
+def parse_bind(value):
+    host, _, port = value.rpartition(':')
+    return host.strip('[]') or '0.0.0.0', int(port)
+
+
+def reuseport_supported():
+    if SO_REUSEPORT is None:
+        return False
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    try:
+        sock.setsockopt(socket.SOL_SOCKET, SO_REUSEPORT, 1)
+        return True
+    except socket.error:
+        return False
+    finally:
+        sock.close()
+
+
+def listen(address, reuseport=False, backlog=1024):
+    family = socket.AF_INET6 if ':' in address[0] else socket.AF_INET
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    if reuseport:
+        sock.setsockopt(socket.SOL_SOCKET, SO_REUSEPORT, 1)
+    sock.bind(address)
+    sock.listen(backlog)
+    return sock
+
+
+def make_app(options):
+    """Return the swiftdav WSGI app configured by the command line options."""
+    from swiftdav import contentcache
+    from swiftdav import metrics
+    from swiftdav import propfind
+    from swiftdav import sharedcache
+    from swiftdav import spool
+    from swiftdav import sqlstore
+    from swiftdav import swiftdav
+    from wsgidav import wsgidav_app
+
+    token_cache = metadata_cache = content_cache = upload_spool = None
+    if options.shared_cache:
+        token_cache = sharedcache.SharedTokenCache(options.shared_cache)
+        metadata_cache = sharedcache.SharedMetadataCache(options.shared_cache)
+    if options.content_cache:
+        content_cache = contentcache.ContentCache(
+            options.content_cache, options.content_cache_size * 1024 * 1024)
+    if options.upload_spool:
+        upload_spool = spool.UploadSpool(
+            options.upload_spool, options.upload_spool_threshold * 1024)
+    provider = swiftdav.SwiftProvider(
+        pool_max_connections=options.max_connections,
+        metadata_cache=metadata_cache,
+        readahead_window=options.readahead,
+        readahead_budget=options.readahead_budget * 1024 * 1024,
+        content_cache=content_cache,
+        upload_spool=upload_spool)
+    domain_controller = swiftdav.WsgiDAVDomainController(
+        options.auth_url, options.insecure,
+        auth_version=options.auth_version, token_cache=token_cache)
+    provider.metrics.add_collector('token_cache',
+                                   domain_controller.token_cache.stats)
+
+    locks_manager = props_manager = True
+    if options.lock_db:
+        locks_manager = sqlstore.SQLiteLockStorage(options.lock_db)
+        props_manager = sqlstore.SQLitePropertyManager(options.lock_db)
+
+    config = wsgidav_app.DEFAULT_CONFIG.copy()
+    config.update({
+        "provider_mapping": {"": provider},
+        "verbose": 1,
+        "propsmanager": props_manager,
+        "locksmanager": locks_manager,
+        "acceptbasic": True,
+        "acceptdigest": False,
+        "defaultdigest": False,
+        "domaincontroller": domain_controller,
+        "block_size": options.block_size,
+        "middleware_stack": [propfind.StreamingPropfind] +
+                            wsgidav_app.DEFAULT_CONFIG["middleware_stack"],
+    })
+    return metrics.MetricsMiddleware(
+        propfind.ConnectionHeaderFilter(wsgidav_app.WsgiDAVApp(config)),
+        provider.metrics, debug=options.debug)
+
+
+class Worker(object):
+    """One serving process; run() does not return."""
+
+    def __init__(self, options, sock, heartbeat):
+        self.options = options
+        self.sock = sock
+        self.heartbeat = heartbeat
+        self.stopping = False
+
+    def notify(self):
+        os.utime(self.heartbeat, None)
+
+    def handle_stop(self, _signum, _frame):
+        self.stopping = True
+
+    def run(self):
+        for signum in (signal.SIGHUP, signal.SIGCHLD):
+            signal.signal(signum, signal.SIG_DFL)
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        status = 0
+        try:
+            if self.sock is None:
+                self.sock = listen(parse_bind(self.options.bind), True)
+            app = make_app(self.options)
+        except Exception:
+            logging.exception('Worker %d failed to start', os.getpid())
+            status = WORKER_BOOT_ERROR
+        else:
+            try:
+                if self.options.gevent:
+                    self.serve_gevent(app)
+                else:
+                    self.serve_waitress(app)
+            except Exception:
+                logging.exception('Worker %d failed', os.getpid())
+                status = 1
+        os._exit(status)
+
+    def serve_waitress(self, app):
+        import waitress
+        import waitress.channel
+
+        signal.signal(signal.SIGTERM, self.handle_stop)
+        server = waitress.create_server(
+            app, sockets=[self.sock], threads=self.options.threads,
+            max_request_body_size=5*1024*1024*1024)
+        while not self.stopping:
+            self.notify()
+            server.asyncore.loop(timeout=1, map=server._map, count=1)
+
+        # Stop accepting and let running requests finish
+        server.close()
+        deadline = time.time() + self.options.graceful_timeout
+        while time.time() < deadline and any(
+                isinstance(channel, waitress.channel.HTTPChannel) and
+                (channel.requests or channel.writable())
+                for channel in server._map.values()):
+            self.notify()
+            server.asyncore.loop(timeout=0.1, map=server._map, count=1)
+        server.task_dispatcher.shutdown(timeout=1)
+
+    def serve_gevent(self, app):
+        import gevent
+        from gevent import pywsgi
+
+        signal.signal(signal.SIGTERM, self.handle_stop)
+        server = pywsgi.WSGIServer(self.sock, app)
+        server.start()
+        while not self.stopping:
+            self.notify()
+            gevent.sleep(1)
+        # Stops accepting, then waits for running requests
+        server.stop(self.options.graceful_timeout)
+
+
+class Arbiter(object):
+    """The master process, which starts and watches the workers."""
+
+    def __init__(self, options):
+        self.options = options
+        self.workers = {}  # pid -> heartbeat file
+        self.retired = {}  # workers stopped by a reload
+        self.cache_server = None
+        self.sock = None
+        self.signals = []
+
+    def handle_signal(self, signum, _frame):
+        self.signals.append(signum)
+
+    def run(self):
+        if self.options.reuseport and not reuseport_supported():
+            logging.warning('SO_REUSEPORT is not supported, the workers '
+                            'share one socket')
+            self.options.reuseport = False
+        if not self.options.reuseport:
+            self.sock = listen(parse_bind(self.options.bind))
+        if self.options.shared_cache:
+            self.start_cache_server()
+        for signum in (signal.SIGHUP, signal.SIGTERM, signal.SIGINT,
+                       signal.SIGCHLD):
+            signal.signal(signum, self.handle_signal)
+        logging.info('Master %d serving %s with %d workers', os.getpid(),
+                     self.options.bind, self.options.workers)
+
+        try:
+            self.spawn_workers()
+            while True:
+                while self.signals:
+                    signum = self.signals.pop(0)
+                    if signum == signal.SIGHUP:
+                        self.reload()
+                    elif signum in (signal.SIGTERM, signal.SIGINT):
+                        return self.stop()
+                if self.reap() == WORKER_BOOT_ERROR:
+                    logging.error('Worker failed to start, exiting')
+                    return self.stop(1)
+                self.check_heartbeats()
+                self.spawn_workers()
+                time.sleep(1)
+        finally:
+            if self.cache_server:
+                self.kill(self.cache_server, signal.SIGTERM)
+                os.unlink(self.options.shared_cache)
+
+    def start_cache_server(self):
+        from swiftdav import sharedcache
+
+        server = sharedcache.CacheServer(self.options.shared_cache)
+        pid = os.fork()
+        if pid == 0:
+            for signum in (signal.SIGHUP, signal.SIGTERM, signal.SIGCHLD):
+                signal.signal(signum, signal.SIG_DFL)
+            signal.signal(signal.SIGINT, signal.SIG_IGN)
+            try:
+                server.serve_forever()
+            finally:
+                os._exit(0)
+        # The socket file is removed by the master when it exits
+        server.socket.close()
+        self.cache_server = pid
+
+    def spawn_workers(self):
+        while len(self.workers) < self.options.workers:
+            fd, heartbeat = tempfile.mkstemp(prefix='swiftdav-worker-')
+            os.close(fd)
+            pid = os.fork()
+            if pid == 0:
+                Worker(self.options, self.sock, heartbeat).run()
+            self.workers[pid] = heartbeat
+            logging.info('Started worker %d', pid)
+
+    def reap(self):
+        """Collect exited workers; return the highest exit status."""
+        worst = 0
+        while True:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except OSError as ex:
+                if ex.errno == errno.ECHILD:
+                    break
+                raise
+            if not pid:
+                break
+            if pid == self.cache_server:
+                logging.error('Shared cache server exited, restarting it')
+                self.start_cache_server()
+                continue
+            heartbeat = self.workers.pop(pid, None) or \
+                self.retired.pop(pid, None)
+            if heartbeat is None:
+                continue
+            os.unlink(heartbeat)
+            code = os.WEXITSTATUS(status) if os.WIFEXITED(status) else 1
+            if code:
+                logging.warning('Worker %d exited with status %d', pid, code)
+            worst = max(worst, code)
+        return worst
+
+    def check_heartbeats(self):
+        now = time.time()
+        for pid, heartbeat in self.workers.items():
+            try:
+                last = os.stat(heartbeat).st_mtime
+            except OSError:
+                continue
+            if now - last > self.options.timeout:
+                logging.error('Worker %d did not respond for %ds, killing it',
+                              pid, now - last)
+                self.kill(pid, signal.SIGKILL)
+
+    @staticmethod
+    def kill(pid, signum):
+        try:
+            os.kill(pid, signum)
+        except OSError as ex:
+            if ex.errno != errno.ESRCH:
+                raise
+
+    def reload(self):
+        """Replace all workers, stopping the old ones gracefully."""
+        logging.info('Reloading workers')
+        self.retired.update(self.workers)
+        self.workers = {}
+        self.spawn_workers()
+        for pid in self.retired:
+            self.kill(pid, signal.SIGTERM)
+
+    def stop(self, status=0):
+        logging.info('Stopping workers')
+        self.retired.update(self.workers)
+        self.workers = {}
+        for pid in self.retired:
+            self.kill(pid, signal.SIGTERM)
+        deadline = time.time() + self.options.graceful_timeout + 1
+        while self.retired and time.time() < deadline:
+            self.reap()
+            time.sleep(0.1)
+        for pid, heartbeat in self.retired.items():
+            self.kill(pid, signal.SIGKILL)
+            os.unlink(heartbeat)
+        return status
+
+
+def main():
+    parser = optparse.OptionParser(usage='%prog [options]')
+    parser.add_option('--bind', default='0.0.0.0:8000',
+                      help='Address to listen on [%default]')
+    parser.add_option('--workers', type='int', default=0,
+                      help='Number of worker processes [number of CPUs]')
+    parser.add_option('--threads', type='int', default=4,
+                      help='Threads per waitress worker [%default]')
+    parser.add_option('--gevent', action='store_true',
+                      help='Serve with gevent instead of waitress')
+    parser.add_option('--no-reuseport', dest='reuseport', default=True,
+                      action='store_false',
+                      help='Share one socket instead of using SO_REUSEPORT')
+    parser.add_option('--auth-url', default='http://127.0.0.1:8080/auth/v1.0',
+                      help='Swift or Keystone auth URL [%default]')
+    parser.add_option('--auth-version', type='int', default=1,
+                      help='1 for tempauth/swauth, 2 for Keystone')
+    parser.add_option('--insecure', action='store_true',
+                      help='Disable SSL certificate validation')
+    parser.add_option('--block-size', type='int', default=1024 * 1024,
+                      help='Size of the blocks object data is read and '
+                           'written in [%default]')
+    parser.add_option('--max-connections', type='int',
+                      help='Concurrent requests per Swift proxy and worker')
+    parser.add_option('--readahead', type='int', default=0, metavar='BLOCKS',
+                      help='Read downloads up to this many 1 MiB blocks '
+                           'ahead of the client [%default]')
+    parser.add_option('--readahead-budget', type='int', default=256,
+                      metavar='MB',
+                      help='Memory for read-ahead blocks per worker '
+                           '[%default]')
+    parser.add_option('--content-cache', metavar='PATH',
+                      help='Cache the data of small objects in PATH')
+    parser.add_option('--content-cache-size', type='int', default=1024,
+                      metavar='MB',
+                      help='Size of the content cache [%default]')
+    parser.add_option('--upload-spool', metavar='PATH',
+                      help='Acknowledge small uploads once spooled in PATH '
+                           'and upload them to Swift in batches')
+    parser.add_option('--upload-spool-threshold', type='int', default=256,
+                      metavar='KB',
+                      help='Largest upload that is spooled [%default]')
+    parser.add_option('--lock-db', metavar='PATH',
+                      help='Store locks and properties in the SQLite '
+                           'database PATH')
+    parser.add_option('--shared-cache', metavar='PATH',
+                      help='Share the caches using a unix socket at PATH')
+    parser.add_option('--timeout', type='int', default=30,
+                      help='Restart workers without heartbeat for this '
+                           'many seconds [%default]')
+    parser.add_option('--graceful-timeout', type='int', default=30,
+                      help='Seconds to wait for running requests when '
+                           'stopping [%default]')
+    parser.add_option('--debug', action='store_true',
+                      help='Log every Swift request and add backend '
+                           'response headers')
+    options, _ = parser.parse_args()
+
+    if options.gevent:
+        from gevent import monkey
+        monkey.patch_all()
+    logging.basicConfig(
+        level=logging.DEBUG if options.debug else logging.INFO,
+        format='%(asctime)s %(process)d %(levelname)s %(message)s')
+    if not options.workers:
+        import multiprocessing
+        options.workers = multiprocessing.cpu_count()
+    sys.exit(Arbiter(options).run())
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,271 @@
+# Copyright 2013 Christian Schwede <info@cschwede.de>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# pylint:disable=E1101, C0103
+
+import bisect
+import logging
+import threading
+import time
+
+# Upper bounds of the latency histogram buckets in seconds
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+# Key of the RequestTrace in the WSGI environ
+TRACE_KEY = 'swiftdav.trace'
+
+METRICS_PATH = '/_metrics'
+
+
+def status_class(status):
+    """Return the status label: '2xx', '4xx' etc. or 'error'.
+
+    Only the class is used to keep the number of time series small.
+    """
+    if not status:
+        return 'error'
+    return '%dxx' % (int(status) // 100)
+
+
+class Histogram(object):
+    """Cumulative latency histogram in the Prometheus sense."""
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(BUCKETS, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self):
+        total = 0
+        for bound, count in zip(BUCKETS + ('+Inf', ), self.counts):
+            total += count
+            yield bound, total
+
+
+class Metrics(object):
+    """Process-wide counters and histograms of Swift and WebDAV requests.
+
+    Backend calls are counted by operation (get_container, put_object, ...)
+    and status class, WebDAV requests by method and status class. Additional
+    gauges, for example the statistics of a cache, can be added with
+    add_collector(). render() returns everything in the Prometheus text
+    format.
+    """
+
+    def __init__(self):
+        self.backend_requests = {}
+        self.backend_latency = {}
+        self.backend_bytes = {}
+        self.requests = {}
+        self.latency = {}
+        self.collectors = []
+        self._lock = threading.Lock()
+
+    def observe_backend(self, operation, status, latency, nbytes=0):
+        with self._lock:
+            key = (operation, status_class(status))
+            self.backend_requests[key] = self.backend_requests.get(key, 0) + 1
+            self.backend_latency.setdefault(
+                operation, Histogram()).observe(latency)
+            self.backend_bytes[operation] = \
+                self.backend_bytes.get(operation, 0) + nbytes
+
+    def observe_request(self, method, status, latency):
+        with self._lock:
+            key = (method, status_class(status))
+            self.requests[key] = self.requests.get(key, 0) + 1
+            self.latency.setdefault(method, Histogram()).observe(latency)
+
+    def add_collector(self, name, stats):
+        """Export the dict returned by stats() as gauges name_<key>."""
+        self.collectors.append((name, stats))
+
+    def render(self):
+        lines = []
+
+        def counter(name, doc, values, labels):
+            lines.append('# HELP %s %s' % (name, doc))
+            lines.append('# TYPE %s counter' % name)
+            for key, value in sorted(values.items()):
+                if not isinstance(key, tuple):
+                    key = (key, )
+                lines.append('%s{%s} %s' % (name, format_labels(labels, key),
+                                            value))
+
+        def histogram(name, doc, values, label):
+            lines.append('# HELP %s %s' % (name, doc))
+            lines.append('# TYPE %s histogram' % name)
+            for key, hist in sorted(values.items()):
+                prefix = '%s="%s"' % (label, escape(key))
+                for bound, count in hist.cumulative():
+                    lines.append('%s_bucket{%s,le="%s"} %d' % (
+                        name, prefix, bound, count))
+                lines.append('%s_sum{%s} %f' % (name, prefix, hist.sum))
+                lines.append('%s_count{%s} %d' % (name, prefix, hist.count))
+
+        with self._lock:
+            counter('swiftdav_backend_requests_total',
+                    'Requests sent to Swift.', self.backend_requests,
+                    ('operation', 'status'))
+            histogram('swiftdav_backend_request_seconds',
+                      'Latency of requests sent to Swift.',
+                      self.backend_latency, 'operation')
+            counter('swiftdav_backend_bytes_total',
+                    'Object data transferred to and from Swift.',
+                    self.backend_bytes, ('operation', ))
+            counter('swiftdav_requests_total', 'WebDAV requests served.',
+                    self.requests, ('method', 'status'))
+            histogram('swiftdav_request_seconds',
+                      'Latency of WebDAV requests.', self.latency, 'method')
+
+        for name, stats in self.collectors:
+            for key, value in sorted(stats().items()):
+                lines.append('# TYPE swiftdav_%s_%s gauge' % (name, key))
+                lines.append('swiftdav_%s_%s %s' % (name, key, value))
+        return '\n'.join(lines) + '\n'
+
+
+def escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"')
+
+
+def format_labels(names, values):
+    return ','.join('%s="%s"' % (name, escape(value))
+                    for name, value in zip(names, values))
+
+
+class RequestTrace(object):
+    """Backend calls made while serving one WebDAV request.
+
+    Calls can be added from several threads, for example by the tree
+    workers of a COPY. Individual calls are only kept if `keep_calls` is
+    set.
+    """
+
+    def __init__(self, keep_calls=False):
+        self.started = time.time()
+        self.count = 0
+        self.time = 0.0
+        self.bytes = 0
+        self.calls = [] if keep_calls else None
+        self._lock = threading.Lock()
+
+    def add(self, operation, status, latency, nbytes=0):
+        with self._lock:
+            self.count += 1
+            self.time += latency
+            self.bytes += nbytes
+            if self.calls is not None:
+                self.calls.append((operation, status, latency, nbytes))
+
+    def headers(self):
+        return [('X-Backend-Calls', str(self.count)),
+                ('X-Backend-Time', '%.6f' % self.time)]
+
+
+def record(environ, operation, started, status, nbytes=0):
+    """Account a finished backend call to the provider and the request.
+
+    started is the time.time() when the call was sent, status the HTTP
+    status of the response or None if no response was received.
+    """
+    latency = time.time() - started
+    registry = getattr(environ.get('wsgidav.provider'), 'metrics', None)
+    if registry is not None:
+        registry.observe_backend(operation, status, latency, nbytes)
+    trace = environ.get(TRACE_KEY)
+    if trace is not None:
+        trace.add(operation, status, latency, nbytes)
+
+
+class MetricsMiddleware(object):
+    """WSGI middleware attaching a RequestTrace to every request.
+
+    When a request is done, a summary with the number and total time of its
+    backend calls is logged and added to the WebDAV request metrics. In
+    debug mode every backend call is logged, and the X-Backend-Calls and
+    X-Backend-Time response headers contain the calls made until the
+    response headers were sent; streamed object data is not included.
+
+    GET /_metrics returns the metrics in the Prometheus text format.
+    """
+
+    def __init__(self, app, metrics, debug=False):
+        self.app = app
+        self.metrics = metrics
+        self.debug = debug
+
+    def __call__(self, environ, start_response):
+        if environ.get('PATH_INFO') == METRICS_PATH and \
+                environ.get('REQUEST_METHOD') in ('GET', 'HEAD'):
+            body = self.metrics.render()
+            start_response('200 OK', [
+                ('Content-Type', 'text/plain; version=0.0.4'),
+                ('Content-Length', str(len(body)))])
+            return [body] if environ['REQUEST_METHOD'] == 'GET' else []
+
+        trace = RequestTrace(keep_calls=self.debug)
+        environ[TRACE_KEY] = trace
+        response = {}
+
+        def traced_start_response(status, headers, exc_info=None):
+            response['status'] = status
+            if self.debug:
+                headers = list(headers) + trace.headers()
+            return start_response(status, headers, exc_info)
+
+        try:
+            result = self.app(environ, traced_start_response)
+        except Exception:
+            response.setdefault('status', '500')
+            self.finish(environ, trace, response)
+            raise
+        return TracedResponse(result,
+                              lambda: self.finish(environ, trace, response))
+
+    def finish(self, environ, trace, response):
+        latency = time.time() - trace.started
+        status = response.get('status', '500').split()[0]
+        method = environ.get('REQUEST_METHOD')
+        self.metrics.observe_request(method, status, latency)
+        logging.info('%s %s %s %.3fs backend_calls=%d backend_time=%.3fs '
+                     'backend_bytes=%d', method, environ.get('PATH_INFO'),
+                     status, latency, trace.count, trace.time, trace.bytes)
+        for operation, backend_status, backend_latency, nbytes in \
+                trace.calls or ():
+            logging.debug('  %s %s %.3fs %d bytes', operation,
+                          backend_status or 'error', backend_latency, nbytes)
+
+
+class TracedResponse(object):
+    """Iterate over a WSGI response and call done() when it is closed."""
+
+    def __init__(self, result, done):
+        self.result = result
+        self.done = done
+
+    def __iter__(self):
+        return iter(self.result)
+
+    def close(self):
+        try:
+            if hasattr(self.result, 'close'):
+                self.result.close()
+        finally:
+            self.done()
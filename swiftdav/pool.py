@@ -0,0 +1,223 @@
+# Copyright 2013 Christian Schwede <info@cschwede.de>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# pylint:disable=E1101, C0103
+
+import httplib
+import select
+import socket
+import ssl
+import threading
+import time
+import urlparse
+import weakref
+
+from swiftclient import client
+
+
+def raw_connection(url, insecure=False):
+    """Return a plain httplib connection for streaming requests."""
+    parsed = urlparse.urlparse(url)
+    if parsed.scheme == "http":
+        return httplib.HTTPConnection(parsed.netloc)
+    elif parsed.scheme == "https":
+        if insecure and hasattr(ssl, '_create_unverified_context'):
+            return httplib.HTTPSConnection(
+                parsed.netloc, context=ssl._create_unverified_context())
+        return httplib.HTTPSConnection(parsed.netloc)
+    raise client.ClientException('Unsupported scheme "%s" in url "%s"'
+                                 % (parsed.scheme, url))
+
+
+def swift_connection(url, insecure=False):
+    """Return a swiftclient connection (the second item of http_conn)."""
+    return client.http_connection(url, insecure=insecure)[1]
+
+
+def is_connected(conn):
+    """Check if the socket of a httplib connection is still usable.
+
+    An idle keep-alive socket must not be readable; if it is, the server
+    either closed it or sent unexpected data.
+    """
+    sock = getattr(conn, 'sock', None)
+    if sock is None:
+        return True  # httplib will connect on the next request
+    try:
+        readable, _, _ = select.select([sock], [], [], 0)
+    except (select.error, socket.error, ValueError):
+        return False
+    return not readable
+
+
+class ConnectionPool(object):
+    """Thread-safe pool of keep-alive connections to one Swift proxy.
+
+    At most `max_size` idle connections are kept; if all of them are in use a
+    new connection is created and closed again when it is returned. Idle
+    connections older than `idle_timeout` seconds or failing the health check
+    are closed instead of being handed out.
+
+    If `max_connections` is set, get() blocks while that many connections
+    are handed out, which bounds the number of concurrent requests to the
+    proxy. Connections are returned with put() or discard(); the slot of a
+    connection that is garbage collected instead, for example by a download
+    the client dropped, is reclaimed within `reclaim_interval` seconds.
+    """
+
+    reclaim_interval = 1
+
+    def __init__(self, create, max_size=16, idle_timeout=60, check=None,
+                 max_connections=None):
+        self.create = create
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.check = check
+        self.max_connections = max_connections
+        self.created = 0
+        self.reused = 0
+        self.in_use = 0
+        self._idle = []
+        self._lock = threading.Lock()
+        self._cond = threading.Condition(self._lock)
+        # Weak references to the connections handed out, and the ones of
+        # collected connections. The weakref callback may run at any time
+        # during garbage collection, so it only appends to _lost.
+        self._out = set()
+        self._lost = []
+
+    def get(self):
+        if not self.max_connections:
+            return self._get()
+        with self._lock:
+            while self._reclaim() >= self.max_connections:
+                self._cond.wait(self.reclaim_interval)
+            self.in_use += 1
+        try:
+            conn = self._get()
+        except Exception:
+            self._release(None)
+            raise
+        with self._lock:
+            self._out.add(weakref.ref(conn, self._lost.append))
+        return conn
+
+    def _reclaim(self):
+        """Free the slots of collected connections; return in_use.
+
+        Must be called with the lock held.
+        """
+        while self._lost:
+            ref = self._lost.pop()
+            if ref in self._out:
+                self._out.remove(ref)
+                self.in_use -= 1
+        return self.in_use
+
+    def _release(self, conn):
+        if not self.max_connections:
+            return
+        with self._lock:
+            if conn is not None:
+                ref = weakref.ref(conn)
+                if ref not in self._out:
+                    return  # not from get(), or returned twice
+                self._out.remove(ref)
+            self.in_use -= 1
+            self._cond.notify()
+
+    def _get(self):
+        now = time.time()
+        while True:
+            with self._lock:
+                if not self._idle:
+                    self.created += 1
+                    break
+                conn, last_used = self._idle.pop()
+            if now - last_used > self.idle_timeout or \
+                    (self.check and not self.check(conn)):
+                self._close(conn)
+                continue
+            with self._lock:
+                self.reused += 1
+            return conn
+        return self.create()
+
+    def put(self, conn):
+        self._release(conn)
+        with self._lock:
+            if len(self._idle) < self.max_size:
+                self._idle.append((conn, time.time()))
+                return
+        self._close(conn)
+
+    def discard(self, conn):
+        """Close a connection from get() that can't be reused."""
+        self._release(conn)
+        self._close(conn)
+
+    @staticmethod
+    def _close(conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn, _ in idle:
+            self._close(conn)
+
+
+class PoolManager(object):
+    """Per-process registry of connection pools keyed by storage URL netloc.
+
+    There are two kinds of pools per netloc: swiftclient connections used for
+    the client.* calls, and raw httplib connections used to stream object
+    data in DownloadFile and UploadFile. `max_connections` limits the
+    connections of each kind in use per netloc, see ConnectionPool.
+    """
+
+    def __init__(self, max_size=16, idle_timeout=60, max_connections=None):
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.max_connections = max_connections
+        self._pools = {}
+        self._lock = threading.Lock()
+
+    def get(self, url, insecure=False, raw=False):
+        parsed = urlparse.urlparse(url)
+        key = (parsed.scheme, parsed.netloc, bool(insecure), raw)
+        with self._lock:
+            pool = self._pools.get(key)
+            if pool is None:
+                base = '%s://%s' % (parsed.scheme, parsed.netloc)
+                if raw:
+                    create = lambda: raw_connection(base, insecure)
+                    check = is_connected
+                else:
+                    create = lambda: swift_connection(base, insecure)
+                    check = None
+                pool = ConnectionPool(create, self.max_size,
+                                      self.idle_timeout, check,
+                                      self.max_connections)
+                self._pools[key] = pool
+            return pool
+
+    def close(self):
+        with self._lock:
+            pools, self._pools = self._pools.values(), {}
+        for pool in pools:
+            pool.close()
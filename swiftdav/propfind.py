@@ -0,0 +1,276 @@
+# Copyright 2013 Christian Schwede <info@cschwede.de>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# pylint:disable=E1101, C0103
+
+"""Streaming PROPFIND responses for SwiftProvider collections.
+
+wsgidav builds the complete multistatus element tree of a PROPFIND before
+sending the first byte. StreamingPropfind renders the <D:response> element of
+each member as soon as its listing page arrives and sends the response in
+chunks, so the memory needed doesn't depend on the number of members. Add it
+as first entry of the wsgidav "middleware_stack":
+
+    config["middleware_stack"] = [propfind.StreamingPropfind] + \\
+        wsgidav_app.DEFAULT_CONFIG["middleware_stack"]
+
+WsgiDAVApp adds a "Connection: close" header to responses without
+Content-Length, which servers like waitress refuse. Wrap WsgiDAVApp in a
+ConnectionHeaderFilter to send the response with chunked encoding instead:
+
+    app = propfind.ConnectionHeaderFilter(wsgidav_app.WsgiDAVApp(config))
+
+Only Depth:1 and Depth:infinity requests for allprop or named properties on
+collections are streamed; requests with conditions (If, If-Match, ...) and
+anything else are passed on to wsgidav.
+"""
+
+from __future__ import absolute_import
+
+import itertools
+from cStringIO import StringIO
+from xml.sax import saxutils
+
+from swiftclient import client
+
+from wsgidav import dav_error
+from wsgidav import util
+from wsgidav import xml_tools
+from wsgidav.middleware import BaseMiddleware
+
+from swiftdav import swiftdav
+
+# The response is sent in chunks of at least this size
+CHUNK_SIZE = 64 * 1024
+
+HEADER = ('<?xml version="1.0" encoding="UTF-8"?>\n'
+          '<D:multistatus xmlns:D="DAV:">')
+FOOTER = '</D:multistatus>'
+RESPONSE = '<D:response><D:href>%s</D:href>%s</D:response>'
+PROPSTAT = ('<D:propstat><D:prop>%s</D:prop>'
+            '<D:status>HTTP/1.1 %s</D:status></D:propstat>')
+OK = '200 OK'
+
+RESOURCETYPE = '{DAV:}resourcetype'
+COLLECTION = '<D:resourcetype><D:collection/></D:resourcetype>'
+NON_COLLECTION = '<D:resourcetype/>'
+LOCKDISCOVERY = '{DAV:}lockdiscovery'
+NO_LOCKS = '<D:lockdiscovery/>'
+SUPPORTEDLOCK = '{DAV:}supportedlock'
+SUPPORTED_LOCKS = (
+    '<D:supportedlock>' +
+    ''.join('<D:lockentry><D:lockscope><D:%s/></D:lockscope>'
+            '<D:locktype><D:write/></D:locktype></D:lockentry>' % scope
+            for scope in ('exclusive', 'shared')) +
+    '</D:supportedlock>')
+
+
+def element(name, text=None):
+    """Return an XML element for a property name in Clark notation."""
+    namespace, localname = util.splitNamespace(name)
+    if namespace == 'DAV:':
+        tag, declaration = 'D:' + localname, ''
+    elif namespace:
+        tag = 'X:' + localname
+        declaration = ' xmlns:X=%s' % saxutils.quoteattr(namespace)
+    else:
+        tag, declaration = localname, ''
+    if text is None:
+        return '<%s%s/>' % (tag, declaration)
+    if isinstance(text, unicode):
+        text = text.encode('utf-8')
+    return '<%s%s>%s</%s>' % (tag, declaration, saxutils.escape(text), tag)
+
+
+def optional(func):
+    return lambda value: func(value) if value is not None else None
+
+
+# Live properties rendered from the resource getters, in the order of
+# wsgidav's getPropertyNames()
+LIVE_PROPERTIES = [
+    ('{DAV:}creationdate', 'getCreationDate', optional(util.getRfc3339Time)),
+    ('{DAV:}getcontentlength', 'getContentLength', optional(str)),
+    ('{DAV:}getcontenttype', 'getContentType', None),
+    ('{DAV:}getlastmodified', 'getLastModified',
+     optional(util.getRfc1123Time)),
+    ('{DAV:}displayname', 'getDisplayName', None),
+    ('{DAV:}getetag', 'getEtag', None),
+]
+LIVE_NAMES = [name for name, _, _ in LIVE_PROPERTIES]
+# name -> (getter, conversion, template)
+TEMPLATES = dict((name, (getter, conversion, element(name, '%s')))
+                 for name, getter, conversion in LIVE_PROPERTIES)
+
+
+def render_response(res, names):
+    """Return the <D:response> element of res.
+
+    names is the list of requested properties in Clark notation, or None
+    for allprop.
+    """
+    provider = res.provider
+    lock_manager = provider.lockManager
+    allprop = names is None
+    if allprop:
+        names = [RESOURCETYPE] + LIVE_NAMES
+        if lock_manager and not res.preventLocking():
+            names.extend((LOCKDISCOVERY, SUPPORTEDLOCK))
+        if provider.propManager:
+            names.extend(provider.propManager.getProperties(res.getRefUrl()))
+    results = {}
+    for name in names:
+        status, xml = OK, None
+        if name == RESOURCETYPE:
+            xml = COLLECTION if res.isCollection else NON_COLLECTION
+        elif name in TEMPLATES:
+            getter, conversion, template = TEMPLATES[name]
+            value = getattr(res, getter)()
+            if conversion is not None:
+                value = conversion(value)
+            if value is None:
+                if allprop:
+                    continue
+                status = dav_error.getHttpStatusString(
+                    dav_error.HTTP_NOT_FOUND)
+            else:
+                if isinstance(value, unicode):
+                    value = value.encode('utf-8')
+                xml = template % saxutils.escape(value)
+        elif name == SUPPORTEDLOCK and lock_manager:
+            xml = SUPPORTED_LOCKS
+        elif name == LOCKDISCOVERY and lock_manager and \
+                not lock_manager.getUrlLockList(res.getRefUrl()):
+            xml = NO_LOCKS
+        else:
+            # Active locks and dead properties
+            try:
+                value = res.getPropertyValue(name)
+                if isinstance(value, basestring):
+                    xml = element(name, value)
+                else:
+                    xml = xml_tools.etree.tostring(value)
+            except Exception as ex:
+                status = dav_error.getHttpStatusString(
+                    dav_error.asDAVError(ex))
+        results.setdefault(status, []).append(xml or element(name))
+    propstats = ''.join(PROPSTAT % (''.join(elements), status)
+                        for status, elements in results.items())
+    return RESPONSE % (saxutils.escape(res.getHref()), propstats)
+
+
+def requested_properties(body):
+    """Return the property names requested by a PROPFIND body.
+
+    Returns None for allprop and raises ValueError for anything not
+    streamed, including invalid requests.
+    """
+    if not body:
+        return None
+    try:
+        root = xml_tools.etree.fromstring(body)
+    except Exception:
+        raise ValueError('Invalid XML')
+    if root.tag != '{DAV:}propfind' or len(root) != 1:
+        raise ValueError('Not a simple propfind request')
+    if root[0].tag == '{DAV:}allprop':
+        return None
+    if root[0].tag == '{DAV:}prop':
+        return [prop.tag for prop in root[0]]
+    raise ValueError('Unsupported propfind request')
+
+
+class StreamingPropfind(BaseMiddleware):
+    """wsgidav middleware streaming PROPFIND responses of collections."""
+
+    def __init__(self, application, config):
+        super(StreamingPropfind, self).__init__(application, config)
+        self.app = application
+
+    def __call__(self, environ, start_response):
+        provider = environ.get('wsgidav.provider')
+        depth = environ.get('HTTP_DEPTH', 'infinity').lower()
+        if environ.get('REQUEST_METHOD') != 'PROPFIND' or \
+                not isinstance(provider, swiftdav.SwiftProvider) or \
+                depth not in ('1', 'infinity') or \
+                any(name in environ for name in swiftdav.CONDITIONS):
+            return self.app(environ, start_response)
+
+        body = self.read_body(environ)
+        try:
+            names = requested_properties(body)
+        except ValueError:
+            return self.app(environ, start_response)
+        res = provider.getResourceInst(environ['PATH_INFO'], environ)
+        if res is None or not res.isCollection:
+            return self.app(environ, start_response)
+
+        if depth == 'infinity':
+            members = res.getDescendants(depth='infinity', addSelf=True)
+        else:
+            members = itertools.chain([res], res.iter_members())
+        members = iter(members)
+        try:
+            # Fail before the status is sent if the listing fails
+            first = list(itertools.islice(members, 2))
+        except client.ClientException as ex:
+            raise swiftdav.as_dav_error(ex)
+        start_response('207 Multi-Status', [
+            ('Content-Type', 'application/xml'),
+            ('Date', util.getRfc1123Time())])
+        return self.stream(itertools.chain(first, members), names)
+
+    @staticmethod
+    def read_body(environ):
+        """Read the request body; wsgi.input is replaced to read it again."""
+        try:
+            length = int(environ.get('CONTENT_LENGTH') or 0)
+        except ValueError:
+            length = 0
+        body = environ['wsgi.input'].read(length) if length > 0 else ''
+        environ['wsgi.input'] = StringIO(body)
+        return body
+
+    @staticmethod
+    def stream(members, names):
+        chunk = [HEADER]
+        size = len(HEADER)
+        for res in members:
+            response = render_response(res, names)
+            chunk.append(response)
+            size += len(response)
+            if size >= CHUNK_SIZE:
+                yield ''.join(chunk)
+                chunk = []
+                size = 0
+        chunk.append(FOOTER)
+        yield ''.join(chunk)
+
+
+class ConnectionHeaderFilter(object):
+    """WSGI middleware removing the Connection header of responses.
+
+    Connection is a hop-by-hop header managed by the server, which closes
+    the connection or uses chunked encoding if the length is unknown.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    def __call__(self, environ, start_response):
+        def filtered_start_response(status, headers, exc_info=None):
+            headers = [(name, value) for name, value in headers
+                       if name.lower() != 'connection']
+            return start_response(status, headers, exc_info)
+        return self.app(environ, filtered_start_response)
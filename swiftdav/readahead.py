@@ -0,0 +1,157 @@
+# Copyright 2013 Christian Schwede <info@cschwede.de>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# pylint:disable=E1101, C0103
+
+import logging
+import threading
+
+
+class Budget(object):
+    """Limit for the bytes buffered by all read-aheads of a process."""
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.used = 0
+        self._lock = threading.Lock()
+
+    def try_acquire(self, size):
+        with self._lock:
+            if self.used + size > self.max_bytes:
+                return False
+            self.used += size
+            return True
+
+    def release(self, size):
+        with self._lock:
+            self.used -= size
+
+
+class Prefetcher(object):
+    """Fetch the blocks of a download ahead of the reader.
+
+    fetch(index) returns block number index; an empty block marks the end.
+    `workers` threads fetch the blocks following the last block read, at
+    most `window` blocks ahead. With one worker the blocks are fetched in
+    order, so fetch() may read them from one stream.
+
+    Every block fetched ahead takes `block_size` bytes of the budget; when
+    it is exhausted, only the block the reader waits for is fetched. If
+    fetch() fails, get() raises its exception once the blocks before it
+    are read.
+    """
+
+    wait_interval = 0.1
+
+    def __init__(self, fetch, block_size, window, workers=1, budget=None,
+                 count=None):
+        self.fetch = fetch
+        self.block_size = block_size
+        self.window = max(window, 1)
+        self.budget = budget
+        self.next_fetch = 0
+        self.next_read = 0
+        # Number of blocks, if known in advance
+        self.end = count
+        self.blocks = {}  # index -> (data, charged)
+        self.error = None
+        self.stopped = False
+        self._cond = threading.Condition()
+        self.threads = []
+        for _ in range(workers):
+            thread = threading.Thread(target=self._worker)
+            thread.daemon = True
+            thread.start()
+            self.threads.append(thread)
+
+    def _next_index(self):
+        """Reserve the next block to fetch; return (index, charged)."""
+        with self._cond:
+            while True:
+                if self.stopped or self.error is not None or \
+                        (self.end is not None and self.next_fetch >= self.end):
+                    return None, False
+                index = self.next_fetch
+                if index - self.next_read < self.window:
+                    if index == self.next_read:
+                        # The reader waits for this one, fetch it anyway
+                        charged = self.budget is not None and \
+                            self.budget.try_acquire(self.block_size)
+                        break
+                    if self.budget is None or \
+                            self.budget.try_acquire(self.block_size):
+                        charged = self.budget is not None
+                        break
+                self._cond.wait(self.wait_interval)
+            self.next_fetch += 1
+            return index, charged
+
+    def _worker(self):
+        while True:
+            index, charged = self._next_index()
+            if index is None:
+                return
+            try:
+                data = self.fetch(index)
+            except Exception as ex:
+                logging.debug('Read-ahead of block %d failed: %s', index, ex)
+                with self._cond:
+                    if self.error is None or index < self.error[0]:
+                        self.error = (index, ex)
+                    self._cond.notify_all()
+                self._uncharge(charged)
+                return
+            with self._cond:
+                if self.stopped:
+                    self._uncharge(charged)
+                    return
+                self.blocks[index] = (data, charged)
+                if not data and (self.end is None or index < self.end):
+                    self.end = index
+                self._cond.notify_all()
+
+    def _uncharge(self, charged):
+        if charged:
+            self.budget.release(self.block_size)
+
+    def get(self):
+        """Return the next block, or '' at the end."""
+        with self._cond:
+            while True:
+                index = self.next_read
+                if index in self.blocks:
+                    data, charged = self.blocks.pop(index)
+                    self.next_read += 1
+                    self._cond.notify_all()
+                    break
+                if self.error is not None and self.error[0] <= index:
+                    raise self.error[1]
+                if self.end is not None and index >= self.end:
+                    return ''
+                self._cond.wait(self.wait_interval)
+        self._uncharge(charged)
+        return data
+
+    def close(self, timeout=1):
+        """Stop fetching; return False if a fetch() is still running."""
+        with self._cond:
+            self.stopped = True
+            blocks, self.blocks = self.blocks, {}
+            self._cond.notify_all()
+        for _, charged in blocks.values():
+            self._uncharge(charged)
+        for thread in self.threads:
+            if thread is not threading.current_thread():
+                thread.join(timeout)
+        return not any(thread.is_alive() for thread in self.threads)
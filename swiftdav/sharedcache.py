@@ -0,0 +1,187 @@
+# Copyright 2013 Christian Schwede <info@cschwede.de>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# pylint:disable=E1101, C0103
+
+"""Token and metadata caches shared by the processes of one host.
+
+CacheServer keeps a TokenCache and a MetadataCache and serves them on a unix
+socket; SharedTokenCache and SharedMetadataCache have the interface of the
+local caches and forward every call to the server. Requests and responses
+are marshalled tuples with a length prefix, so only plain data (strings,
+numbers, tuples, lists and dicts) can be stored. The socket is only
+accessible by its owner.
+"""
+
+from __future__ import absolute_import
+
+import logging
+import marshal
+import os
+import socket
+import SocketServer
+import struct
+
+from swiftdav import auth
+from swiftdav import cache
+from swiftdav import pool
+
+HEADER = struct.Struct('!I')
+
+# Methods of the caches that can be called remotely
+METHODS = ('get', 'set', 'invalidate', 'clear', 'stats')
+
+
+def send_message(sock, value):
+    data = marshal.dumps(value)
+    sock.sendall(HEADER.pack(len(data)) + data)
+
+
+def recv_exactly(sock, size):
+    chunks = []
+    while size:
+        data = sock.recv(size)
+        if not data:
+            raise EOFError('Connection closed')
+        chunks.append(data)
+        size -= len(data)
+    return ''.join(chunks)
+
+
+def recv_message(sock):
+    size, = HEADER.unpack(recv_exactly(sock, HEADER.size))
+    return marshal.loads(recv_exactly(sock, size))
+
+
+class CacheRequestHandler(SocketServer.BaseRequestHandler):
+    def handle(self):
+        while True:
+            try:
+                name, method, args = recv_message(self.request)
+            except (EOFError, socket.error):
+                return
+            except (ValueError, TypeError) as ex:
+                logging.warning('Invalid shared cache request: %s', ex)
+                return
+            target = self.server.caches.get(name)
+            if target is None or method not in METHODS:
+                send_message(self.request,
+                             (False, 'Unknown method %s.%s' % (name, method)))
+                continue
+            try:
+                result = getattr(target, method)(*args)
+            except Exception as ex:
+                send_message(self.request, (False, str(ex)))
+            else:
+                send_message(self.request, (True, result))
+
+
+class CacheServer(SocketServer.ThreadingMixIn, SocketServer.UnixStreamServer):
+    """Serve a TokenCache and a MetadataCache on the unix socket `path`."""
+
+    daemon_threads = True
+
+    def __init__(self, path, token_cache=None, metadata_cache=None):
+        if os.path.exists(path):
+            os.unlink(path)
+        old_umask = os.umask(0o077)
+        try:
+            SocketServer.UnixStreamServer.__init__(self, path,
+                                                   CacheRequestHandler)
+        finally:
+            os.umask(old_umask)
+        self.caches = {
+            SharedTokenCache.name: token_cache or auth.TokenCache(),
+            SharedMetadataCache.name:
+                metadata_cache or cache.MetadataCache()}
+
+    def server_close(self):
+        SocketServer.UnixStreamServer.server_close(self)
+        try:
+            os.unlink(self.server_address)
+        except OSError:
+            pass
+
+
+def unix_connection(path, timeout=1):
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.settimeout(timeout)
+    sock.connect(path)
+    return sock
+
+
+class SharedCache(object):
+    """Client for one of the caches of a CacheServer.
+
+    Connections to the server are pooled. If the server can't be reached,
+    get() returns None and other calls do nothing, so swiftdav keeps working
+    without a cache.
+    """
+
+    name = None
+
+    def __init__(self, path, timeout=1, pool_size=16):
+        self.path = path
+        self.conn_pool = pool.ConnectionPool(
+            lambda: unix_connection(path, timeout), pool_size)
+
+    def call(self, method, *args):
+        try:
+            conn = self.conn_pool.get()
+        except socket.error as ex:
+            logging.warning('Shared cache %s not available: %s', self.path,
+                            ex)
+            return None
+        try:
+            send_message(conn, (self.name, method, args))
+            ok, result = recv_message(conn)
+        except (EOFError, ValueError, socket.error) as ex:
+            self.conn_pool.discard(conn)
+            logging.warning('Shared cache %s failed: %s', self.path, ex)
+            return None
+        self.conn_pool.put(conn)
+        if not ok:
+            logging.warning('Shared cache %s failed: %s', self.path, result)
+            return None
+        return result
+
+    def get(self, key):
+        return self.call('get', key)
+
+    def set(self, key, *args):
+        self.call('set', key, *args)
+
+    def invalidate(self, *args):
+        self.call('invalidate', *args)
+
+    def clear(self):
+        self.call('clear')
+
+    def stats(self):
+        return self.call('stats') or {}
+
+
+class SharedTokenCache(SharedCache):
+    """TokenCache stored in a CacheServer."""
+
+    name = 'token'
+    make_key = staticmethod(auth.TokenCache.make_key)
+
+
+class SharedMetadataCache(SharedCache):
+    """MetadataCache stored in a CacheServer."""
+
+    name = 'metadata'
+    head_key = staticmethod(cache.MetadataCache.head_key)
+    listing_key = staticmethod(cache.MetadataCache.listing_key)
@@ -0,0 +1,566 @@
+# Copyright 2013 Christian Schwede <info@cschwede.de>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# pylint:disable=E1101, C0103
+
+"""Write-behind spool for small uploads.
+
+A PUT of a small object is answered as soon as the object is written to a
+file in the spool directory and synced to disk. A background thread
+uploads the spooled objects in batches, each batch with one bulk
+extract-archive request (or parallel PUTs), see swiftdav.upload_spooled.
+
+Each object is stored in one file like in the content cache: a line with
+the JSON encoded account, container, name and response headers, followed
+by the object data. Files are named by the SHA1 of the storage URL,
+container and object name, so a new upload of an object replaces the
+spooled one. While a batch is uploaded, its files are renamed to
+"<key>.flushing"; a newer upload of the same object waits in "<key>" until
+the running upload is done, so uploads reach Swift in order. Objects Swift
+refuses permanently (e.g. because of a quota) were already acknowledged to
+the client; they are moved to the "failed" directory of the spool instead
+of being deleted.
+
+Several processes can share the spool directory; renames in it are
+serialized by a lock file. Objects are only uploaded by processes that
+served a request of the account recently, as the upload needs its token.
+"""
+
+import collections
+import contextlib
+import errno
+import fcntl
+import hashlib
+import json
+import logging
+import mimetypes
+import os
+import tempfile
+import threading
+import time
+
+from wsgidav import dav_error
+from wsgidav import util
+
+FLUSHING = '.flushing'
+FAILED = 'failed'
+
+
+def guess_type(name):
+    """Return the content type Swift sets for an upload without one."""
+    return mimetypes.guess_type(name)[0] or 'application/octet-stream'
+
+
+class SpoolEntry(object):
+    """A spooled object; data is only read for the upload."""
+
+    __slots__ = ('key', 'storage_url', 'container', 'name', 'headers',
+                 'spooled', 'data')
+
+    def __init__(self, key, storage_url, container, name, headers, spooled,
+                 data=None):
+        self.key = key
+        self.storage_url = storage_url
+        self.container = container
+        self.name = name
+        self.headers = headers
+        self.spooled = spooled
+        self.data = data
+
+    @classmethod
+    def read(cls, key, filename, with_data=False):
+        with open(filename, 'rb') as fileobj:
+            meta = json.loads(fileobj.readline())
+            data = fileobj.read() if with_data else None
+        utf8 = lambda value: value.encode('utf-8')
+        return cls(key, utf8(meta['account']), utf8(meta['container']),
+                   utf8(meta['name']),
+                   dict((utf8(name), utf8(value))
+                        for name, value in meta['headers'].items()),
+                   meta['spooled'], data)
+
+
+class SpooledFile(object):
+    """A spooled object, a file-like object like DownloadFile."""
+
+    def __init__(self, entry):
+        self.headers = entry.headers
+        self.data = entry.data
+        self.position = 0
+
+    def read(self, size=-1):
+        if self.data is None:
+            raise ValueError('I/O operation on closed file')
+        if size < 0:
+            size = len(self.data)
+        data = self.data[self.position:self.position + size]
+        self.position += len(data)
+        return data
+
+    def seek(self, position):
+        self.position = position
+
+    def close(self):
+        self.data = None
+
+
+class SpoolWriter(object):
+    """The file-like object returned by beginWrite for spooled uploads.
+
+    The data is kept in memory and spooled by close(), unless it has fewer
+    or more bytes than length or its MD5 differs from etag (the
+    Content-MD5 of the client).
+    """
+
+    def __init__(self, spool, storage_url, container, name, length=None,
+                 etag=None):
+        self.spool = spool
+        self.storage_url = storage_url
+        self.container = container
+        self.name = name
+        self.length = length
+        self.etag = etag
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(data)
+
+    def close(self):
+        if self.chunks is None:
+            return
+        chunks, self.chunks = self.chunks, None
+        data = ''.join(chunks)
+        if self.length is not None and len(data) != self.length:
+            raise dav_error.DAVError(
+                dav_error.HTTP_BAD_REQUEST,
+                'Upload incomplete: received %d of %d bytes' % (
+                    len(data), self.length))
+        etag = hashlib.md5(data).hexdigest()
+        if self.etag and etag != self.etag:
+            raise dav_error.DAVError(dav_error.HTTP_BAD_REQUEST,
+                                     'Content-MD5 mismatch')
+        self.spool.add(self.storage_url, self.container, self.name, data,
+                       etag)
+
+    def abort(self):
+        self.chunks = None
+
+
+class UploadSpool(object):
+    """Write-behind spool in the directory `path`.
+
+    Uploads of at most max_object_size bytes are spooled. Every
+    flush_interval seconds, spooled objects are uploaded in batches of at
+    most batch_size objects and batch_bytes bytes. Objects failing with a
+    client error (4xx except 401, 408 and 429) are moved to the failed
+    directory (see keep_failed()), others are retried in the next round.
+    """
+
+    # A flushing entry older than this many seconds is considered dead
+    flush_timeout = 300
+    # Seconds between the checks of discard() for a running upload
+    poll_interval = 0.05
+
+    def __init__(self, path, max_object_size=256 * 1024, batch_size=1000,
+                 batch_bytes=16 * 1024 * 1024, flush_interval=1.0):
+        self.path = path
+        self.max_object_size = max_object_size
+        self.batch_size = batch_size
+        self.batch_bytes = batch_bytes
+        self.flush_interval = flush_interval
+        self.spooled = 0
+        self.flushed = 0
+        self.failed = 0
+        self.batches = 0
+        # Environ of the last request of each account: storage URL ->
+        # dict with the provider, storage URL and token
+        self.accounts = {}
+        # Entries found by the last scan and added since: key -> SpoolEntry
+        self._entries = {}
+        self._lock = threading.Lock()
+        self._thread = None
+        self.makedirs(path)
+        self._lockfile = open(os.path.join(path, '.lock'), 'a')
+
+    @staticmethod
+    def make_key(account, container, name):
+        return hashlib.sha1('\0'.join((account, container, name))).hexdigest()
+
+    def filename(self, key):
+        return os.path.join(self.path, key[:2], key)
+
+    @contextlib.contextmanager
+    def locked(self):
+        """Serialize renames with other threads and processes."""
+        with self._lock:
+            fcntl.flock(self._lockfile, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(self._lockfile, fcntl.LOCK_UN)
+
+    def accepts(self, content_length):
+        """Return True if an upload of content_length bytes is spooled."""
+        try:
+            return 0 <= int(content_length) <= self.max_object_size
+        except (TypeError, ValueError):
+            return False
+
+    def open(self, storage_url, container, name, length=None, etag=None):
+        return SpoolWriter(self, storage_url, container, name, length, etag)
+
+    def add(self, storage_url, container, name, data, etag=None):
+        """Store an object durably; it replaces a spooled older version.
+
+        etag is the MD5 of data if already known.
+        """
+        now = time.time()
+        headers = {'content-type': guess_type(name),
+                   'content-length': str(len(data)),
+                   'etag': etag or hashlib.md5(data).hexdigest(),
+                   'last-modified': util.getRfc1123Time(now),
+                   'x-timestamp': '%.5f' % now}
+        key = self.make_key(storage_url, container, name)
+        filename = self.filename(key)
+        dirname = os.path.dirname(filename)
+        self.makedirs(dirname)
+        fd, tmpname = tempfile.mkstemp(dir=dirname, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as fileobj:
+                fileobj.write(json.dumps({
+                    'account': storage_url, 'container': container,
+                    'name': name, 'headers': headers, 'spooled': now}))
+                fileobj.write('\n')
+                fileobj.write(data)
+                fileobj.flush()
+                os.fsync(fileobj.fileno())
+            with self.locked():
+                os.rename(tmpname, filename)
+                self._entries[key] = SpoolEntry(key, storage_url, container,
+                                                name, headers, now)
+                self.spooled += 1
+        except BaseException:
+            self.unlink(tmpname)
+            raise
+        self.sync_dir(dirname)
+        return headers
+
+    def get(self, storage_url, container, name):
+        """Return a SpooledFile of the object, or None if not spooled."""
+        key = self.make_key(storage_url, container, name)
+        filename = self.filename(key)
+        # A waiting upload is newer than a flushing one
+        for candidate in (filename, filename + FLUSHING):
+            try:
+                return SpooledFile(SpoolEntry.read(key, candidate, True))
+            except (IOError, OSError) as ex:
+                if ex.errno != errno.ENOENT:
+                    logging.warning('Spooled object %s unreadable: %s',
+                                    candidate, ex)
+            except (ValueError, KeyError) as ex:
+                logging.warning('Spooled object %s unreadable: %s',
+                                candidate, ex)
+        return None
+
+    def listing(self, storage_url, container, prefix=''):
+        """Return the entries of spooled objects below prefix.
+
+        Entries spooled by other processes are included once the spool
+        was scanned after they were added.
+        """
+        with self._lock:
+            return [entry for entry in self._entries.values()
+                    if entry.storage_url == storage_url and
+                    entry.container == container and
+                    entry.name.startswith(prefix)]
+
+    def discard(self, storage_url, container, name, tree=False):
+        """Drop spooled versions of an object before it is overwritten or
+        deleted.
+
+        With tree=True all objects below the prefix name are dropped.
+        Returns once running uploads of them are done.
+        """
+        if tree:
+            keys = [entry.key for entry in
+                    self.listing(storage_url, container, name)]
+        else:
+            keys = [self.make_key(storage_url, container, name)]
+        for key in keys:
+            filename = self.filename(key)
+            with self.locked():
+                self.unlink(filename)
+                self._entries.pop(key, None)
+            self.wait(filename + FLUSHING)
+
+    def wait(self, flushing):
+        while os.path.exists(flushing) and not self.is_stale(flushing):
+            time.sleep(self.poll_interval)
+
+    def scan(self):
+        """Read the headers of all spooled objects, oldest first.
+
+        Returns a list of (entry, flushing) tuples.
+        """
+        found = []
+        for dirpath, dirnames, filenames in os.walk(self.path):
+            if dirpath == self.path and FAILED in dirnames:
+                dirnames.remove(FAILED)
+            for name in filenames:
+                if name.startswith('.') or name.endswith('.tmp'):
+                    continue
+                flushing = name.endswith(FLUSHING)
+                key = name[:-len(FLUSHING)] if flushing else name
+                filename = os.path.join(dirpath, name)
+                try:
+                    entry = SpoolEntry.read(key, filename)
+                except (IOError, OSError, ValueError, KeyError):
+                    continue
+                if flushing and self.is_stale(filename):
+                    self.release(entry, False)
+                    flushing = False
+                found.append((entry, flushing))
+        found.sort(key=lambda item: item[0].spooled)
+        entries = {}
+        for entry, _ in found:
+            entries.setdefault(entry.key, entry)
+        with self._lock:
+            self._entries = entries
+        return found
+
+    def claim(self, entry):
+        """Mark a spooled object as flushing; return it with its data.
+
+        Returns None if the object is gone or an upload of it is running.
+        """
+        filename = self.filename(entry.key)
+        with self.locked():
+            if os.path.exists(filename + FLUSHING):
+                return None
+            try:
+                os.rename(filename, filename + FLUSHING)
+                # The age of a flushing entry is the time of its claim
+                os.utime(filename + FLUSHING, None)
+            except OSError:
+                self._entries.pop(entry.key, None)
+                return None
+        try:
+            return SpoolEntry.read(entry.key, filename + FLUSHING, True)
+        except (IOError, OSError, ValueError, KeyError) as ex:
+            logging.warning('Spooled object %s unreadable: %s', filename, ex)
+            self.unlink(filename + FLUSHING)
+            return None
+
+    def release(self, entry, done):
+        """End the upload of a claimed object.
+
+        If it is not done, the object is spooled again unless a newer
+        version was spooled meanwhile.
+        """
+        filename = self.filename(entry.key)
+        with self.locked():
+            if done or os.path.exists(filename):
+                self.unlink(filename + FLUSHING)
+                if not os.path.exists(filename):
+                    self._entries.pop(entry.key, None)
+            else:
+                try:
+                    os.rename(filename + FLUSHING, filename)
+                except OSError:
+                    pass
+
+    def keep_failed(self, entry):
+        """End the upload of a claimed object that Swift refused.
+
+        The file is kept in the failed directory as "<key>-<spooled>", so
+        the data acknowledged to the client can be recovered. Returns the
+        new file name.
+        """
+        filename = self.filename(entry.key)
+        dirname = os.path.join(self.path, FAILED)
+        failed = os.path.join(dirname, '%s-%.5f' % (entry.key, entry.spooled))
+        self.makedirs(dirname)
+        with self.locked():
+            os.rename(filename + FLUSHING, failed)
+            if not os.path.exists(filename):
+                self._entries.pop(entry.key, None)
+        self.sync_dir(dirname)
+        return failed
+
+    def remember(self, environ):
+        """Keep the credentials of a request to upload its account."""
+        storage_url = environ.get('swift_storage_url')
+        with self._lock:
+            self.accounts[storage_url] = {
+                'wsgidav.provider': environ.get('wsgidav.provider'),
+                'swift_storage_url': storage_url,
+                'swift_auth_token': environ.get('swift_auth_token'),
+                'insecure': environ.get('insecure')}
+
+    def flush(self, environ, uploader, container=None, prefix=None):
+        """Upload the spooled objects of the account of environ.
+
+        Only objects in container and below prefix are uploaded if given;
+        the call returns once running uploads of these are done as well.
+        uploader(environ, container, entries) uploads a batch of one
+        container and returns a list of (entry, HTTP status or None) tuples
+        for the failed objects. Returns the number of failed objects.
+        """
+        if container is None:
+            return self.flush_entries(environ, uploader, self.scan())
+        found = [(entry, False) for entry in self.listing(
+            environ.get('swift_storage_url'), container, prefix or '')]
+        running = []
+        failed = self.flush_entries(environ, uploader, found, running)
+        for entry in running:
+            self.wait(self.filename(entry.key) + FLUSHING)
+        return failed
+
+    def flush_entries(self, environ, uploader, found, running=None):
+        """Upload the entries of the account of environ in found.
+
+        found is a list of (entry, flushing) tuples like returned by
+        scan(). Entries with a running upload are appended to running.
+        """
+        storage_url = environ.get('swift_storage_url')
+        batches = collections.defaultdict(list)
+        if running is None:
+            running = []
+        for entry, flushing in found:
+            if entry.storage_url != storage_url:
+                continue
+            if flushing:
+                running.append(entry)
+            else:
+                batches[entry.container].append(entry)
+        failed = 0
+        for name, entries in batches.items():
+            batch, size = [], 0
+            for entry in entries:
+                claimed = self.claim(entry)
+                if claimed is None:
+                    running.append(entry)
+                    continue
+                batch.append(claimed)
+                size += len(claimed.data)
+                if len(batch) >= self.batch_size or size >= self.batch_bytes:
+                    failed += self.upload(environ, uploader, name, batch)
+                    batch, size = [], 0
+            if batch:
+                failed += self.upload(environ, uploader, name, batch)
+        return failed
+
+    def upload(self, environ, uploader, container, batch):
+        try:
+            failures = uploader(environ, container, batch)
+        except Exception as ex:
+            logging.warning('Uploading %d spooled objects to %s failed: %s',
+                            len(batch), container, ex)
+            failures = [(entry, getattr(ex, 'http_status', None))
+                        for entry in batch]
+        failed = dict((entry.key, status) for entry, status in failures)
+        refused = 0
+        for entry in batch:
+            if entry.key not in failed:
+                self.release(entry, True)
+                continue
+            status = failed[entry.key]
+            if status is None or not 400 <= status < 500 or \
+                    status in (401, 408, 429):
+                self.release(entry, False)
+                continue
+            try:
+                kept = self.keep_failed(entry)
+            except OSError as ex:
+                # Retry it rather than losing it
+                logging.error('Moving refused spooled object /%s/%s to %s '
+                              'failed: %s', container, entry.name, FAILED, ex)
+                self.release(entry, False)
+                continue
+            logging.error('Upload of spooled object /%s/%s refused with '
+                          'status %s, kept in %s', container, entry.name,
+                          status, kept)
+            refused += 1
+        if any(status == 401 for status in failed.values()):
+            # The token expired; wait for a new one
+            with self._lock:
+                if self.accounts.get(environ.get('swift_storage_url')) is \
+                        environ:
+                    del self.accounts[environ.get('swift_storage_url')]
+        with self._lock:
+            self.batches += 1
+            self.flushed += len(batch) - len(failed)
+            self.failed += refused
+        return len(failed) - refused
+
+    def start(self, uploader):
+        """Start the thread uploading spooled objects with uploader."""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self.run,
+                                            args=(uploader, ))
+            self._thread.daemon = True
+            self._thread.start()
+
+    def run(self, uploader):
+        while True:
+            time.sleep(self.flush_interval)
+            try:
+                found = self.scan()
+                with self._lock:
+                    accounts = self.accounts.values()
+                for environ in accounts:
+                    self.flush_entries(environ, uploader, found)
+            except Exception:
+                logging.exception('Flushing the upload spool failed')
+
+    def is_stale(self, filename):
+        try:
+            return os.stat(filename).st_mtime < \
+                time.time() - self.flush_timeout
+        except OSError:
+            return True
+
+    def makedirs(self, dirname):
+        try:
+            os.makedirs(dirname, 0o700)
+        except OSError as ex:
+            if ex.errno != errno.EEXIST:
+                raise
+
+    @staticmethod
+    def sync_dir(dirname):
+        """Make a rename in dirname durable."""
+        fd = os.open(dirname, os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    def unlink(self, filename):
+        try:
+            os.unlink(filename)
+        except OSError:
+            pass
+
+    def stats(self):
+        with self._lock:
+            entries = self._entries.values()
+            oldest = min([entry.spooled for entry in entries] or [None])
+            return {'pending': len(entries),
+                    'pending_bytes': sum(
+                        int(entry.headers.get('content-length', 0))
+                        for entry in entries),
+                    'lag_seconds': time.time() - oldest if oldest else 0,
+                    'spooled': self.spooled, 'flushed': self.flushed,
+                    'failed': self.failed, 'batches': self.batches}
@@ -0,0 +1,363 @@
+# Copyright 2013 Christian Schwede <info@cschwede.de>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# pylint:disable=E1101, C0103
+
+"""Lock storage and property manager for wsgidav backed by SQLite.
+
+Unlike the in-memory defaults of wsgidav, locks and dead properties are
+kept across restarts and shared by all processes using the same database
+file. The database uses write-ahead logging, so readers don't block each
+other or the writer. Paths are indexed, lookups of all paths below a
+collection are range queries on the index.
+
+Use an SQLiteLockStorage as "locksmanager" and an SQLitePropertyManager as
+"propsmanager" in the wsgidav config; both can share one file.
+
+wsgidav serializes checking for conflicting locks and creating a lock only
+within one process. SQLiteLockStorage.create() checks again and inserts the
+lock in one transaction holding the write lock of the database, so processes
+sharing the file never grant conflicting locks.
+"""
+
+import contextlib
+import json
+import logging
+import sqlite3
+import threading
+import time
+
+from wsgidav import dav_error
+from wsgidav import lock_manager
+
+
+def child_range(path):
+    """Return the bounds of the paths below path for a range query."""
+    path = path.rstrip('/')
+    # '0' is the character following '/'
+    return path + '/', path + '0'
+
+
+def utf8_values(value):
+    """Convert the unicode strings of a decoded JSON value to str."""
+    if isinstance(value, unicode):
+        return value.encode('utf-8')
+    if isinstance(value, dict):
+        return dict((utf8_values(k), utf8_values(v))
+                    for k, v in value.items())
+    return value
+
+
+class Database(object):
+    """One SQLite database file, with a connection per thread."""
+
+    def __init__(self, path, schema, timeout=10):
+        self.path = path
+        self.timeout = timeout
+        self._local = threading.local()
+        self.connection().executescript(schema)
+
+    def connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=self.timeout,
+                                   isolation_level=None)
+            conn.text_factory = str
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    def execute(self, sql, args=()):
+        return self.connection().execute(sql, args)
+
+    @contextlib.contextmanager
+    def transaction(self):
+        """Run several statements atomically, taking the write lock first."""
+        conn = self.connection()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            yield conn
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        conn.execute('COMMIT')
+
+    def close(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+
+LOCK_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS locks (
+    token TEXT PRIMARY KEY,
+    root TEXT NOT NULL,
+    expire REAL NOT NULL,
+    lock TEXT NOT NULL);
+CREATE INDEX IF NOT EXISTS locks_root ON locks (root);
+CREATE INDEX IF NOT EXISTS locks_expire ON locks (expire);
+'''
+
+
+def ancestors(path):
+    """Return the parent paths of a normalized lock root, nearest first."""
+    result = []
+    while path.rstrip('/'):
+        path = path.rstrip('/').rsplit('/', 1)[0] or '/'
+        result.append(path)
+    return result
+
+
+class SQLiteLockStorage(object):
+    """Lock storage with the interface of wsgidav's LockStorageDict.
+
+    Expired locks are not returned and are deleted by cleanup(), which
+    runs at most every sweep_interval seconds when a lock is created.
+    create() raises DAVError(HTTP_LOCKED) if the lock conflicts with a
+    valid lock, also if that lock was created by another process.
+    """
+
+    LOCK_TIME_OUT_DEFAULT = 604800  # 1 week, in seconds
+    LOCK_TIME_OUT_MAX = 4 * 604800  # 1 month, in seconds
+
+    sweep_interval = 60
+
+    def __init__(self, path):
+        self.path = path
+        self.db = None
+        self.last_sweep = 0
+
+    def __repr__(self):
+        return 'SQLiteLockStorage(%r)' % self.path
+
+    def open(self):
+        self.db = Database(self.path, LOCK_SCHEMA)
+
+    def close(self):
+        if self.db is not None:
+            self.db.close()
+
+    def cleanup(self):
+        """Delete expired locks."""
+        self.last_sweep = time.time()
+        cursor = self.db.execute(
+            'DELETE FROM locks WHERE expire >= 0 AND expire < ?',
+            (time.time(), ))
+        if cursor.rowcount:
+            logging.debug('Deleted %d expired locks', cursor.rowcount)
+
+    def clear(self):
+        self.db.execute('DELETE FROM locks')
+
+    @staticmethod
+    def is_valid(expire):
+        return expire < 0 or expire >= time.time()
+
+    def get(self, token):
+        """Return the lock dict of token, or None if missing or expired."""
+        row = self.db.execute('SELECT expire, lock FROM locks WHERE token = ?',
+                              (token, )).fetchone()
+        if row is None:
+            return None
+        if not self.is_valid(row[0]):
+            self.delete(token)
+            return None
+        return utf8_values(json.loads(row[1]))
+
+    def create(self, path, lock):
+        """Store a new lock for path; return the lock with its token."""
+        assert lock.get('token') is None
+        assert lock.get('expire') is None, 'Use timeout instead of expire'
+        assert path and '/' in path
+
+        lock['root'] = lock_manager.normalizeLockRoot(path)
+        timeout = float(lock.get('timeout') or self.LOCK_TIME_OUT_DEFAULT)
+        if timeout < 0 or timeout > self.LOCK_TIME_OUT_MAX:
+            timeout = self.LOCK_TIME_OUT_MAX
+        lock['timeout'] = timeout
+        lock['expire'] = time.time() + timeout
+        lock_manager.validateLock(lock)
+        lock['token'] = lock_manager.generateLockToken()
+
+        if time.time() - self.last_sweep > self.sweep_interval:
+            self.cleanup()
+        with self.db.transaction() as conn:
+            conflicts = self.conflicts(conn, lock)
+            if conflicts:
+                condition = dav_error.DAVErrorCondition(
+                    dav_error.PRECONDITION_CODE_LockConflict)
+                for root in conflicts:
+                    condition.add_href(root)
+                raise dav_error.DAVError(dav_error.HTTP_LOCKED,
+                                         errcondition=condition)
+            conn.execute(
+                'INSERT INTO locks (token, root, expire, lock) '
+                'VALUES (?, ?, ?, ?)',
+                (lock['token'], lock['root'], lock['expire'],
+                 json.dumps(lock)))
+        return lock
+
+    def conflicts(self, conn, lock):
+        """Return the roots of the valid locks conflicting with lock.
+
+        The rules are those of wsgidav's LockManager: locks on the same
+        resource and depth-infinity locks on its ancestors conflict unless
+        both are shared; with depth infinity every lock below it conflicts.
+        """
+        root = lock['root']
+        shared = lock['scope'] == 'shared'
+        parents = ancestors(root)
+        rows = list(conn.execute(
+            'SELECT root, expire, lock FROM locks WHERE root IN (%s)' %
+            ', '.join('?' * (len(parents) + 1)), [root] + parents))
+        if lock['depth'] == 'infinity':
+            rows.extend(conn.execute(
+                'SELECT root, expire, lock FROM locks '
+                'WHERE root >= ? AND root < ?', child_range(root)))
+        result = []
+        for other_root, expire, other in rows:
+            if not self.is_valid(expire):
+                continue
+            other = json.loads(other)
+            if other_root == root or other_root in parents:
+                if other_root != root and other['depth'] != 'infinity':
+                    continue
+                if shared and other['scope'] == 'shared':
+                    continue
+            result.append(other_root)
+        return result
+
+    def refresh(self, token, timeout):
+        """Set a new timeout; return the lock dict."""
+        assert timeout == -1 or timeout > 0
+        if timeout < 0 or timeout > self.LOCK_TIME_OUT_MAX:
+            timeout = self.LOCK_TIME_OUT_MAX
+        with self.db.transaction() as conn:
+            row = conn.execute('SELECT lock FROM locks WHERE token = ?',
+                               (token, )).fetchone()
+            assert row is not None, 'Lock must exist'
+            lock = utf8_values(json.loads(row[0]))
+            lock['timeout'] = timeout
+            lock['expire'] = time.time() + timeout
+            conn.execute('UPDATE locks SET expire = ?, lock = ? '
+                         'WHERE token = ?',
+                         (lock['expire'], json.dumps(lock), token))
+        return lock
+
+    def delete(self, token):
+        """Delete a lock; return False if it does not exist."""
+        cursor = self.db.execute('DELETE FROM locks WHERE token = ?',
+                                 (token, ))
+        return cursor.rowcount > 0
+
+    def getLockList(self, path, includeRoot, includeChildren, tokenOnly):
+        """Return the valid locks of path and/or the paths below it."""
+        assert path and path.startswith('/')
+        assert includeRoot or includeChildren
+        path = lock_manager.normalizeLockRoot(path)
+        rows = []
+        if includeRoot:
+            rows.extend(self.db.execute(
+                'SELECT token, expire, lock FROM locks WHERE root = ?',
+                (path, )))
+        if includeChildren:
+            rows.extend(self.db.execute(
+                'SELECT token, expire, lock FROM locks '
+                'WHERE root >= ? AND root < ?', child_range(path)))
+        result = []
+        for token, expire, lock in rows:
+            if not self.is_valid(expire):
+                continue
+            if tokenOnly:
+                result.append(token)
+            else:
+                result.append(utf8_values(json.loads(lock)))
+        return result
+
+
+PROPERTY_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS properties (
+    url TEXT NOT NULL,
+    name TEXT NOT NULL,
+    value BLOB NOT NULL,
+    PRIMARY KEY (url, name));
+'''
+
+
+class SQLitePropertyManager(object):
+    """Dead property storage with the interface of wsgidav's
+    PropertyManager.
+
+    Properties are stored by the normalized URL of their resource; the
+    primary key index serves lookups by URL and by URL prefix.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.db = Database(path, PROPERTY_SCHEMA)
+
+    def __repr__(self):
+        return 'SQLitePropertyManager(%r)' % self.path
+
+    def getProperties(self, normurl):
+        return [name for name, in self.db.execute(
+            'SELECT name FROM properties WHERE url = ?', (normurl, ))]
+
+    def getProperty(self, normurl, propname):
+        row = self.db.execute(
+            'SELECT value FROM properties WHERE url = ? AND name = ?',
+            (normurl, propname)).fetchone()
+        return str(row[0]) if row else None
+
+    def writeProperty(self, normurl, propname, propertyvalue, dryRun=False):
+        assert normurl and normurl.startswith('/')
+        assert propname
+        assert propertyvalue is not None
+        if dryRun:
+            return
+        self.db.execute(
+            'INSERT OR REPLACE INTO properties (url, name, value) '
+            'VALUES (?, ?, ?)', (normurl, propname, buffer(propertyvalue)))
+
+    def removeProperty(self, normurl, propname, dryRun=False):
+        if dryRun:
+            return
+        self.db.execute('DELETE FROM properties WHERE url = ? AND name = ?',
+                        (normurl, propname))
+
+    def removeProperties(self, normurl):
+        self.db.execute('DELETE FROM properties WHERE url = ?', (normurl, ))
+
+    def copyProperties(self, srcurl, desturl):
+        with self.db.transaction() as conn:
+            conn.execute('DELETE FROM properties WHERE url = ?', (desturl, ))
+            conn.execute('INSERT INTO properties (url, name, value) '
+                         'SELECT ?, name, value FROM properties '
+                         'WHERE url = ?', (desturl, srcurl))
+
+    def moveProperties(self, srcurl, desturl, withChildren):
+        with self.db.transaction() as conn:
+            urls = [srcurl]
+            if withChildren:
+                urls.extend(url for url, in conn.execute(
+                    'SELECT DISTINCT url FROM properties '
+                    'WHERE url >= ? AND url < ?', child_range(srcurl)))
+            for url in urls:
+                dest = desturl + url[len(srcurl):]
+                conn.execute('DELETE FROM properties WHERE url = ?',
+                             (dest, ))
+                conn.execute('UPDATE properties SET url = ? WHERE url = ?',
+                             (dest, url))
@@ -14,18 +14,39 @@
 #
 # pylint:disable=E1101, C0103
 
+from __future__ import absolute_import
+
+import base64
+import binascii
+import calendar
+import functools
+import hashlib
+import heapq
 import httplib
+import itertools
+import json
 import logging
 import re
 import socket
+import tarfile
+import threading
 import time
 import urllib
 import urlparse
+from cStringIO import StringIO
 
 from swiftclient import client
 
 from wsgidav import dav_error
 from wsgidav import dav_provider
+from wsgidav import util
+
+from swiftdav import auth
+from swiftdav import cache
+from swiftdav import metrics
+from swiftdav import pool
+from swiftdav import readahead
+from swiftdav import workers
 
 requests_log = logging.getLogger("requests")
 requests_log.setLevel(logging.WARNING)
@@ -33,6 +54,26 @@ requests_log.setLevel(logging.WARNING)
 swiftclient_log = logging.getLogger("swiftclient")
 swiftclient_log.setLevel(logging.WARNING)
 
+# Default maximum number of entries Swift returns for one listing request
+LISTING_LIMIT = 10000
+
+# Log the progress of tree operations every PROGRESS_INTERVAL objects
+PROGRESS_INTERVAL = 1000
+
+# Object data is passed between wsgidav and Swift in blocks of this size; use
+# it as "block_size" in the wsgidav config (wsgidav defaults to 8 KiB)
+IO_BLOCK_SIZE = 1024 * 1024
+
+# Chunks up to this size are framed by copying them, larger chunks are sent
+# with separate framing
+SMALL_CHUNK = 16 * 1024
+
+QUOTA_USED_BYTES = '{DAV:}quota-used-bytes'
+
+# Conditional request headers in the WSGI environ
+CONDITIONS = ('HTTP_IF', 'HTTP_IF_MATCH', 'HTTP_IF_NONE_MATCH',
+              'HTTP_IF_MODIFIED_SINCE', 'HTTP_IF_UNMODIFIED_SINCE')
+
 
 def sanitize(name):
     """
@@ -48,86 +89,1458 @@ def getnames(path):
     return (elements[0], '/'.join(elements[1:]))
 
 
-class DownloadFile(object):
-    """A file-like object for downloading files from Openstack Swift."""
+def drop_rejected_token(environ, status):
+    """Drop the token of this request from the token cache after a 401.
 
-    def __init__(self, storage_url, auth_token, container, objname):
-        self.headers = {'X-Auth-Token': auth_token}
-        self.storage_url = storage_url
-        self.container = urllib.quote(container)
-        self.objname = urllib.quote(objname)
+    Every request to Swift reports its status here, so once Swift rejects a
+    cached token (e.g. because it was revoked), the next request
+    authenticates again.
+    """
+    if status == 401:
+        token_cache = environ.get('swift_token_cache')
+        if token_cache:
+            token_cache.invalidate(environ.get('swift_token_key'))
 
-        self.conn = None
-        self.resp = None
 
-        conn = self.get_conn()
-        conn.request('HEAD', self.path, None, self.headers)
+def backend_recorder(environ):
+    """Return the recorder of DownloadFile/UploadFile for this request.
+
+    Requests are accounted in the metrics, and a rejected token is dropped
+    like in swift_call().
+    """
+    def record(operation, started, status, nbytes=0):
+        metrics.record(environ, operation, started, status, nbytes)
+        drop_rejected_token(environ, status)
+    return record
+
+
+def swift_call(environ, func, *args, **kwargs):
+    """Call a swiftclient function with the credentials of this request.
+
+    The connection is borrowed from the connection pool of the provider. If
+    Swift rejects the token, it is dropped (see drop_rejected_token()).
+    """
+    storage_url = environ.get('swift_storage_url')
+    conn_pool = environ['wsgidav.provider'].pools.get(
+        storage_url, environ.get('insecure'))
+    conn = conn_pool.get()
+    contents = kwargs.get('contents')
+    nbytes = len(contents) if isinstance(contents, str) else 0
+    started = time.time()
+    try:
+        result = func(storage_url,
+                      environ.get('swift_auth_token'),
+                      *args,
+                      http_conn=(urlparse.urlparse(storage_url), conn),
+                      **kwargs)
+    except client.ClientException as ex:
+        metrics.record(environ, func.__name__, started, ex.http_status,
+                       nbytes)
+        conn_pool.put(conn)
+        drop_rejected_token(environ, ex.http_status)
+        raise
+    except Exception:
+        metrics.record(environ, func.__name__, started, None, nbytes)
+        conn_pool.discard(conn)
+        raise
+    metrics.record(environ, func.__name__, started, 200, nbytes)
+    conn_pool.put(conn)
+    return result
+
+
+def iter_listing(environ, container=None, page_size=None, cached=True,
+                 **kwargs):
+    """Yield the entries of a container or account listing.
+
+    The listing is requested page by page using the name of the last entry
+    as marker, so it is complete for any number of entries and only one page
+    is held in memory. Stop iterating to skip the remaining pages. Other
+    keyword arguments (prefix, delimiter, marker, end_marker) are passed to
+    swiftclient.
+
+    Pages are cached in the metadata cache of the provider unless cached
+    is False.
+    """
+    page_size = page_size or LISTING_LIMIT
+    metadata = environ['wsgidav.provider'].metadata
+    account = environ.get('swift_storage_url')
+    while True:
+        key = metadata.listing_key(account, container, limit=page_size,
+                                   **kwargs)
+        page = metadata.get(key) if cached else None
+        if page is None:
+            if container is None:
+                _, page = swift_call(environ, client.get_account,
+                                     limit=page_size, **kwargs)
+            else:
+                _, page = swift_call(environ, client.get_container,
+                                     container, limit=page_size, **kwargs)
+            metadata.set(key, page)
+        for entry in page:
+            yield entry
+        if len(page) < page_size:
+            return
+        kwargs['marker'] = page[-1].get('name', page[-1].get('subdir'))
+
+
+def head(environ, container, objname=None, fetch=True):
+    """Return the headers of a container or object, using the cache.
+
+    If fetch is False, only the cache is used; None is returned on a miss.
+    """
+    metadata = environ['wsgidav.provider'].metadata
+    key = metadata.head_key(environ.get('swift_storage_url'), container,
+                            objname)
+    headers = metadata.get(key)
+    if headers is None and fetch:
+        if objname is None:
+            headers = swift_call(environ, client.head_container, container)
+        else:
+            headers = swift_call(environ, client.head_object, container,
+                                 objname)
+        # Response headers must be byte strings for the WSGI server
+        headers = dict((utf8(name), utf8(value))
+                       for name, value in headers.items())
+        metadata.set(key, headers)
+    return headers
+
+
+def cache_headers(environ, container, objname, headers):
+    """Store the headers of an object GET as HEAD result."""
+    metadata = environ['wsgidav.provider'].metadata
+    metadata.set(metadata.head_key(environ.get('swift_storage_url'),
+                                   container, objname),
+                 dict((name, value) for name, value in headers.items()
+                      if name not in ('content-range', 'connection')))
+
+
+def invalidate(environ, container, objname=None, tree=False):
+    """Drop cached metadata after a change of a container or object.
+
+    With tree=True objname is a prefix, and everything below it is dropped.
+    """
+    environ['wsgidav.provider'].metadata.invalidate(
+        environ.get('swift_storage_url'), container, objname, tree)
+
+
+def utf8(name):
+    if isinstance(name, unicode):
+        return name.encode('utf8')
+    return name
+
+
+def href(environ, container, name=''):
+    """Return the quoted href of an object for multistatus responses."""
+    provider = environ['wsgidav.provider']
+    path = '/%s/%s' % (utf8(container), utf8(name))
+    return urllib.quote(provider.mountPath + provider.sharePath + path,
+                        safe="/!*'(),$-_|.")
+
+
+def as_dav_error(ex):
+    if isinstance(ex, client.ClientException) and ex.http_status:
+        return dav_error.DAVError(ex.http_status)
+    return dav_error.asDAVError(ex)
+
+
+def copy_object(environ, container, name, dst_container, dst_name):
+    """Copy an object server-side, keeping its metadata and content type.
+
+    Returns True if the copy shares the segments of a large object, which
+    must not be deleted with the source then.
+    """
+    copy_from = urllib.quote('/%s/%s' % (utf8(container), utf8(name)))
+    try:
+        try:
+            swift_call(environ, client.put_object, dst_container,
+                       dst_name, headers={'X-Copy-From': copy_from})
+        except client.ClientException as ex:
+            if ex.http_status != 413:
+                raise
+            # The content of a large object exceeds the maximum object
+            # size; copy its manifest instead, which shares the segments
+            swift_call(environ, client.put_object, dst_container,
+                       dst_name, headers={'X-Copy-From': copy_from},
+                       query_string='multipart-manifest=get')
+            return True
+    finally:
+        invalidate(environ, dst_container, dst_name)
+    return False
+
+
+def copy_tree(environ, container, prefix, dst_container, dst_prefix,
+              move=False):
+    """Copy all objects below prefix to dst_prefix server-side.
+
+    The listing is streamed and the objects are copied by the tree_workers
+    of the provider; with move=True each source object is deleted once it
+    has been copied, and afterwards a folder marker without '/' and the
+    segments of moved large objects. The destination folder has its own
+    marker already. Returns a list of (href, DAVError) tuples for objects
+    that failed.
+    """
+    provider = environ['wsgidav.provider']
+    verb = 'Moving' if move else 'Copying'
+    source = '/%s/%s' % (utf8(container), utf8(prefix))
+    destination = '/%s/%s' % (utf8(dst_container), utf8(dst_prefix))
+    spool_flush(environ, container, prefix)
+
+    def task(name):
+        shared = copy_object(environ, container, name,
+                             dst_container, dst_prefix + name[len(prefix):])
+        if move:
+            try:
+                swift_call(environ, client.delete_object, container, name)
+            finally:
+                invalidate(environ, container, name)
+        return name if shared else None
+
+    started = time.time()
+    pool = workers.WorkerPool(provider.tree_workers,
+                              provider.tree_workers * 4)
+    count = 0
+    for obj in iter_listing(environ, container, cached=False,
+                            prefix=prefix or None):
+        pool.spawn(task, obj['name'])
+        count += 1
+        if count % PROGRESS_INTERVAL == 0:
+            logging.info('%s %s to %s: %d objects listed', verb, source,
+                         destination, count)
+    results, errors = pool.join()
+    logging.info('%s %s to %s: %d objects done in %.1fs, %d failed', verb,
+                 source, destination, count - len(errors),
+                 time.time() - started, len(errors))
+    marker = folder_marker(environ, container, prefix) if move else None
+    if marker is not None and not errors:
+        try:
+            swift_call(environ, client.delete_object, container, marker)
+        except client.ClientException as ex:
+            if ex.http_status != 404:
+                errors.append(((marker, ), ex))
+        finally:
+            invalidate(environ, container, marker)
+    if move:
+        # Segments are still used by objects that failed to move and by
+        # copied manifests
+        used = set(name for name in results if name)
+        used.update(args[0] for args, _ in errors)
+        keep = None
+        if used:
+            keep = lambda segment: any(segment.startswith(name + '/')
+                                       for name in used)
+        delete_segments(environ, container, prefix, keep)
+    return [(href(environ, container, args[0]), as_dav_error(ex))
+            for args, ex in errors]
+
+
+def content_md5(environ):
+    """Return the Content-MD5 of a request as hex digest like an ETag.
+
+    Returns None without the header, and raises DAVError if it is invalid.
+    Some clients send the hex digest instead of base64, which is accepted.
+    """
+    value = environ.get('HTTP_CONTENT_MD5', '').strip()
+    if not value:
+        return None
+    if re.match('^[0-9a-fA-F]{32}$', value):
+        return value.lower()
+    try:
+        digest = base64.b64decode(value)
+    except (TypeError, ValueError):
+        digest = ''
+    if len(digest) != 16:
+        raise dav_error.DAVError(dav_error.HTTP_BAD_REQUEST,
+                                 'Invalid Content-MD5 header')
+    return binascii.hexlify(digest)
+
+
+def revalidation(environ):
+    """Return the If-None-Match and If-Modified-Since headers of a request.
+
+    These are the conditions of clients revalidating their copy. Requests
+    with other conditions are left to wsgidav; an empty dict is returned
+    for them.
+    """
+    if environ.get('REQUEST_METHOD') not in ('GET', 'HEAD') or \
+            'HTTP_IF_MATCH' in environ or \
+            'HTTP_IF_UNMODIFIED_SINCE' in environ or 'HTTP_IF' in environ:
+        return {}
+    conditions = {}
+    for name in ('If-None-Match', 'If-Modified-Since'):
+        value = environ.get('HTTP_' + name.upper().replace('-', '_'))
+        if value:
+            conditions[name] = value
+    return conditions
+
+
+def not_modified(conditions, headers):
+    """Check the conditions of revalidation() against object headers.
+
+    As in RFC 7232, If-Modified-Since is ignored if If-None-Match is given.
+    """
+    etag = str(headers.get('etag') or '').strip('"')
+    if 'If-None-Match' in conditions:
+        for tag in conditions['If-None-Match'].split(','):
+            tag = tag.strip()
+            if tag.startswith('W/'):
+                tag = tag[2:]
+            tag = tag.strip('"')
+            if tag == '*' or (etag and tag == etag):
+                return True
+        return False
+    since = util.parseTimeString(conditions.get('If-Modified-Since', ''))
+    last_modified = util.parseTimeString(headers.get('last-modified') or '')
+    return bool(since and last_modified and last_modified <= since)
+
+
+def parse_listing_time(value):
+    """Return the seconds since the epoch of a listing timestamp, or None.
+
+    Listings have UTC timestamps like 2013-10-14T12:34:56.123456. Like the
+    RFC 1123 dates of HEAD responses they are used in whole seconds.
+    """
+    try:
+        if value[10] != 'T':
+            return None
+        return calendar.timegm((int(value[0:4]), int(value[5:7]),
+                                int(value[8:10]), int(value[11:13]),
+                                int(value[14:16]), int(value[17:19])))
+    except (IndexError, TypeError, ValueError):
+        return None
+
+
+class ObjectInfo(object):
+    """The properties of an object, converted once.
+
+    PROPFIND asks every member for several properties, so listing entries
+    and headers are not looked up and parsed again for each of them.
+    """
+
+    __slots__ = ('size', 'content_type', 'etag', 'modified')
+
+    def __init__(self, size, content_type, etag, modified):
+        self.size = size
+        self.content_type = content_type or 'application/octet-stream'
+        # Large object ETags are quoted
+        self.etag = str(etag).strip('"') if etag else None
+        self.modified = modified
+
+    @classmethod
+    def from_listing(cls, obj):
+        return cls(obj.get('bytes'), obj.get('content_type'), obj.get('hash'),
+                   parse_listing_time(obj.get('last_modified')))
+
+    @classmethod
+    def from_headers(cls, headers):
+        size = headers.get('content-length')
+        return cls(int(size) if size is not None else None,
+                   headers.get('content-type'), headers.get('etag'),
+                   util.parseTimeString(headers.get('last-modified') or ''))
+
+
+class ContainerStats(object):
+    """Object count, bytes used and creation time of a container."""
+
+    __slots__ = ('count', 'size', 'created')
+
+    def __init__(self, count, size, created):
+        self.count = count
+        self.size = size
+        self.created = created
+
+    @classmethod
+    def from_listing(cls, entry):
+        """Use an entry of the account listing.
+
+        Only recent Swift versions list the creation time (last_modified).
+        """
+        return cls(entry.get('count'), entry.get('bytes'),
+                   parse_listing_time(entry.get('last_modified')))
+
+    @classmethod
+    def from_headers(cls, headers):
+        def number(name, convert=int):
+            try:
+                return convert(headers.get(name))
+            except (TypeError, ValueError):
+                return None
+        return cls(number('x-container-object-count'),
+                   number('x-container-bytes-used'),
+                   number('x-timestamp', float))
+
+
+def is_directory_marker(headers):
+    """Check if object headers belong to a folder marker without a '/'."""
+    return headers.get('content-type') == 'application/directory'
+
+
+def folder_marker(environ, container, prefix):
+    """Return the name of the folder marker without '/' of prefix, or None.
+
+    Folder markers usually end with '/' and are listed below prefix; other
+    Swift clients create them without.
+    """
+    name = prefix.rstrip('/')
+    if not name:
+        return None
+    try:
+        headers = head(environ, container, name)
+    except client.ClientException:
+        return None
+    return name if is_directory_marker(headers) else None
+
+
+def raw_pool(environ):
+    """Return the pool of raw httplib connections for this request."""
+    return environ['wsgidav.provider'].pools.get(
+        environ.get('swift_storage_url'), environ.get('insecure'), raw=True)
+
+
+def readahead_options(environ):
+    """Return the read-ahead arguments of DownloadFile for this request."""
+    provider = environ['wsgidav.provider']
+    return {'readahead': provider.readahead_window,
+            'readahead_workers': provider.readahead_workers,
+            'parallel_size': provider.readahead_parallel_size,
+            'budget': provider.readahead_budget}
+
+
+def raw_request(environ, operation, method, path, body=None, headers=None):
+    """Send a single request on a pooled raw connection.
+
+    operation is the name the request is accounted as in the metrics.
+    Returns the response, its body is available as resp.body.
+    """
+    headers = dict(headers or {})
+    headers['X-Auth-Token'] = environ.get('swift_auth_token')
+    if body is not None:
+        headers['Content-Length'] = str(len(body))
+    conn_pool = raw_pool(environ)
+    conn = conn_pool.get()
+    started = time.time()
+    try:
+        conn.request(method, path, body, headers)
         resp = conn.getresponse()
-        conn.close()
-        self.closed = True
+        resp.body = resp.read()
+    except Exception:
+        metrics.record(environ, operation, started, None, len(body or ''))
+        conn_pool.discard(conn)
+        raise
+    metrics.record(environ, operation, started, resp.status,
+                   len(body or ''))
+    drop_rejected_token(environ, resp.status)
+    if resp.will_close:
+        conn_pool.discard(conn)
+    else:
+        conn_pool.put(conn)
+    return resp
+
+
+def delete_objects(environ, container, names):
+    """Delete objects in parallel using the tree_workers of the provider.
+
+    Returns a list of (href, DAVError) tuples for objects that failed;
+    objects that are already gone are not an error.
+    """
+    provider = environ['wsgidav.provider']
+
+    def task(name):
+        try:
+            swift_call(environ, client.delete_object, container, name)
+        except client.ClientException as ex:
+            if ex.http_status != 404:
+                raise
+
+    pool = workers.WorkerPool(provider.tree_workers)
+    for name in names:
+        pool.spawn(task, name)
+    _, errors = pool.join()
+    return [(href(environ, container, args[0]), as_dav_error(ex))
+            for args, ex in errors]
+
+
+def bulk_delete(environ, container, names):
+    """Delete objects with a single request to the bulk-delete middleware.
+
+    Returns a list of (href, DAVError) tuples for objects that failed.
+    Raises ClientException if the request as a whole failed.
+    """
+    body = '\n'.join(urllib.quote('/%s/%s' % (utf8(container), utf8(name)))
+                     for name in names)
+    path = urlparse.urlparse(environ.get('swift_storage_url')).path
+    resp = raw_request(environ, 'bulk_delete', 'POST',
+                       path + '?bulk-delete', body,
+                       {'Content-Type': 'text/plain',
+                        'Accept': 'application/json'})
+    try:
+        result = json.loads(resp.body) if resp.status == 200 else {}
+    except ValueError:
+        result = {}
+    status = result.get('Response Status', '%d' % resp.status)
+    errors = result.get('Errors') or []
+    if not status.startswith('2') and not errors:
+        raise client.ClientException('Bulk delete failed',
+                                     http_status=int(status.split()[0]),
+                                     http_response_content=resp.body)
+    return [(href(environ, container,
+                  urllib.unquote(utf8(failed)).lstrip('/').partition('/')[2]),
+             dav_error.DAVError(int(error.split()[0])))
+            for failed, error in errors]
+
+
+def archive_safe(name):
+    """Return True if extract-archive creates an object of this name."""
+    parts = name.split('/')
+    return all(part not in ('', '.', '..') for part in parts)
+
+
+def spooled_archive(entries):
+    """Return a tar archive of spooled objects for extract-archive.
+
+    Swift sets the content type from the mime_type pax header.
+    """
+    buf = StringIO()
+    archive = tarfile.open(fileobj=buf, mode='w', format=tarfile.PAX_FORMAT,
+                           encoding='utf-8')
+    for entry in entries:
+        info = tarfile.TarInfo(entry.name)
+        info.size = len(entry.data)
+        info.mtime = int(entry.spooled)
+        info.pax_headers = {u'SCHILY.xattr.user.mime_type':
+                            entry.headers['content-type'].decode('utf-8')}
+        archive.addfile(info, StringIO(entry.data))
+    archive.close()
+    return buf.getvalue()
+
+
+def extract_archive(environ, container, entries):
+    """Upload spooled objects with a single extract-archive request.
+
+    Returns a list of (entry, HTTP status or None) tuples for objects that
+    failed. Raises ClientException if the request as a whole failed.
+    """
+    path = '%s/%s?extract-archive=tar' % (
+        urlparse.urlparse(environ.get('swift_storage_url')).path,
+        urllib.quote(container))
+    resp = raw_request(environ, 'extract_archive', 'PUT', path,
+                       spooled_archive(entries),
+                       {'Content-Type': 'application/x-tar',
+                        'Accept': 'application/json'})
+    try:
+        result = json.loads(resp.body) if resp.status == 200 else {}
+    except ValueError:
+        result = {}
+    status = result.get('Response Status', '%d' % resp.status)
+    errors = result.get('Errors') or []
+    if not status.startswith('2') and not errors:
+        raise client.ClientException('Extract archive failed',
+                                     http_status=int(status.split()[0]),
+                                     http_response_content=resp.body)
+    # Error paths include the account: /v1/AUTH_test/container/object
+    failures = []
+    failed_paths = [urllib.unquote(failed) for failed, _ in errors]
+    for entry in entries:
+        suffix = '/%s/%s' % (container, entry.name)
+        for failed_path, (_, error) in zip(failed_paths, errors):
+            if failed_path.endswith(suffix):
+                failures.append((entry, int(error.split()[0])))
+                break
+    if result.get('Number Files Created', 0) + len(failures) < len(entries):
+        # Swift stops after too many failures; retry all but the failed
+        failed = set(entry.key for entry, _ in failures)
+        failures.extend((entry, None) for entry in entries
+                        if entry.key not in failed)
+    return failures
+
+
+def put_spooled(environ, container, entries):
+    """Upload spooled objects by parallel PUTs of the tree_workers.
+
+    Returns a list of (entry, HTTP status or None) tuples for objects that
+    failed.
+    """
+    if not entries:
+        return []
+    provider = environ['wsgidav.provider']
+    account_path = urlparse.urlparse(environ.get('swift_storage_url')).path
+
+    def task(entry):
+        resp = raw_request(environ, 'put_object', 'PUT', '%s/%s/%s' % (
+            account_path, urllib.quote(container), urllib.quote(entry.name)),
+            entry.data, {'ETag': entry.headers['etag'],
+                         'Content-Type': entry.headers['content-type']})
         if resp.status < 200 or resp.status >= 300:
-            raise Exception
+            raise client.ClientException('Object PUT failed',
+                                         http_status=resp.status,
+                                         http_response_content=resp.body)
+
+    pool = workers.WorkerPool(provider.tree_workers)
+    for entry in entries:
+        pool.spawn(task, entry)
+    _, errors = pool.join()
+    return [(args[0], getattr(ex, 'http_status', None))
+            for args, ex in errors]
+
+
+def upload_spooled(environ, container, entries):
+    """Upload a batch of objects of an UploadSpool.
+
+    If the cluster supports extract-archive, the batch is uploaded by one
+    request, otherwise (or if the request fails) by parallel PUTs. Returns
+    a list of (entry, HTTP status or None) tuples for objects that failed.
+    """
+    provider = environ['wsgidav.provider']
+    failures = []
+    archived = [entry for entry in entries if archive_safe(entry.name)]
+    if archived and provider.get_capabilities(environ).get('bulk_upload'):
+        try:
+            failures = extract_archive(environ, container, archived)
+            done = set(archived)
+            entries = [entry for entry in entries if entry not in done]
+        except (client.ClientException, httplib.HTTPException,
+                socket.error) as ex:
+            logging.warning('Extract archive in /%s failed, uploading %d '
+                            'objects one by one: %s', utf8(container),
+                            len(archived), ex)
+    try:
+        failures += put_spooled(environ, container, entries)
+    finally:
+        for entry in set(archived + entries):
+            invalidate(environ, container, entry.name)
+    failed = set(entry for entry, _ in failures)
+    for entry in set(archived + entries) - failed:
+        delete_old_segments(environ, container, entry.name)
+    return failures
+
+
+def spool_discard(environ, container, name, tree=False):
+    """Drop spooled uploads of an object (or of all below a prefix)."""
+    upload_spool = environ['wsgidav.provider'].upload_spool
+    if upload_spool is not None:
+        upload_spool.discard(environ.get('swift_storage_url'), container,
+                             name, tree)
+
+
+def spool_flush(environ, container, prefix):
+    """Upload spooled objects below prefix now, e.g. before copying."""
+    upload_spool = environ['wsgidav.provider'].upload_spool
+    if upload_spool is not None:
+        upload_spool.flush(environ, upload_spooled, container, prefix)
+
+
+def delete_tree(environ, container, prefix, keep=None, segments=True):
+    """Delete all objects below prefix.
+
+    The listing is streamed in batches. If the cluster supports bulk
+    deletes, each batch is deleted by one request, otherwise (or if a bulk
+    request fails) by parallel DELETE requests. Objects for which keep(name)
+    returns True are skipped. Unless segments is False, a folder marker
+    without '/' is deleted last, and the segments of the large objects
+    below prefix afterwards. Returns a list of (href, DAVError) tuples for
+    objects that failed.
+    """
+    provider = environ['wsgidav.provider']
+    capabilities = provider.get_capabilities(environ)
+    batch_size = capabilities.get('bulk_delete', {}).get(
+        'max_deletes_per_request')
+    source = '/%s/%s' % (utf8(container), utf8(prefix))
+    if segments:
+        spool_discard(environ, container, prefix, tree=True)
+
+    def delete_batch(names):
+        if batch_size:
+            try:
+                return bulk_delete(environ, container, names)
+            except (client.ClientException, httplib.HTTPException,
+                    socket.error) as ex:
+                logging.warning('Bulk delete in %s failed, deleting objects '
+                                'one by one: %s', source, ex)
+        return delete_objects(environ, container, names)
+
+    started = time.time()
+    errors = []
+    batch = []
+    count = 0
+    marker = folder_marker(environ, container, prefix) if segments else None
+    try:
+        names = (obj['name'] for obj in iter_listing(
+            environ, container, cached=False, prefix=prefix or None))
+        if marker is not None:
+            names = itertools.chain(names, [marker])
+        for name in names:
+            if keep is not None and keep(name):
+                continue
+            batch.append(name)
+            count += 1
+            if len(batch) >= (batch_size or PROGRESS_INTERVAL):
+                errors.extend(delete_batch(batch))
+                batch = []
+                logging.info('Deleting %s: %d objects done', source, count)
+        if batch:
+            errors.extend(delete_batch(batch))
+    finally:
+        # Bulk deletes don't invalidate single objects; drop the cached
+        # listings and HEAD results of the whole subtree for both ways
+        invalidate(environ, container, prefix or None, tree=True)
+        if marker is not None:
+            invalidate(environ, container, marker)
+    if segments or count:
+        logging.info('Deleting %s: %d objects done in %.1fs, %d failed',
+                     source, count - len(errors), time.time() - started,
+                     len(errors))
+    if segments and not errors:
+        # Keep the segments of objects that could not be deleted
+        delete_segments(environ, container, prefix)
+    return errors
+
+
+def segment_container(container):
+    """Return the container UploadFile stores the segments in."""
+    return container + '_segments'
+
+
+def is_large_object(headers):
+    return headers.get('x-static-large-object', '').lower() == 'true'
+
+
+def segments_exist(environ, container):
+    """Check if the segment container of container exists, usually cached.
+
+    The account listing starting at its name is cached like other listings.
+    """
+    name = utf8(segment_container(container))
+    for entry in iter_listing(environ, page_size=1, prefix=name):
+        return utf8(entry['name']) == name
+    return False
+
+
+def delete_segments(environ, container, prefix, keep=None):
+    """Delete the segments of the large objects below prefix.
+
+    UploadFile stores the segments of an object below '<object name>/' in
+    the segment container. keep(name) returns True for segments still in
+    use. Failures are only logged, the segments are not DAV members. The
+    segment container itself is deleted with the segments of a container.
+    """
+    name = segment_container(container)
+    try:
+        if not segments_exist(environ, container):
+            return
+        errors = delete_tree(environ, name, prefix, keep=keep,
+                             segments=False)
+        if not prefix and keep is None and not errors:
+            errors = delete_container(environ, name)
+    except client.ClientException as ex:
+        if ex.http_status == 404:
+            return
+        errors = [(href(environ, name, prefix), as_dav_error(ex))]
+    except (httplib.HTTPException, socket.error) as ex:
+        errors = [(href(environ, name, prefix), as_dav_error(ex))]
+    for path, error in errors:
+        logging.warning('Deleting segments %s failed: %s', path, error)
+
+
+def delete_old_segments(environ, container, name, current=None):
+    """Delete the segments of earlier uploads of an overwritten object.
+
+    current is the segment prefix of the upload now stored, if it is a
+    large object itself. Nothing is requested unless the container has a
+    segment container.
+    """
+    keep = None
+    if current is not None:
+        keep = lambda segment: segment.startswith(current + '/')
+    delete_segments(environ, container, name + '/slo/', keep)
+
+
+def delete_container(environ, container, retries=2):
+    """Delete an empty container.
+
+    Container listings are updated asynchronously in Swift, so a container
+    that was just emptied might still be reported as not empty; retry in
+    this case. Returns a list with the (href, DAVError) tuple on failure.
+    """
+    for attempt in range(retries + 1):
+        try:
+            swift_call(environ, client.delete_container, container)
+            return []
+        except client.ClientException as ex:
+            if ex.http_status != 409 or attempt == retries:
+                return [(href(environ, container), as_dav_error(ex))]
+            time.sleep(0.5 * 2 ** attempt)
+        finally:
+            invalidate(environ, container)
+
+
+class SwiftFile(object):
+    """Base class for file-like objects using raw pooled connections.
+
+    If a recorder (see backend_recorder()) is given, every request is
+    accounted with record(operation, started, status, nbytes).
+    """
+
+    storage_url = None
+    conn_pool = None
+    recorder = None
+
+    def record(self, operation, started, status, nbytes=0):
+        if self.recorder:
+            self.recorder(operation, started, status, nbytes)
 
     def get_conn(self):
+        if self.conn_pool:
+            return self.conn_pool.get()
+        return pool.raw_connection(self.storage_url)
+
+    def release_conn(self, conn, reusable):
+        if not self.conn_pool:
+            conn.close()
+        elif reusable:
+            self.conn_pool.put(conn)
+        else:
+            self.conn_pool.discard(conn)
+
+
+class DownloadFile(SwiftFile):
+    """A file-like object for downloading files from Openstack Swift.
+
+    The GET is sent by open() or on the first read(), starting at the current
+    position. Its status is the existence check and its headers are available
+    in response_headers, so no separate HEAD is required.
+
+    seek() drops a running response, the next read() reopens the GET at the
+    new offset using a Range request. If byte_range (first, last) is given
+    and the file is seeked to its first byte, only the bytes up to and
+    including the last byte are requested.
+
+    Responses with a Content-Length are read with recv_into() into a
+    reusable buffer instead of through httplib, which saves copying the
+    data several times.
+
+    If readahead is set, read() returns blocks of block_size bytes that a
+    readahead.Prefetcher fetches up to readahead blocks ahead of the reader,
+    charged to budget (a readahead.Budget shared by all downloads). They
+    are read from the running response, or, if at least parallel_size bytes
+    remain, by readahead_workers ranged GETs in parallel. Objects of a
+    single block are read directly.
+
+    If fill (a contentcache.CacheFill) is set, the data read is written to
+    it until the file is seeked.
+    """
+
+    def __init__(self, storage_url, auth_token, container, objname,
+                 conn_pool=None, byte_range=None, recorder=None,
+                 readahead=0, readahead_workers=4, parallel_size=None,
+                 budget=None, block_size=IO_BLOCK_SIZE):
+        self.headers = {'X-Auth-Token': auth_token}
+        self.storage_url = storage_url
+        self.container = urllib.quote(container)
+        self.objname = urllib.quote(objname)
+        self.conn_pool = conn_pool
+        self.byte_range = byte_range
+        self.recorder = recorder
         url = urlparse.urlparse(self.storage_url)
         self.path = "%s/%s/%s" % (url.path, self.container, self.objname)
-        if url.scheme == "http":
-            conn = httplib.HTTPConnection(url.netloc)
-        elif url.scheme == "https":
-            conn = httplib.HTTPSConnection(url.netloc)
-        else:
-            raise Exception
-        return conn
+
+        self.conn = None
+        self.resp = None
+        self.response_headers = None
+        self.position = 0
+        self.last_byte = None
+        self.seeked = False
+        self.closed = True
+        self.block = bytearray()
+        # Start time and bytes read of the running GET, for the metrics
+        self.started = None
+        self.received = 0
+
+        self.readahead = readahead
+        self.readahead_workers = readahead_workers
+        self.parallel_size = parallel_size
+        self.budget = budget
+        self.block_size = block_size
+        self.prefetcher = None
+        # Block returned by the prefetcher and the offset read from it
+        self.ahead = ''
+        self.ahead_offset = 0
+        self.ahead_first = 0
+        self.ahead_length = 0
+        self.ahead_etag = None
+        self._lock = threading.Lock()
+        self.fill = None
+
+    def open(self, range_header=None, conditions=None):
+        """Send the GET request.
+
+        range_header is passed to Swift as is; the position and byte range
+        are then taken from the Content-Range of the response. conditions
+        are additional headers like If-None-Match; if Swift answers with an
+        error status, the headers of the response are kept anyway.
+        """
+        headers = dict(self.headers)
+        headers.update(conditions or {})
+        if range_header:
+            headers['Range'] = range_header
+        elif self.position or self.last_byte is not None:
+            headers['Range'] = 'bytes=%d-%s' % (
+                self.position,
+                '' if self.last_byte is None else self.last_byte)
+        self.conn = self.get_conn()
+        self.started = time.time()
+        self.received = 0
+        try:
+            self.conn.request('GET', self.path, None, headers)
+            self.resp = self.conn.getresponse()
+        except Exception:
+            self.record('get_object', self.started, None)
+            self.started = None
+            self.release_conn(self.conn, False)
+            self.conn = None
+            raise
+        status, reason = self.resp.status, self.resp.reason
+        if status not in (200, 206):
+            self.response_headers = dict(self.resp.getheaders())
+            self.resp.read()
+            self.record('get_object', self.started, status)
+            self.started = None
+            self.close()
+            raise client.ClientException('Object GET failed',
+                                         http_path=self.path,
+                                         http_status=status,
+                                         http_reason=reason)
+
+        self.response_headers = dict(self.resp.getheaders())
+        content_range = self.response_headers.get('content-range', '')
+        match = re.match(r'bytes (\d+)-(\d+)/(\d+)', content_range)
+        if status == 206 and match:
+            if range_header:
+                self.position = int(match.group(1))
+                self.last_byte = int(match.group(2))
+                self.byte_range = (self.position, self.last_byte)
+            # Report the size of the whole object, not of this range
+            self.response_headers['content-length'] = match.group(3)
+        elif self.position:
+            # Range was ignored, skip to the requested position
+            remaining = self.position
+            while remaining > 0:
+                data = self.resp.read(min(remaining, 65536))
+                if not data:
+                    break
+                remaining -= len(data)
+                self.received += len(data)
+        return self.response_headers
 
     def read(self, size):
+        if self.readahead and self.prefetcher is None:
+            self.start_readahead()
+        if self.prefetcher is not None:
+            data = self.read_ahead(size)
+        else:
+            if len(self.block) < size:
+                self.block = bytearray(size)
+            view = memoryview(self.block)[:size]
+            data = view[:self.readinto(view)].tobytes()
+        if self.fill is not None and not self.fill.write(data):
+            self.fill = None
+        return data
+
+    def body_socket(self):
+        """Return the socket to read the response body from, or None.
+
+        This is only possible if the length of the body is known and the
+        file object of the response holds no buffered data.
+        """
+        if self.resp.chunked or self.resp.length is None:
+            return None
+        fp = self.resp.fp
+        rbuf = getattr(fp, '_rbuf', None)
+        if rbuf is None or rbuf.tell():
+            return None
+        return getattr(fp, '_sock', None)
+
+    def readinto(self, buf):
+        """Read up to len(buf) bytes into buf; return the number of bytes."""
+        self.prepare()
+        count = self.recv_into(buf)
+        self.position += count
+        return count
+
+    def prepare(self):
+        if not self.seeked and (self.position or self.last_byte is not None):
+            # Opened with a range, but the caller reads from the start
+            self.seek(0)
         if not self.resp:
-            self.conn = self.get_conn()
-            self.conn.request('GET', self.path, None, self.headers)
-            self.resp = self.conn.getresponse()
-        return self.resp.read(size)
+            self.open()
+
+    def recv_into(self, buf):
+        """Read from the response into buf, without moving the position."""
+        view = memoryview(buf)
+        sock = self.resp.fp and self.body_socket()
+        if sock is None:
+            data = self.resp.read(len(view))
+            count = len(data)
+            view[:count] = data
+        else:
+            size = min(len(view), self.resp.length)
+            count = 0
+            while count < size:
+                received = sock.recv_into(view[count:size])
+                if not received:
+                    break
+                count += received
+            # Keep the state of the response as resp.read() does, so the
+            # connection can be reused
+            self.resp.length -= count
+            if not self.resp.length or not count:
+                self.resp.close()
+        self.received += count
+        return count
+
+    def start_readahead(self):
+        self.prepare()
+        remaining = self.resp.length
+        if remaining is not None and remaining <= self.block_size:
+            return
+        self.ahead = ''
+        self.ahead_offset = 0
+        if self.readahead_workers > 1 and self.parallel_size and \
+                remaining is not None and remaining >= self.parallel_size:
+            self.ahead_first = self.position
+            self.ahead_length = remaining
+            self.ahead_etag = self.response_headers.get('etag')
+            count = -(-remaining // self.block_size)
+            self.prefetcher = readahead.Prefetcher(
+                self.fetch_range, self.block_size, self.readahead,
+                workers=min(self.readahead_workers, self.readahead),
+                budget=self.budget, count=count)
+        else:
+            self.prefetcher = readahead.Prefetcher(
+                self.fetch_block, self.block_size, self.readahead,
+                budget=self.budget)
+
+    def read_ahead(self, size):
+        if self.ahead_offset >= len(self.ahead):
+            self.ahead = self.prefetcher.get()
+            self.ahead_offset = 0
+        if not self.ahead_offset and size >= len(self.ahead):
+            data = self.ahead
+        else:
+            data = self.ahead[self.ahead_offset:self.ahead_offset + size]
+        self.ahead_offset += len(data)
+        self.position += len(data)
+        return data
+
+    def fetch_block(self, _index):
+        """Read the next block from the running response."""
+        buf = bytearray(self.block_size)
+        count = 0
+        while count < self.block_size:
+            received = self.recv_into(memoryview(buf)[count:])
+            if not received:
+                break
+            count += received
+        return memoryview(buf)[:count].tobytes()
+
+    def fetch_range(self, index):
+        """Return block number index of the remaining bytes.
+
+        The first block is read from the running response, which is closed
+        then; the others are fetched with ranged GETs. If the ETag changes,
+        the object was replaced and the download fails.
+        """
+        if index == 0:
+            data = self.fetch_block(index)
+            self.close_stream()
+            return data
+        first = self.ahead_first + index * self.block_size
+        last = min(first + self.block_size,
+                   self.ahead_first + self.ahead_length) - 1
+        headers = dict(self.headers)
+        headers['Range'] = 'bytes=%d-%d' % (first, last)
+        conn = self.get_conn()
+        started = time.time()
+        try:
+            conn.request('GET', self.path, None, headers)
+            resp = conn.getresponse()
+            data = resp.read()
+        except Exception:
+            self.record('get_object', started, None)
+            self.release_conn(conn, False)
+            raise
+        self.record('get_object', started, resp.status, len(data))
+        self.release_conn(conn, not resp.will_close)
+        if resp.status != 206 or len(data) != last - first + 1 or \
+                resp.getheader('etag') != self.ahead_etag:
+            raise client.ClientException('Object GET failed',
+                                         http_path=self.path,
+                                         http_status=resp.status,
+                                         http_reason=resp.reason)
+        return data
 
     def seek(self, position):
-        pass
+        self.seeked = True
+        last_byte = None
+        if self.byte_range and self.byte_range[0] == position:
+            last_byte = self.byte_range[1]
+        if position == self.position and last_byte == self.last_byte:
+            return
+        if self.fill is not None:
+            self.fill.abort()
+            self.fill = None
+        self.close()
+        self.position = position
+        self.last_byte = last_byte
 
     def close(self):
-        self.conn.close()
-
-
-class UploadFile(object):
-    """A file-like object for uploading files to Openstack Swift."""
+        if self.fill is not None:
+            # Only complete objects are added
+            self.fill.abort()
+            self.fill = None
+        if self.prefetcher is not None:
+            if not self.prefetcher.close():
+                logging.warning('Read-ahead of %s still running', self.path)
+            self.prefetcher = None
+            self.ahead = ''
+        self.close_stream()
+
+    def close_stream(self):
+        with self._lock:
+            if self.started is not None:
+                # Account the GET with the time until the data was consumed
+                self.record('get_object', self.started, self.resp.status,
+                            self.received)
+                self.started = None
+            if self.conn:
+                # Only a fully consumed response leaves the connection
+                # reusable
+                self.release_conn(self.conn, self.resp.isclosed() and
+                                  not self.resp.will_close)
+                self.conn = None
+                self.resp = None
+
+
+class UploadFile(SwiftFile):
+    """A file-like object for uploading files to Openstack Swift.
+
+    Uploads are streamed as one chunked PUT. If segment_size is set, uploads
+    larger than segment_threshold (or of unknown length and larger than one
+    segment) are stored as a Static Large Object instead: write() cuts the
+    data into segments, which are uploaded to '<container>_segments' by
+    segment_workers threads, and close() commits the manifest. Failed segment
+    PUTs are retried segment_retries times. At most segment_workers + 2
+    segments are held in memory.
+
+    Large chunks are sent without copying them: the chunk framing is sent
+    separately, and segments are collected in a bytearray and sent from it.
+
+    The data is checked before the upload is committed: an upload with
+    fewer or more bytes than content_length, or whose MD5 differs from
+    etag (the Content-MD5 of the client), is discarded. The ETag returned
+    by Swift for a single object is compared to the MD5 of the data sent.
+
+    If a MetadataCache is given, close() drops its entries for the object.
+    """
 
-    def __init__(self, storage_url, token, container, objname, content_length):
-        headers = {'X-Auth-Token': token,
-                   'Content-Length': str(content_length),
-                   'Transfer-Encoding': 'chunked'}
+    max_segments = 1000  # default max_manifest_segments of Swift
 
-        container = urllib.quote(container)
-        objname = urllib.quote(objname)
+    def __init__(self, storage_url, token, container, objname, content_length,
+                 conn_pool=None, segment_size=None, segment_threshold=None,
+                 segment_workers=4, segment_retries=3, metadata=None,
+                 recorder=None, etag=None):
+        self.storage_url = storage_url
+        self.metadata = metadata
+        self.recorder = recorder
+        self.token = token
+        self.container = container
+        self.objname = objname
+        self.conn_pool = conn_pool
+        self.segment_size = segment_size
+        self.segment_workers = segment_workers
+        self.segment_retries = segment_retries
 
         url = urlparse.urlparse(storage_url)
-        path = "%s/%s/%s" % (url.path, container, objname)
-        if url.scheme == "http":
-            self.conn = httplib.HTTPConnection(url.netloc)
-        elif url.scheme == "https":
-            self.conn = httplib.HTTPSConnection(url.netloc)
-        else:
-            raise Exception
+        self.account_path = url.path
+        self.path = self.object_path(container, objname)
 
+        self.conn = None
+        self.resp = None
         self.closed = False
-        self.conn.request('PUT', path, None, headers)
+        # Data of the current segment, or of the object in 'buffer' mode
+        self.segment = bytearray()
+        # Trailer of the last chunk, sent with the framing of the next one
+        self.pending = ''
+        self.workers = None
+        self.segment_count = 0
+        self.segment_names = []
+        # Start time and bytes sent of a streamed PUT, for the metrics
+        self.started = None
+        self.sent = 0
+
+        try:
+            length = int(content_length)
+        except (TypeError, ValueError):
+            length = None
+        self.length = length
+        self.received = 0
+        self.etag = etag
+        # MD5 of the data, computed while it is written unless only needed
+        # for a buffered object; segments are checked by their own ETags
+        self.md5 = hashlib.md5() if etag or not segment_size or \
+            length is not None and length <= (segment_threshold or 0) \
+            else None
+
+        if segment_size and length is None:
+            # Wait for the first segment to decide
+            self.mode = 'buffer'
+        elif segment_size and length > (segment_threshold or 0):
+            # Keep within the manifest segment limit of Swift
+            self.segment_size = max(segment_size,
+                                    -(-length // self.max_segments))
+            self.start_segments()
+        else:
+            self.mode = 'stream'
+            headers = {'X-Auth-Token': token,
+                       'Content-Length': str(content_length),
+                       'Transfer-Encoding': 'chunked'}
+            if etag:
+                headers['ETag'] = etag
+            self.conn = self.get_conn()
+            self.started = time.time()
+            try:
+                self.conn.request('PUT', self.path, None, headers)
+                # Don't delay the small framing writes
+                self.conn.sock.setsockopt(socket.IPPROTO_TCP,
+                                          socket.TCP_NODELAY, 1)
+            except Exception:
+                self.record('put_object', self.started, None)
+                self.release_conn(self.conn, False)
+                raise
+
+    def object_path(self, container, objname):
+        return "%s/%s/%s" % (self.account_path, urllib.quote(container),
+                             urllib.quote(objname))
+
+    def request(self, operation, method, path, body=None, headers=None):
+        """Send a single request on a pooled connection.
+
+        operation is the name the request is accounted as in the metrics.
+        Returns the response, its body is available as resp.body.
+        """
+        headers = dict(headers or {})
+        headers['X-Auth-Token'] = self.token
+        if body is not None:
+            headers['Content-Length'] = str(len(body))
+        conn = self.get_conn()
+        started = time.time()
+        try:
+            conn.request(method, path, body, headers)
+            resp = conn.getresponse()
+            resp.body = resp.read()
+        except Exception:
+            self.record(operation, started, None, len(body or ''))
+            self.release_conn(conn, False)
+            raise
+        self.record(operation, started, resp.status, len(body or ''))
+        self.release_conn(conn, not resp.will_close)
+        return resp
+
+    def check_response(self, resp, msg):
+        if resp.status < 200 or resp.status >= 300:
+            raise client.ClientException(msg,
+                                         http_status=resp.status,
+                                         http_reason=resp.reason,
+                                         http_response_content=resp.body)
+
+    def start_segments(self):
+        self.mode = 'segments'
+        self.segment_container = segment_container(self.container)
+        self.segment_prefix = '%s/slo/%f/%d' % (self.objname, time.time(),
+                                                self.segment_size)
+        resp = self.request('put_container', 'PUT', "%s/%s" % (
+            self.account_path, urllib.quote(self.segment_container)), '')
+        self.check_response(resp, 'Segment container PUT failed')
+        if self.metadata:
+            self.metadata.invalidate(self.storage_url,
+                                     self.segment_container)
+        self.workers = workers.WorkerPool(self.segment_workers, 1)
+
+    def spawn_segment(self, data):
+        name = '%s/%08d' % (self.segment_prefix, self.segment_count)
+        self.segment_names.append(name)
+        self.workers.spawn(self.upload_segment, self.segment_count, name,
+                           data)
+        self.segment_count += 1
+
+    def upload_segment(self, index, name, data):
+        etag = hashlib.md5(data).hexdigest()
+        path = self.object_path(self.segment_container, name)
+        for attempt in range(self.segment_retries + 1):
+            try:
+                resp = self.request('put_segment', 'PUT', path, data,
+                                    {'ETag': etag})
+                self.check_response(resp, 'Segment PUT failed')
+                break
+            except (client.ClientException, httplib.HTTPException,
+                    socket.error):
+                if attempt == self.segment_retries:
+                    raise
+                time.sleep(0.1 * 2 ** attempt)
+        return index, {'path': '/%s/%s' % (self.segment_container, name),
+                       'etag': etag,
+                       'size_bytes': len(data)}
+
+    def cleanup_segments(self):
+        """Delete all segments of this upload."""
+        names, self.segment_names = self.segment_names, []
+        for name in names:
+            try:
+                self.request('delete_segment', 'DELETE',
+                             self.object_path(self.segment_container, name))
+            except (httplib.HTTPException, socket.error):
+                pass
 
     def write(self, data):
-        self.conn.send('%x\r\n%s\r\n' % (len(data), data))
+        if not data:
+            # An empty chunk would end the upload
+            return
+        self.received += len(data)
+        if self.md5 is not None:
+            self.md5.update(data)
+        if self.mode == 'stream':
+            header = '%s%x\r\n' % (self.pending, len(data))
+            if len(data) <= SMALL_CHUNK:
+                self.conn.send(header + data)
+            else:
+                self.conn.send(header)
+                self.conn.send(data)
+            self.pending = '\r\n'
+            self.sent += len(data)
+            return
+
+        view = memoryview(data)
+        while len(view):
+            free = self.segment_size - len(self.segment)
+            if not free:
+                # A full segment is only sent once more data follows, so an
+                # upload of exactly one segment stays a single object
+                if self.mode == 'buffer':
+                    self.start_segments()
+                self.spawn_segment(self.segment)
+                self.segment = bytearray()
+                continue
+            self.segment += view[:free]
+            view = view[free:]
+
+    def check_data(self):
+        """Raise ClientException if the data is incomplete or corrupted."""
+        if self.length is not None and self.received != self.length:
+            raise client.ClientException(
+                'Upload incomplete: received %d of %d bytes' % (
+                    self.received, self.length), http_status=400)
+        if self.etag and self.md5.hexdigest() != self.etag:
+            raise client.ClientException('Content-MD5 mismatch',
+                                         http_status=400)
+
+    def check_etag(self, etag):
+        """Compare the ETag of a stored object with the data sent."""
+        if etag and etag.strip('"') != self.md5.hexdigest():
+            raise client.ClientException(
+                'ETag mismatch: Swift stored %s, sent %s' % (
+                    etag, self.md5.hexdigest()), http_status=502)
 
     def close(self):
-        if not self.closed:
-            self.conn.send('0\r\n\r\n')
-            self.conn.close()
-            self.closed = True
+        """Commit the upload; raise DAVError if it was not stored."""
+        try:
+            self.finish()
+        except client.ClientException as ex:
+            logging.warning('Upload of /%s/%s failed: %s', self.container,
+                            self.objname, ex)
+            raise as_dav_error(ex)
+
+    def finish(self):
+        """Commit the upload; raise ClientException if it failed."""
+        if self.closed:
+            return
+        try:
+            self.check_data()
+        except client.ClientException:
+            self.abort()
+            raise
+        self.closed = True
+        try:
+            if self.mode == 'stream':
+                try:
+                    self.conn.send(self.pending + '0\r\n\r\n')
+                    # Read the response, otherwise the connection can't be
+                    # reused
+                    self.resp = self.conn.getresponse()
+                    self.resp.body = self.resp.read()
+                except Exception:
+                    self.record('put_object', self.started, None, self.sent)
+                    self.release_conn(self.conn, False)
+                    raise
+                self.record('put_object', self.started, self.resp.status,
+                            self.sent)
+                self.release_conn(self.conn, not self.resp.will_close)
+                self.check_response(self.resp, 'Object PUT failed')
+                self.check_etag(self.resp.getheader('etag'))
+            elif self.mode == 'buffer':
+                data = memoryview(self.segment)
+                if self.md5 is None:
+                    self.md5 = hashlib.md5(data)
+                # Swift answers 422 if the data doesn't match the ETag
+                self.resp = self.request('put_object', 'PUT', self.path,
+                                         data,
+                                         {'ETag': self.md5.hexdigest()})
+                self.segment = bytearray()
+                self.check_response(self.resp, 'Object PUT failed')
+                self.check_etag(self.resp.getheader('etag'))
+            else:
+                self.close_segments()
+        finally:
+            if self.metadata:
+                self.metadata.invalidate(self.storage_url, self.container,
+                                         self.objname)
+                if self.mode == 'segments':
+                    self.metadata.invalidate(self.storage_url,
+                                             self.segment_container,
+                                             self.segment_prefix)
+
+    def close_segments(self):
+        if self.segment or not self.segment_count:
+            self.spawn_segment(self.segment)
+            self.segment = bytearray()
+        results, errors = self.workers.join()
+        if errors:
+            self.cleanup_segments()
+            raise errors[0][1]
+        manifest = [segment for _, segment in sorted(results)]
+        try:
+            self.resp = self.request('put_manifest', 'PUT',
+                                     self.path + '?multipart-manifest=put',
+                                     json.dumps(manifest))
+            self.check_response(self.resp, 'Manifest PUT failed')
+        except Exception:
+            self.cleanup_segments()
+            raise
+
+    def abort(self):
+        """Abort the upload and remove already uploaded segments."""
+        if self.mode == 'stream' and not self.closed:
+            # Closing without the last chunk discards the object in Swift
+            self.record('put_object', self.started, None, self.sent)
+            self.release_conn(self.conn, False)
+        elif self.mode == 'segments':
+            if not self.closed:
+                self.workers.join()
+            self.cleanup_segments()
+        self.closed = True
+        self.segment = bytearray()
 
 
 class ObjectResource(dav_provider.DAVNonCollection):
-    def __init__(self, container, objectname, environ, objects=None):
+    def __init__(self, container, objectname, environ, objects=None,
+                 headers=None, download=None, info=None):
         self.container = container
         self.objectname = objectname
         self.environ = environ
@@ -138,67 +1551,79 @@ class ObjectResource(dav_provider.DAVNonCollection):
         self.auth_token = self.environ.get('swift_auth_token')
         self.storage_url = self.environ.get('swift_storage_url')
 
-        self.headers = None
+        if info is None and headers is not None:
+            info = ObjectInfo.from_headers(headers)
+        self.info = info
+        self.download = download
         self.tmpfile = None
-        self.http_connection = client.http_connection(
-            self.storage_url,
-            insecure=self.environ.get('insecure'))
+        # Set if a copy shares the segments of this large object
+        self.shared_segments = False
 
     def supportRanges(self):
-        return False
+        return True
 
-    def get_headers(self):
-        """Execute HEAD object request.
+    def get_info(self):
+        """Return the ObjectInfo of the object.
 
-        Since this info is used in different methods (see below),
-        do it once and then use this info.
+        It is taken from the listing of the collection if possible,
+        otherwise from a HEAD request; either only once.
         """
-
-        if self.headers is None:
-            data = self.objects.get(self.objectname)
+        if self.info is None:
+            data = self.objects.get(self.objectname) if self.objects else None
             if data:
-                self.headers = {'content-length': data.get('bytes'),
-                                'etag': data.get('hash'),
-                                'last_modified': data.get('last_modified'),
-                                }
+                self.info = ObjectInfo.from_listing(data)
             else:
                 try:
-                    self.headers = client.head_object(
-                        self.storage_url,
-                        self.auth_token,
-                        self.container,
-                        self.objectname,
-                        http_conn=self.http_connection)
+                    headers = head(self.environ, self.container,
+                                   self.objectname)
                 except client.ClientException:
-                    self.headers = {}
-                    pass
+                    headers = {}
+                self.info = ObjectInfo.from_headers(headers)
+        return self.info
+
+    def get_byte_range(self):
+        """Return the (first, last) byte wsgidav will send, or None.
+
+        wsgidav sorts and merges multiple ranges and only serves the first
+        one of the list it returns, which is the range with the highest
+        offset (e.g. 4-5 for "bytes=0-1,4-5"); only this one is requested
+        from Swift.
+        """
+        rangetext = self.environ.get('HTTP_RANGE')
+        if not rangetext:
+            return None
+        try:
+            ranges, _ = util.obtainContentRanges(rangetext,
+                                                 self.getContentLength())
+        except (TypeError, ValueError):
+            return None
+        if not ranges:
+            return None
+        return ranges[0][0], ranges[0][1]
 
     def getContent(self):
+        if self.download:
+            # Already opened by ObjectCollection.getMember
+            download, self.download = self.download, None
+            return download
         return DownloadFile(self.storage_url, self.auth_token,
-                            self.container, self.objectname)
+                            self.container, self.objectname,
+                            conn_pool=raw_pool(self.environ),
+                            byte_range=self.get_byte_range(),
+                            recorder=backend_recorder(self.environ),
+                            **readahead_options(self.environ))
 
     def getContentLength(self):
-        self.get_headers()
-        return int(self.headers.get('content-length'))
+        return self.get_info().size
 
     def getContentType(self):
-        self.get_headers()
-        return self.headers.get('content-type', 'application/octet-stream')
+        return self.get_info().content_type
 
     def getCreationDate(self):
-        self.get_headers()
-        lastmod = self.headers.get('last_modified')
-        try:
-            return time.mktime(time.strptime(lastmod, "%Y-%m-%dT%H:%M:%S.%f"))
-        except (ValueError, TypeError):
-            pass
+        return self.get_info().modified
 
     def getEtag(self):
-        self.get_headers()
-        etag = self.headers.get('etag')
-        if etag:
-            return str(etag)
-        return None
+        return self.get_info().etag
 
     def getLastModified(self):
         """Return LastModified, which is identical to CreationDate."""
@@ -206,35 +1631,103 @@ class ObjectResource(dav_provider.DAVNonCollection):
         return self.getCreationDate()
 
     def delete(self):
+        """Delete the object, and its segments if it is a large object."""
+        spool_discard(self.environ, self.container, self.objectname)
+        query_string = None
+        if not self.shared_segments:
+            try:
+                if is_large_object(head(self.environ, self.container,
+                                        self.objectname)):
+                    query_string = 'multipart-manifest=delete'
+            except client.ClientException:
+                pass
         try:
-                client.delete_object(self.storage_url,
-                                     self.auth_token,
-                                     self.container,
-                                     self.objectname,
-                                     http_conn=self.http_connection)
+                swift_call(self.environ, client.delete_object,
+                           self.container,
+                           self.objectname,
+                           query_string=query_string)
         except client.ClientException:
             pass
+        invalidate(self.environ, self.container, self.objectname)
+        if query_string:
+            invalidate(self.environ, segment_container(self.container),
+                       self.objectname + '/', tree=True)
 
-    def handleCopy(self, destPath, depthInfinity):
+    def supportRecursiveMove(self, destPath):
         return False
 
+    def copyMoveSingle(self, destPath, isMove):
+        """Copy the object server-side; wsgidav deletes it after a MOVE."""
+        container, name = getnames(destPath)
+        spool_flush(self.environ, self.container, self.objectname)
+        try:
+            self.shared_segments = copy_object(
+                self.environ, self.container, self.objectname, container,
+                name)
+        except client.ClientException as ex:
+            raise as_dav_error(ex)
+
     def beginWrite(self, contentType=None):
         content_length = self.environ.get('CONTENT_LENGTH')
-
-        self.tmpfile = UploadFile(self.storage_url, self.auth_token,
-                                  self.container, self.objectname,
-                                  content_length)
+        etag = content_md5(self.environ)
+
+        upload_spool = self.provider.upload_spool
+        if upload_spool is not None:
+            if upload_spool.accepts(content_length) and \
+                    self.container_exists():
+                upload_spool.remember(self.environ)
+                self.tmpfile = upload_spool.open(
+                    self.storage_url, self.container, self.objectname,
+                    int(content_length), etag)
+                return self.tmpfile
+            # A spooled older version must not overwrite this upload
+            upload_spool.discard(self.storage_url, self.container,
+                                 self.objectname)
+
+        self.tmpfile = UploadFile(
+            self.storage_url, self.auth_token,
+            self.container, self.objectname,
+            content_length,
+            conn_pool=raw_pool(self.environ),
+            segment_size=self.provider.segment_size,
+            segment_threshold=self.provider.segment_threshold,
+            segment_workers=self.provider.segment_workers,
+            segment_retries=self.provider.segment_retries,
+            metadata=self.provider.metadata,
+            recorder=backend_recorder(self.environ),
+            etag=etag)
         return self.tmpfile
 
 
+    def container_exists(self):
+        """Check the container of a spooled upload, usually cached.
+
+        Uploads to missing containers are sent to Swift to fail there.
+        """
+        try:
+            head(self.environ, self.container)
+            return True
+        except client.ClientException:
+            return False
+
     def endWrite(self, withErrors):
         if self.tmpfile:
+            if withErrors:
+                self.tmpfile.abort()
+                return
             self.tmpfile.close()
+            if isinstance(self.tmpfile, UploadFile):
+                # Spooled uploads do this once they are sent to Swift
+                delete_old_segments(
+                    self.environ, self.container, self.objectname,
+                    self.tmpfile.segment_prefix
+                    if self.tmpfile.mode == 'segments' else None)
             raise dav_error.DAVError(dav_error.HTTP_CREATED)
 
 
 class ObjectCollection(dav_provider.DAVCollection):
-    def __init__(self, container, environ, prefix=None, path=None):
+    def __init__(self, container, environ, prefix=None, path=None,
+                 stats=None):
         self.path = path
         path = container
         if path[0] != '/':
@@ -250,10 +1743,30 @@ class ObjectCollection(dav_provider.DAVCollection):
         self.auth_token = self.environ.get('swift_auth_token')
         self.storage_url = self.environ.get('swift_storage_url')
         self.objects = {}
+        # ContainerStats of a container from the account listing or HEAD
+        self.stats = stats
 
-        self.http_connection = client.http_connection(
-            self.storage_url,
-            insecure=self.environ.get('insecure'))
+    def getCreationDate(self):
+        if self.stats is not None:
+            return self.stats.created
+        return None
+
+    def getPropertyNames(self, isAllProp):
+        """Add quota-used-bytes (RFC 4331) of containers.
+
+        Like all quota properties it is not part of allprop.
+        """
+        names = super(ObjectCollection, self).getPropertyNames(isAllProp)
+        if not isAllProp and self.stats is not None and \
+                self.stats.size is not None:
+            names.append(QUOTA_USED_BYTES)
+        return names
+
+    def getPropertyValue(self, propname):
+        if propname == QUOTA_USED_BYTES and self.stats is not None and \
+                self.stats.size is not None:
+            return str(self.stats.size)
+        return super(ObjectCollection, self).getPropertyValue(propname)
 
     def is_subdir(self, name):
         """Checks if given name is a subdir.
@@ -273,26 +1786,14 @@ class ObjectCollection(dav_provider.DAVCollection):
         name = name.replace(self.container + '/', '')
 
         obj = self.objects.get(name, self.objects.get(name + '/'))
-        if not obj:
-            _, objects = client.get_container(self.storage_url,
-                                              self.auth_token,
-                                              container=self.container,
-                                              http_conn=self.http_connection)
-            for obj in objects:
-                objname = obj.get('name')
-                self.objects[objname] = obj
-
-            _, objects = client.get_container(self.storage_url,
-                                              self.auth_token,
-                                              container=self.container,
-                                              delimiter='/',
-                                              prefix=name,
-                                              http_conn=self.http_connection)
-            for obj in objects:
-                objname = obj.get('name', obj.get('subdir'))
-                self.objects[objname] = obj
-
-        obj = self.objects.get(name, self.objects.get(name + '/', {}))
+        if obj is None:
+            # Any entry below "name/" (including the marker object) makes
+            # it a subdir; one entry is enough to know.
+            for _ in iter_listing(self.environ, self.container,
+                                  page_size=1, prefix=name + '/'):
+                return True
+            return False
+
         if obj.get('subdir') or \
                 obj.get('content_type') == 'application/directory':
             return True
@@ -300,21 +1801,17 @@ class ObjectCollection(dav_provider.DAVCollection):
         return False
 
     def getMemberNames(self):
-        _stat, objects = client.get_container(self.storage_url,
-                                              self.auth_token,
-                                              container=self.container,
-                                              delimiter='/',
-                                              prefix=self.prefix,
-                                              http_conn=self.http_connection)
-
         self.objects = {}
 
         childs = []
-        for obj in objects:
+        seen = set()
+        for obj in iter_listing(self.environ, self.container,
+                                delimiter='/', prefix=self.prefix):
             name = obj.get('name')
             if name and name != self.prefix:
                 name = name.encode("utf8")
                 childs.append(name)
+                seen.add(name)
                 self.objects[name] = obj
             subdir = obj.get('subdir')
             if subdir and subdir != self.prefix:
@@ -323,11 +1820,152 @@ class ObjectCollection(dav_provider.DAVCollection):
                 # there might be two entries:
                 # 1. object with type application/directory and no trailing '/'
                 # 2. subdir entry with trailing '/'
-                if subdir not in childs:
+                if subdir not in seen:
                     childs.append(subdir)
+                    seen.add(subdir)
                     self.objects[subdir] = obj
         return childs
 
+    def getMemberList(self):
+        return list(self.iter_members())
+
+    def iter_members(self):
+        """Yield the members built from the listing data while it arrives.
+
+        Unlike getMember() this needs no HEAD request per member, so a
+        Depth:1 PROPFIND only requests the listing pages. Members are the
+        same as the names of getMemberNames().
+        """
+        seen = set()
+        spooled = self.spooled_members()
+        for obj in iter_listing(self.environ, self.container,
+                                delimiter='/', prefix=self.prefix):
+            name = obj.get('name')
+            if name:
+                name = name.encode('utf8')
+                if name == self.prefix:
+                    continue
+                seen.add(name)
+                if name in spooled:
+                    # The spooled upload replaces this object
+                    yield spooled.pop(name)
+                elif obj.get('content_type') == 'application/directory':
+                    yield ObjectCollection(self.container, self.environ,
+                                           prefix=name)
+                else:
+                    yield ObjectResource(self.container, name, self.environ,
+                                         info=ObjectInfo.from_listing(obj))
+            subdir = obj.get('subdir')
+            if subdir:
+                subdir = subdir.encode('utf8')
+                if subdir == self.prefix:
+                    continue
+                subdir = subdir.rstrip('/')
+                if subdir not in seen:
+                    seen.add(subdir)
+                    yield ObjectCollection(self.container, self.environ,
+                                           prefix=subdir)
+        for name, res in sorted(spooled.items()):
+            if name not in seen:
+                yield res
+
+    def spooled_members(self):
+        """Return the members of spooled uploads by name.
+
+        Uploads below a pseudofolder make it a member; see
+        spool.UploadSpool.
+        """
+        upload_spool = self.provider.upload_spool
+        if upload_spool is None:
+            return {}
+        prefix = self.prefix or ''
+        members = {}
+        for entry in upload_spool.listing(self.storage_url, self.container,
+                                          prefix):
+            name, slash, _ = entry.name[len(prefix):].partition('/')
+            name = prefix + name
+            if slash:
+                members[name] = ObjectCollection(self.container, self.environ,
+                                                 prefix=name)
+            elif name not in members:
+                members[name] = ObjectResource(
+                    self.container, name, self.environ,
+                    info=ObjectInfo.from_headers(entry.headers))
+        return members
+
+    def spooled_entries(self):
+        """Return (name, 0, entry) of the spooled uploads below this
+        collection, sorted like a listing."""
+        upload_spool = self.provider.upload_spool
+        if upload_spool is None:
+            return []
+        return sorted((entry.name, 0, entry) for entry in upload_spool.listing(
+            self.storage_url, self.container, self.prefix or ''))
+
+    def getDescendants(self, collections=True, resources=True,
+                       depthFirst=False, depth='infinity', addSelf=False):
+        """Return the members of all levels from one flat listing.
+
+        wsgidav would request a delimiter listing for every pseudofolder;
+        with Depth:infinity the subtree is listed once without delimiter
+        instead. The result is an iterator yielding the members while the
+        listing pages arrive. Depth-first order (only used by DELETE, which
+        is handled by delete()) and other depths use the default.
+        """
+        if depth != 'infinity' or depthFirst:
+            return super(ObjectCollection, self).getDescendants(
+                collections, resources, depthFirst, depth, addSelf)
+        return self.iter_tree(collections, resources, addSelf)
+
+    def iter_tree(self, collections=True, resources=True, addSelf=False):
+        """Yield the collections and resources below this collection.
+
+        Pseudofolders are derived from the object names, so folders without
+        a marker object are included. Spooled uploads are merged into the
+        listing in name order and replace listed objects of the same name.
+        Every folder is yielded before its members.
+        """
+        if addSelf:
+            yield self
+        prefix = self.prefix or ''
+        folders = set()
+        listing = ((obj['name'].encode('utf8'), 1, obj) for obj in
+                   iter_listing(self.environ, self.container, prefix=prefix))
+        previous = None
+        for name, listed, obj in heapq.merge(self.spooled_entries(),
+                                             listing):
+            if name == previous:
+                # Replaced by the spooled upload
+                continue
+            previous = name
+            is_folder = listed and \
+                obj.get('content_type') == 'application/directory'
+            name = name[len(prefix):]
+            parts = name.rstrip('/').split('/')
+            if not parts[-1]:
+                # Marker object of this collection
+                continue
+            if not is_folder and not name.endswith('/'):
+                name = parts.pop()
+            else:
+                name = None
+            path = ''
+            for part in parts:
+                path += part
+                if path not in folders:
+                    folders.add(path)
+                    if collections:
+                        yield ObjectCollection(self.container, self.environ,
+                                               prefix=prefix + path)
+                path += '/'
+            if name is not None and resources:
+                if listed:
+                    info = ObjectInfo.from_listing(obj)
+                else:
+                    info = ObjectInfo.from_headers(obj.headers)
+                yield ObjectResource(self.container, prefix + path + name,
+                                     self.environ, info=info)
+
     def getMember(self, objectname):
         """Get member for this ObjectCollection.
 
@@ -340,47 +1978,177 @@ class ObjectCollection(dav_provider.DAVCollection):
             return ObjectCollection(self.container, self.environ,
                                     prefix=objectname)
         if self.environ.get('REQUEST_METHOD') in ['PUT']:
+            info = None
+            if not any(name in self.environ for name in CONDITIONS):
+                # wsgidav only uses the properties to evaluate conditions;
+                # don't HEAD the object for them
+                info = ObjectInfo(None, None, None, None)
             return ObjectResource(self.container, objectname,
-                                  self.environ, self.objects)
+                                  self.environ, self.objects, info=info)
+        target = self.environ.get('PATH_INFO', '').rstrip('/') == \
+            '/' + self.container + '/' + objectname
+        conditions = revalidation(self.environ) if target else {}
+        spooled = self.get_spooled(objectname)
+        if spooled is not None:
+            if conditions:
+                self.check_modified(conditions, spooled.headers, spooled)
+            return ObjectResource(self.container, objectname, self.environ,
+                                  self.objects, headers=spooled.headers,
+                                  download=spooled)
+        if conditions:
+            # Answer revalidations from cached metadata if possible
+            headers = head(self.environ, self.container, objectname,
+                           fetch=False)
+            if headers and not is_directory_marker(headers):
+                self.check_modified(conditions, headers)
+        if target and self.environ.get('REQUEST_METHOD') == 'GET' and \
+                'HTTP_IF_MATCH' not in self.environ and \
+                'HTTP_IF_UNMODIFIED_SINCE' not in self.environ:
+            # With other conditions wsgidav might fail the request before
+            # reading the content; the GET is then sent by getContent()
+            return self.get_download(objectname, conditions)
         try:
-            client.head_object(self.storage_url,
-                               self.auth_token,
-                               self.container,
-                               objectname,
-                               http_conn=self.http_connection)
+            headers = head(self.environ, self.container, objectname)
+            if is_directory_marker(headers):
+                return ObjectCollection(self.container, self.environ,
+                                        prefix=objectname)
+            if conditions:
+                self.check_modified(conditions, headers)
             return ObjectResource(self.container, objectname,
-                                  self.environ, self.objects)
+                                  self.environ, self.objects, headers=headers)
         except client.ClientException:
             pass
         return None
 
-    def delete(self):
-        prefix = '/'.join(self.path.split('/')[2:])
-        if '/' + self.container == self.path:
-            try:
-                client.delete_container(self.storage_url,
-                                        self.auth_token,
-                                        self.container,
-                                        http_conn=self.http_connection)
-            except client.ClientException:
-                pass
-        else:
+    def get_spooled(self, objectname):
+        """Return the SpooledFile of an upload not yet sent to Swift."""
+        upload_spool = self.provider.upload_spool
+        if upload_spool is None:
+            return None
+        return upload_spool.get(self.storage_url, self.container, objectname)
+
+    @staticmethod
+    def check_modified(conditions, headers, download=None):
+        """Answer 304 if the client's copy matches headers.
+
+        download is closed in this case.
+        """
+        if not_modified(conditions, headers):
+            if download is not None:
+                download.close()
+            raise dav_error.DAVError(dav_error.HTTP_NOT_MODIFIED)
+
+    def get_download(self, objectname, conditions=None):
+        """Return an ObjectResource with an already opened GET request.
+
+        The GET replaces the HEAD request; its status is the existence check
+        and its headers are used for the resource properties. A single Range
+        from the client is passed on, unless it depends on If-Range.
+
+        conditions (see revalidation()) are passed on as well, so Swift
+        answers 304 instead of sending the object if the client's copy is
+        current; the client then gets a 304 as well.
+
+        Returns None if the object doesn't exist; other failures of the GET
+        raise a DAVError with the status of Swift.
+        """
+        conditions = conditions or {}
+        range_header = self.environ.get('HTTP_RANGE')
+        if not range_header or ',' in range_header or \
+                'HTTP_IF_RANGE' in self.environ:
+            range_header = None
+        download = DownloadFile(self.storage_url, self.auth_token,
+                                self.container, objectname,
+                                conn_pool=raw_pool(self.environ),
+                                recorder=backend_recorder(self.environ),
+                                **readahead_options(self.environ))
+        content_cache = self.provider.content_cache
+        cached = None
+        if content_cache is not None:
+            key = content_cache.make_key(self.storage_url, self.container,
+                                         objectname)
+            cached = content_cache.get(key)
+        swift_conditions = dict(conditions)
+        if cached is not None:
+            # Swift answers 304 if the cached copy is current. Swift might
+            # answer 304 for If-Modified-Since regardless of the ETag, so
+            # it is only checked here.
+            tags = [conditions.get('If-None-Match'),
+                    '"%s"' % cached.etag.strip('"')]
+            swift_conditions['If-None-Match'] = ', '.join(filter(None, tags))
+            swift_conditions.pop('If-Modified-Since', None)
+        try:
             try:
-                client.delete_object(self.storage_url,
-                                     self.auth_token,
-                                     self.container,
-                                     prefix + '/',
-                                     http_conn=self.http_connection)
+                headers = download.open(range_header, swift_conditions)
+            except client.ClientException as ex:
+                if ex.http_status == 304:
+                    headers = download.response_headers
+                    download = None
+                elif ex.http_status == 416 and range_header:
+                    # Let wsgidav answer unsatisfiable ranges
+                    headers = download.open(conditions=swift_conditions)
+                else:
+                    raise
+        except client.ClientException as ex:
+            if cached is not None:
+                cached.close()
+            if ex.http_status == 404:
+                return None
+            # Other failures don't mean the object is missing
+            raise as_dav_error(ex)
+
+        if download is None:
+            if cached is not None and (
+                    not conditions or
+                    str(headers.get('etag')).strip('"') ==
+                    cached.etag.strip('"')):
+                headers = content_cache.use(cached, headers)
+                download, cached = cached, None
+            else:
+                # Only the client's copy is current
+                if cached is not None:
+                    cached.close()
+                raise dav_error.DAVError(dav_error.HTTP_NOT_MODIFIED)
+        if cached is not None:
+            content_cache.discard(cached)
+        if is_directory_marker(headers):
+            download.close()
+            return ObjectCollection(self.container, self.environ,
+                                    prefix=objectname)
+        cache_headers(self.environ, self.container, objectname, headers)
+        if conditions:
+            self.check_modified(conditions, headers, download)
+        if content_cache is not None and not range_header and \
+                isinstance(download, DownloadFile):
+            # Store the object while it is sent to the client
+            download.fill = content_cache.start_fill(key, headers)
+        return ObjectResource(self.container, objectname, self.environ,
+                              self.objects, headers=headers,
+                              download=download)
+
+    def supportRecursiveDelete(self):
+        return True
 
-            except client.ClientException:
-                pass
+    def handleDelete(self):
+        """Delete recursively, without letting wsgidav list all members."""
+        return self.delete() or True
+
+    def delete(self):
+        """Delete this container or pseudofolder and all objects below it.
+
+        Returns the list of objects that could not be deleted, which wsgidav
+        reports as multistatus response.
+        """
+        errors = delete_tree(self.environ, self.container, self.prefix or '')
+        if errors or self.prefix:
+            return errors
+        return delete_container(self.environ, self.container)
 
     def createEmptyResource(self, name):
-        client.put_object(self.storage_url,
-                          self.auth_token,
-                          self.container,
-                          sanitize(name),
-                          http_conn=self.http_connection)
+        swift_call(self.environ, client.put_object,
+                   self.container,
+                   sanitize(name))
+        invalidate(self.environ, self.container, sanitize(name))
         return ObjectResource(self.container, name, self.environ, self.objects)
 
     def createCollection(self, name):
@@ -390,92 +2158,85 @@ class ObjectCollection(dav_provider.DAVCollection):
             name = '/'.join(tmp[2:]) + '/' + name
         name = name.strip('/')
         try:
-            client.head_object(self.storage_url,
-                               self.auth_token,
-                               self.container,
-                               name,
-                               http_conn=self.http_connection)
+            swift_call(self.environ, client.head_object,
+                       self.container,
+                       name)
             raise dav_error.DAVError(dav_error.HTTP_METHOD_NOT_ALLOWED)
         except client.ClientException:
             pass
 
         try:
-            client.head_object(self.storage_url,
-                               self.auth_token,
-                               self.container,
-                               name + '/',
-                               http_conn=self.http_connection)
+            swift_call(self.environ, client.head_object,
+                       self.container,
+                       name + '/')
             raise dav_error.DAVError(dav_error.HTTP_METHOD_NOT_ALLOWED)
         except client.ClientException:
             pass
 
-        client.put_object(self.storage_url,
-                          self.auth_token,
-                          self.container,
-                          sanitize(name).rstrip('/') + '/',
-                          content_type='application/directory',
-                          http_conn=self.http_connection)
+        swift_call(self.environ, client.put_object,
+                   self.container,
+                   sanitize(name).rstrip('/') + '/',
+                   content_type='application/directory')
+        invalidate(self.environ, self.container,
+                   sanitize(name).rstrip('/') + '/')
 
     def supportRecursiveMove(self, destPath):
-        """ Simulate support for RecursiveMove """
-
         return True
 
-    def moveRecursive(self, newname):
-        """ Move/rename a container.
+    def create_destination(self, destPath):
+        """Create the container or pseudofolder destPath.
 
-        This is only working for empty containers and objects with a size of 0.
-        Required by some clients because they create a folder "New folder" first.
+        Returns its container and the prefix of its objects.
+        """
+        container, name = getnames(destPath)
+        name = sanitize(name).rstrip('/')
+        if name:
+            swift_call(self.environ, client.put_object, container, name + '/',
+                       contents='', content_type='application/directory')
+            invalidate(self.environ, container, name + '/')
+            return container, name + '/'
+        swift_call(self.environ, client.put_container, container)
+        invalidate(self.environ, container)
+        return container, ''
+
+    def copyMoveSingle(self, destPath, isMove):
+        """Create destPath without members; used by wsgidav as fallback."""
+        try:
+            self.create_destination(destPath)
+        except client.ClientException as ex:
+            raise as_dav_error(ex)
 
-        For all other requests this will simply return HTTP_FORBIDDEN. """
-        oldname = self.path.lstrip('/')
-        newname = newname.lstrip('/')
+    def handleCopy(self, destPath, depthInfinity):
+        """Copy this container or pseudofolder server-side.
 
-        if '/' not in oldname:
-            try:
-                # Container deletion will fail if not empty
-                client.delete_container(self.storage_url,
-                                        self.auth_token,
-                                        oldname)
-                client.put_container(self.storage_url,
-                                     self.auth_token,
-                                     newname)
-            except client.ClientException:
-                raise dav_error.DAVError(dav_error.HTTP_FORBIDDEN)
+        Returns True or the list of objects that could not be copied, which
+        wsgidav reports as multistatus response.
+        """
+        try:
+            container, prefix = self.create_destination(destPath)
+        except client.ClientException as ex:
+            raise as_dav_error(ex)
+        if not depthInfinity:
+            return True
+        return copy_tree(self.environ, self.container, self.prefix or '',
+                         container, prefix) or True
 
-        else:
-            old_container, _, old_object = oldname.partition('/')
-            new_container, _, new_object = newname.partition('/')
-            if old_container != new_container:
-                raise dav_error.DAVError(dav_error.HTTP_FORBIDDEN)
-
-            # If it is a pseudofolder, check that it is empty
-            _, objects = client.get_container(
-                self.storage_url,
-                self.auth_token,
-                container=self.container,
-                delimiter='/',
-                prefix=sanitize(old_object).rstrip('/') + '/',
-                http_conn=self.http_connection)
-            if len(objects) != 1:  # first object is the pseudofolder entry
-                raise dav_error.DAVError(dav_error.HTTP_FORBIDDEN)
-
-            # also check if the object is empty
-            if objects[0].get('bytes') != 0:
-                raise dav_error.DAVError(dav_error.HTTP_FORBIDDEN)
-
-            # Do a COPY to preserve existing metadata and content-type
-            client.put_object(self.storage_url,
-								  self.auth_token,
-								  self.container,
-								  sanitize(new_object),
-                                  headers = {'X-Copy-From': '/' + oldname + '/'},
-								  http_conn=self.http_connection)
-            client.delete_object(self.storage_url,
-                                 self.auth_token,
-                                 self.container,
-                                 old_object + '/',
-                                 http_conn=self.http_connection)
+    def moveRecursive(self, newname):
+        """Move this container or pseudofolder with all objects below it.
+
+        Objects are copied server-side and deleted afterwards, a moved
+        container is deleted when it is empty. Returns the list of objects
+        that could not be moved.
+        """
+        try:
+            container, prefix = self.create_destination(newname)
+        except client.ClientException as ex:
+            raise as_dav_error(ex)
+        errors = copy_tree(self.environ, self.container, self.prefix or '',
+                           container, prefix, move=True)
+        if errors or self.prefix:
+            return errors
+        return delete_container(self.environ, self.container)
 
 
 class ContainerCollection(dav_provider.DAVCollection):
@@ -485,24 +2246,51 @@ class ContainerCollection(dav_provider.DAVCollection):
 
         self.auth_token = self.environ.get('swift_auth_token')
         self.storage_url = self.environ.get('swift_storage_url')
-        self.http_connection = client.http_connection(
-            self.storage_url,
-            insecure=self.environ.get('insecure'))
 
     def getMemberNames(self):
-        _, containers = client.get_account(
-            self.storage_url,
-            self.auth_token,
-            http_conn=self.http_connection)
-        return [container['name'].encode("utf8") for container in containers]
+        return [container['name'].encode("utf8")
+                for container in iter_listing(self.environ)]
+
+    def getMemberList(self):
+        return list(self.iter_members())
+
+    def iter_members(self):
+        """Yield the containers of the account without a HEAD for each.
+
+        Their stats are taken from the account listing.
+        """
+        for container in iter_listing(self.environ):
+            name = container['name'].encode("utf8")
+            stats = ContainerStats.from_listing(container)
+            yield ObjectCollection(name, self.environ, path='/' + name,
+                                   stats=stats)
+
+    def getDescendants(self, collections=True, resources=True,
+                       depthFirst=False, depth='infinity', addSelf=False):
+        """Return all members of the account for Depth:infinity.
+
+        The trees of the next tree_workers containers are listed in
+        parallel; see ObjectCollection.getDescendants() for the result.
+        """
+        if depth != 'infinity' or depthFirst:
+            return super(ContainerCollection, self).getDescendants(
+                collections, resources, depthFirst, depth, addSelf)
+        return self.iter_tree(collections, resources, addSelf)
+
+    def iter_tree(self, collections=True, resources=True, addSelf=False):
+        if addSelf:
+            yield self
+        trees = (functools.partial(container.iter_tree, collections,
+                                   resources, addSelf=collections)
+                 for container in self.iter_members())
+        for res in workers.chain_parallel(trees, self.provider.tree_workers):
+            yield res
 
     def getMember(self, name):
         try:
-            client.head_container(self.storage_url,
-                                  self.auth_token,
-                                  container=name,
-                                  http_conn=self.http_connection)
-            return ObjectCollection(name, self.environ, path=self.path)
+            headers = head(self.environ, name)
+            return ObjectCollection(name, self.environ, path=self.path,
+                                    stats=ContainerStats.from_headers(headers))
         except client.ClientException as ex:
             if '404' in ex:
                 raise dav_error.DAVError(dav_error.HTTP_NOT_FOUND)
@@ -523,13 +2311,12 @@ class ContainerCollection(dav_provider.DAVCollection):
     def delete(self):
         name = self.path.strip('/')
         try:
-            client.delete_container(
-                self.storage_url,
-                self.auth_token,
-                name,
-                http_conn=self.http_connection)
+            swift_call(self.environ, client.delete_container,
+                       name)
         except client.ClientException:
             raise dav_error.DAVError(dav_error.HTTP_INTERNAL_ERROR)
+        finally:
+            invalidate(self.environ, name)
 
     def supportRecursiveMove(self, destPath):
         return False
@@ -541,20 +2328,101 @@ class ContainerCollection(dav_provider.DAVCollection):
         return None
 
     def createCollection(self, name):
-        client.put_container(
-            self.storage_url,
-            self.auth_token,
-            name,
-            http_conn=self.http_connection)
+        swift_call(self.environ, client.put_container,
+                   name)
+        invalidate(self.environ, name)
 
 
 class SwiftProvider(dav_provider.DAVProvider):
-    def __init__(self):
+    def __init__(self, pool_size=16, pool_idle_timeout=60,
+                 pool_max_connections=None,
+                 segment_size=32 * 1024 * 1024,
+                 segment_threshold=1024 * 1024 * 1024,
+                 segment_workers=4, segment_retries=3,
+                 metadata_cache_size=10000, listing_ttl=5, head_ttl=5,
+                 tree_workers=8, metrics_registry=None, metadata_cache=None,
+                 readahead_window=0, readahead_budget=256 * 1024 * 1024,
+                 readahead_workers=4,
+                 readahead_parallel_size=64 * 1024 * 1024,
+                 content_cache=None, upload_spool=None):
         super(SwiftProvider, self).__init__()
+        # pool_max_connections limits the concurrent requests to each Swift
+        # proxy, see ConnectionPool
+        self.pools = pool.PoolManager(pool_size, pool_idle_timeout,
+                                      pool_max_connections)
+        # Listing pages and HEAD results are shared between requests for a
+        # few seconds; set the TTLs to 0 to disable this. metadata_cache
+        # replaces the in-process cache, e.g. by a SharedMetadataCache.
+        if metadata_cache is None:
+            metadata_cache = cache.MetadataCache(metadata_cache_size,
+                                                 listing_ttl, head_ttl)
+        self.metadata = metadata_cache
+        # Uploads larger than segment_threshold are stored as SLO; set
+        # segment_size to None to disable this.
+        self.segment_size = segment_size
+        self.segment_threshold = segment_threshold
+        self.segment_workers = segment_workers
+        self.segment_retries = segment_retries
+        # Number of objects copied, moved or deleted in parallel by COPY,
+        # MOVE and DELETE
+        self.tree_workers = tree_workers
+        # Downloads read up to readahead_window blocks of IO_BLOCK_SIZE
+        # ahead of the client, all of them together at most
+        # readahead_budget bytes. Objects with at least
+        # readahead_parallel_size bytes left are fetched by
+        # readahead_workers ranged GETs; 0 disables read-ahead.
+        self.readahead_window = readahead_window
+        self.readahead_budget = readahead.Budget(readahead_budget)
+        self.readahead_workers = readahead_workers
+        self.readahead_parallel_size = readahead_parallel_size
+        # Data of small objects is served from this contentcache.ContentCache
+        # if Swift confirms the ETag; None disables it.
+        self.content_cache = content_cache
+        # Small uploads are acknowledged once written to this
+        # spool.UploadSpool and sent to Swift in batches; None disables it.
+        self.upload_spool = upload_spool
+        self.capabilities = {}
+        # Backend calls are accounted here; serve it with MetricsMiddleware
+        if metrics_registry is None:
+            metrics_registry = metrics.Metrics()
+        self.metrics = metrics_registry
+        self.metrics.add_collector('metadata_cache', self.metadata.stats)
+        if content_cache is not None:
+            self.metrics.add_collector('content_cache', content_cache.stats)
+        if upload_spool is not None:
+            self.metrics.add_collector('upload_spool', upload_spool.stats)
+            upload_spool.start(upload_spooled)
 
     def getResourceInst(self, path, environ):
+        # GET and HEAD resolve the same path in the dir browser and in the
+        # request server; only resolve (and open the GET) once.
+        cache = None
+        if environ.get('REQUEST_METHOD') in ('GET', 'HEAD'):
+            cache = environ.setdefault('swift_resources', {})
+            if path in cache:
+                return cache[path]
         root = ContainerCollection(environ, path)
-        return root.resolve("/", path)
+        res = root.resolve("/", path)
+        if cache is not None:
+            cache[path] = res
+        return res
+
+    def get_capabilities(self, environ):
+        """Return the capabilities (/info) of the Swift cluster.
+
+        The result is cached per proxy; if the request fails, no optional
+        middleware is assumed.
+        """
+        parsed = urlparse.urlparse(environ.get('swift_storage_url'))
+        key = (parsed.scheme, parsed.netloc)
+        if key not in self.capabilities:
+            try:
+                resp = raw_request(environ, 'get_info', 'GET', '/info')
+                info = json.loads(resp.body) if resp.status == 200 else {}
+            except (ValueError, httplib.HTTPException, socket.error):
+                info = {}
+            self.capabilities[key] = info
+        return self.capabilities[key]
 
     def exists(self, path, environ):
         return False
@@ -562,10 +2430,14 @@ class SwiftProvider(dav_provider.DAVProvider):
 
 class WsgiDAVDomainController(object):
 
-    def __init__(self, swift_auth_url, insecure=False, auth_version=1):
+    def __init__(self, swift_auth_url, insecure=False, auth_version=1,
+                 token_cache=None):
         self.swift_auth_url = swift_auth_url
         self.insecure = insecure
         self.auth_version = auth_version
+        if token_cache is None:
+            token_cache = auth.TokenCache()
+        self.token_cache = token_cache
 
     def __repr__(self):
         return self.__class__.__name__
@@ -583,15 +2455,39 @@ class WsgiDAVDomainController(object):
 
         try:
             username = username.replace(';', ':')
-            kwargs = {}
+            tenantname = None
             if self.auth_version == 2:
                 tenantname, username = username.split(':')
-                kwargs = {
-                    'os_options': {
-                        'tenant_name': tenantname}, 'auth_version': 2}
-            (storage_url, auth_token) = client.get_auth(
-                self.swift_auth_url, username, password, **kwargs)
-            print storage_url, auth_token
+
+            key = self.token_cache.make_key(
+                self.swift_auth_url, username, password, tenantname)
+            cached = self.token_cache.get(key)
+            if cached:
+                (storage_url, auth_token) = cached
+            else:
+                started = time.time()
+                try:
+                    if self.auth_version == 2:
+                        (storage_url, auth_token, expires) = \
+                            auth.get_auth_2_0(self.swift_auth_url, username,
+                                              password, tenantname,
+                                              insecure=self.insecure)
+                    else:
+                        (storage_url, auth_token, expires) = \
+                            auth.get_auth_1_0(self.swift_auth_url, username,
+                                              password,
+                                              insecure=self.insecure)
+                except client.ClientException as ex:
+                    metrics.record(environ, 'get_auth', started,
+                                   ex.http_status)
+                    raise
+                except socket.error:
+                    metrics.record(environ, 'get_auth', started, None)
+                    raise
+                metrics.record(environ, 'get_auth', started, 200)
+                self.token_cache.set(key, storage_url, auth_token, expires)
+            environ["swift_token_cache"] = self.token_cache
+            environ["swift_token_key"] = key
             environ["swift_storage_url"] = storage_url
             environ["swift_auth_token"] = auth_token
             environ["swift_usernampe"] = username
@@ -0,0 +1,136 @@
+# Copyright 2013 Christian Schwede <info@cschwede.de>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# pylint:disable=E1101, C0103
+
+import collections
+import logging
+import Queue
+import sys
+import threading
+
+# Seconds a producer of chain_parallel() waits before checking for a stop
+POLL_INTERVAL = 0.1
+
+
+class WorkerPool(object):
+    """Run functions on a bounded number of threads.
+
+    spawn() blocks while `max_pending` tasks are waiting for a free worker,
+    so producers reading from a stream or a listing use constant memory.
+    Results and exceptions are collected and returned by join().
+    """
+
+    def __init__(self, size, max_pending=None):
+        self.tasks = Queue.Queue(max_pending or size)
+        self.results = []
+        self.errors = []
+        self._lock = threading.Lock()
+        self._threads = []
+        for _ in range(size):
+            thread = threading.Thread(target=self._worker)
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+
+    def _worker(self):
+        while True:
+            task = self.tasks.get()
+            if task is None:
+                break
+            func, args, kwargs = task
+            try:
+                result = func(*args, **kwargs)
+                with self._lock:
+                    self.results.append(result)
+            except Exception as ex:
+                logging.debug('Task %s%r failed: %s', func.__name__, args, ex)
+                with self._lock:
+                    self.errors.append((args, ex))
+
+    def spawn(self, func, *args, **kwargs):
+        self.tasks.put((func, args, kwargs))
+
+    def join(self):
+        """Wait for all tasks; return (results, errors).
+
+        errors is a list of (args, exception) tuples of failed tasks.
+        """
+        for _ in self._threads:
+            self.tasks.put(None)
+        for thread in self._threads:
+            thread.join()
+        return self.results, self.errors
+
+
+def _produce(factory, items, stop):
+    """Put the items of factory() into a queue until stop is set."""
+    def put(item):
+        while not stop.is_set():
+            try:
+                items.put(item, timeout=POLL_INTERVAL)
+                return True
+            except Queue.Full:
+                pass
+        return False
+
+    try:
+        for item in factory():
+            if not put((True, item)):
+                return
+    except Exception:
+        put((False, sys.exc_info()))
+    else:
+        put((False, None))
+
+
+def chain_parallel(factories, size, queue_size=1000):
+    """Yield the items of the iterables returned by factories, in order.
+
+    The iterables of the next `size` factories are read ahead on threads,
+    each into a queue of at most `queue_size` items. An exception of an
+    iterable is raised when its items are reached. Closing the generator
+    stops the threads.
+    """
+    factories = iter(factories)
+    stop = threading.Event()
+    running = collections.deque()
+
+    def start():
+        for factory in factories:
+            items = Queue.Queue(queue_size)
+            thread = threading.Thread(target=_produce,
+                                      args=(factory, items, stop))
+            thread.daemon = True
+            thread.start()
+            running.append(items)
+            return True
+        return False
+
+    try:
+        while len(running) < size and start():
+            pass
+        while running:
+            items = running[0]
+            while True:
+                is_item, value = items.get()
+                if not is_item:
+                    break
+                yield value
+            running.popleft()
+            if value is not None:
+                raise value[0], value[1], value[2]
+            start()
+    finally:
+        stop.set()
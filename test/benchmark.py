@@ -0,0 +1,233 @@
+# Copyright 2014 Christian Schwede <christian.schwede@enovance.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Offline benchmarks for swiftdav.
+
+Runs SwiftProvider in wsgidav and a FakeSwift backend in-process and drives
+them with concurrent keep-alive HTTP clients. For every workload it reports
+requests per second, p50/p99 latency, Swift requests per client request and
+the throughput in MB/s:
+
+    propfind  Depth:1 PROPFIND of folders with --files objects each
+    small     PUT and GET of 4 KiB files
+    large     PUT and GET of --size MiB files
+
+Usage:
+
+    python test/benchmark.py [--latency 0.002] [--concurrency 8] \\
+        [--requests 200] [--no-cache] [workload ...]
+"""
+
+import base64
+import httplib
+import optparse
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import fakeswift
+from swiftdav import propfind
+from swiftdav import swiftdav
+from wsgidav import wsgidav_app
+
+CONTAINER = 'bench'
+FOLDERS = 10
+SMALL_SIZE = 4 * 1024
+AUTHORIZATION = 'Basic ' + base64.b64encode(
+    fakeswift.USER.replace(':', ';') + ':' + fakeswift.KEY)
+
+
+class Stack(object):
+    """A FakeSwift backend and swiftdav, each served by waitress."""
+
+    def __init__(self, latency=0.0, **provider_kwargs):
+        self.swift = fakeswift.FakeSwift(latency=latency)
+        self.swift_server = fakeswift.FakeSwiftServer(self.swift).start()
+        self.provider = swiftdav.SwiftProvider(**provider_kwargs)
+        config = wsgidav_app.DEFAULT_CONFIG.copy()
+        config.update({
+            "provider_mapping": {"": self.provider},
+            "verbose": 0,
+            "propsmanager": True,
+            "locksmanager": True,
+            "acceptbasic": True,
+            "acceptdigest": False,
+            "defaultdigest": False,
+            "block_size": swiftdav.IO_BLOCK_SIZE,
+            "middleware_stack": [propfind.StreamingPropfind] +
+                                wsgidav_app.DEFAULT_CONFIG["middleware_stack"],
+            "domaincontroller": swiftdav.WsgiDAVDomainController(
+                self.swift_server.auth_url),
+        })
+        self.dav_server = fakeswift.FakeSwiftServer(
+            propfind.ConnectionHeaderFilter(wsgidav_app.WsgiDAVApp(config)),
+            threads=32).start()
+        self.port = int(self.dav_server.port)
+
+    def populate(self, files):
+        """Create FOLDERS folders with `files` small objects each."""
+        objects = {
+            'small/': fakeswift.FakeObject('', 'application/directory'),
+            'large/': fakeswift.FakeObject('', 'application/directory')}
+        for folder in range(FOLDERS):
+            prefix = 'folder%02d/' % folder
+            objects[prefix] = fakeswift.FakeObject('', 'application/directory')
+            for i in range(files):
+                objects['%sfile%05d' % (prefix, i)] = fakeswift.FakeObject(
+                    'x' * 100, 'application/octet-stream')
+        with self.swift.lock:
+            self.swift.containers[CONTAINER] = objects
+
+    def stop(self):
+        self.dav_server.stop()
+        self.swift_server.stop()
+
+
+class Client(object):
+    """A keep-alive HTTP client recording latency and transferred bytes."""
+
+    def __init__(self, port):
+        self.conn = httplib.HTTPConnection('127.0.0.1', port)
+        self.latencies = []
+        self.bytes = 0
+
+    def request(self, method, path, body=None, headers=None):
+        headers = dict(headers or {})
+        headers['Authorization'] = AUTHORIZATION
+        started = time.time()
+        self.conn.request(method, path, body, headers)
+        resp = self.conn.getresponse()
+        while True:
+            data = resp.read(65536)
+            if not data:
+                break
+            self.bytes += len(data)
+        self.latencies.append(time.time() - started)
+        if body:
+            self.bytes += len(body)
+        if resp.status >= 300:
+            raise Exception('%s %s failed: %d' % (method, path, resp.status))
+        return resp
+
+
+def propfind_folder(client, i, _options):
+    client.request('PROPFIND', '/%s/folder%02d/' % (CONTAINER, i % FOLDERS),
+                   headers={'Depth': '1'})
+
+
+def small(client, i, _options):
+    path = '/%s/small/file%05d' % (CONTAINER, i % 100)
+    client.request('PUT', path, 'x' * SMALL_SIZE)
+    client.request('GET', path)
+
+
+def large(client, i, options):
+    path = '/%s/large/file%02d' % (CONTAINER, i % 4)
+    client.request('PUT', path, options.data)
+    client.request('GET', path)
+
+
+WORKLOADS = [('propfind', propfind_folder), ('small', small), ('large', large)]
+
+
+def percentile(values, fraction):
+    return values[int(round(fraction * (len(values) - 1)))]
+
+
+def run(stack, func, iterations, concurrency, options):
+    """Run func iterations times on concurrency clients; return stats."""
+    clients = [Client(stack.port) for _ in range(concurrency)]
+    counter = iter(range(iterations))
+    lock = threading.Lock()
+    errors = []
+
+    def worker(client):
+        while True:
+            with lock:
+                i = next(counter, None)
+            if i is None:
+                return
+            try:
+                func(client, i, options)
+            except Exception as ex:
+                errors.append(ex)
+
+    backend = len(stack.swift.requests)
+    started = time.time()
+    threads = [threading.Thread(target=worker, args=(client, ))
+               for client in clients]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.time() - started
+
+    latencies = sorted(sum((client.latencies for client in clients), []))
+    transferred = sum(client.bytes for client in clients)
+    return {'requests': len(latencies),
+            'errors': errors,
+            'rps': len(latencies) / elapsed,
+            'p50': percentile(latencies, 0.5) * 1000,
+            'p99': percentile(latencies, 0.99) * 1000,
+            'backend': (len(stack.swift.requests) - backend) /
+                       float(len(latencies)),
+            'mbps': transferred / elapsed / 1024 / 1024}
+
+
+def main():
+    parser = optparse.OptionParser(usage='%prog [options] [workload ...]')
+    parser.add_option('--latency', type='float', default=0.002,
+                      help='Injected Swift latency per request in seconds')
+    parser.add_option('--concurrency', type='int', default=8)
+    parser.add_option('--requests', type='int', default=200,
+                      help='Iterations of the propfind and small workloads')
+    parser.add_option('--files', type='int', default=200,
+                      help='Objects per folder for the propfind workload')
+    parser.add_option('--size', type='int', default=64,
+                      help='Object size in MiB for the large workload')
+    parser.add_option('--no-cache', action='store_true',
+                      help='Disable the metadata cache of swiftdav')
+    options, args = parser.parse_args()
+    options.data = 'x' * (options.size * 1024 * 1024)
+
+    provider_kwargs = {}
+    if options.no_cache:
+        provider_kwargs.update(listing_ttl=0, head_ttl=0)
+    stack = Stack(options.latency, **provider_kwargs)
+    stack.populate(options.files)
+
+    print '%-10s %8s %6s %8s %8s %8s %11s %8s' % (
+        'workload', 'requests', 'errors', 'req/s', 'p50 ms', 'p99 ms',
+        'backend/req', 'MB/s')
+    for name, func in WORKLOADS:
+        if args and name not in args:
+            continue
+        iterations = options.requests
+        if name == 'large':
+            iterations = max(options.concurrency, 8)
+        stats = run(stack, func, iterations, options.concurrency, options)
+        print '%-10s %8d %6d %8.1f %8.1f %8.1f %11.2f %8.1f' % (
+            name, stats['requests'], len(stats['errors']), stats['rps'],
+            stats['p50'], stats['p99'], stats['backend'], stats['mbps'])
+        if stats['errors']:
+            print '  first error: %s' % stats['errors'][0]
+    stack.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,563 @@
+# Copyright 2014 Christian Schwede <christian.schwede@enovance.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""In-process stand-in for a Swift proxy (SAIO) used by the benchmarks.
+
+Supports tempauth-style v1 auth, account and container listings with
+marker/end_marker/limit/prefix/delimiter, object HEAD/GET/PUT/DELETE/COPY,
+X-Copy-From, Range, conditional GET, Static Large Objects and the bulk
+middleware (bulk-delete and extract-archive). All data is kept in memory.
+
+Run it standalone to replace a SAIO for the functional tests:
+
+    python test/fakeswift.py [--port 8080] [--latency 0.005]
+"""
+
+import cgi
+import email.utils
+import hashlib
+import json
+import optparse
+import tarfile
+import threading
+import time
+import urllib
+from cStringIO import StringIO
+
+import waitress
+import waitress.channel
+import waitress.server
+import waitress.task
+
+ACCOUNT = 'AUTH_test'
+USER = 'test:tester'
+KEY = 'testing'
+TOKEN = 'AUTH_tk_fakeswift'
+
+
+def status_line(status):
+    reasons = {200: 'OK', 201: 'Created', 202: 'Accepted',
+               204: 'No Content', 206: 'Partial Content',
+               304: 'Not Modified', 400: 'Bad Request',
+               401: 'Unauthorized', 404: 'Not Found',
+               409: 'Conflict', 412: 'Precondition Failed',
+               416: 'Requested Range Not Satisfiable',
+               422: 'Unprocessable Entity'}
+    return '%d %s' % (status, reasons.get(status, 'Unknown'))
+
+
+def http_date(timestamp):
+    return email.utils.formatdate(timestamp, usegmt=True)
+
+
+def iso_date(timestamp):
+    return time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(timestamp)) + \
+        ('%.6f' % (timestamp % 1))[1:]
+
+
+class FakeObject(object):
+    def __init__(self, data, content_type, metadata=None, manifest=None):
+        self.data = data
+        self.content_type = content_type
+        self.metadata = metadata or {}
+        self.manifest = manifest
+        self.timestamp = time.time()
+        if manifest is None:
+            self.etag = hashlib.md5(data).hexdigest()
+        else:
+            self.etag = hashlib.md5(
+                ''.join(seg['etag'] for seg in manifest)).hexdigest()
+
+    @property
+    def size(self):
+        if self.manifest is not None:
+            return sum(seg['size_bytes'] for seg in self.manifest)
+        return len(self.data)
+
+
+class FakeSwift(object):
+    """A WSGI application emulating a single Swift account."""
+
+    def __init__(self, latency=0.0, token_expires=86400, bulk=True):
+        self.latency = latency
+        self.token_expires = token_expires
+        self.bulk = bulk
+        self.containers = {}
+        self.lock = threading.Lock()
+        self.requests = []
+        self.token = TOKEN
+        self.revoked = 0
+
+    def revoke_token(self):
+        """Reject the current token; authentication returns a new one."""
+        with self.lock:
+            self.revoked += 1
+            self.token = '%s_%d' % (TOKEN, self.revoked)
+
+    def reset_stats(self):
+        with self.lock:
+            self.requests = []
+
+    def __call__(self, environ, start_response):
+        method = environ['REQUEST_METHOD']
+        path = environ.get('PATH_INFO', '')
+        query = dict(cgi.parse_qsl(environ.get('QUERY_STRING', ''),
+                                   keep_blank_values=True))
+        with self.lock:
+            self.requests.append((method, path))
+        if self.latency:
+            time.sleep(self.latency)
+
+        if path.startswith('/auth/'):
+            return self.auth(environ, start_response)
+        if path == '/info':
+            return self.info(start_response)
+        if environ.get('HTTP_X_AUTH_TOKEN') != self.token:
+            return self.respond(start_response, 401)
+
+        parts = path.split('/', 4)[1:]  # v1, account, container, object
+        if len(parts) < 2 or parts[0] != 'v1' or parts[1] != ACCOUNT:
+            return self.respond(start_response, 404)
+        container = urllib.unquote(parts[2]) if len(parts) > 2 else ''
+        obj = urllib.unquote(parts[3]) if len(parts) > 3 else ''
+
+        if not container:
+            return self.handle_account(environ, start_response, method, query)
+        if not obj:
+            return self.handle_container(environ, start_response, method,
+                                         container, query)
+        return self.handle_object(environ, start_response, method,
+                                  container, obj, query)
+
+    def respond(self, start_response, status, body='', headers=None):
+        headers = list(headers or [])
+        if not [h for h in headers if h[0].lower() == 'content-length']:
+            headers.append(('Content-Length', str(len(body))))
+        start_response(status_line(status), headers)
+        return [body]
+
+    def read_body(self, environ):
+        wsgi_input = environ['wsgi.input']
+        length = environ.get('CONTENT_LENGTH')
+        if length and not environ.get('HTTP_TRANSFER_ENCODING'):
+            return wsgi_input.read(int(length))
+        chunks = []
+        while True:
+            chunk = wsgi_input.read(65536)
+            if not chunk:
+                break
+            chunks.append(chunk)
+        return ''.join(chunks)
+
+    def auth(self, environ, start_response):
+        if environ.get('HTTP_X_AUTH_USER') != USER or \
+                environ.get('HTTP_X_AUTH_KEY') != KEY:
+            return self.respond(start_response, 401)
+        url = '%s://%s/v1/%s' % (environ['wsgi.url_scheme'],
+                                 environ['HTTP_HOST'], ACCOUNT)
+        return self.respond(start_response, 200, headers=[
+            ('X-Storage-Url', url),
+            ('X-Auth-Token', self.token),
+            ('X-Storage-Token', self.token),
+            ('X-Auth-Token-Expires', str(self.token_expires))])
+
+    def info(self, start_response):
+        info = {'swift': {'version': 'fakeswift'},
+                'slo': {'max_manifest_segments': 1000}}
+        if self.bulk:
+            info['bulk_delete'] = {'max_deletes_per_request': 10000,
+                                   'max_failed_deletes': 1000}
+            info['bulk_upload'] = {'max_containers_per_extraction': 10000,
+                                   'max_failed_extractions': 1000}
+        return self.respond(start_response, 200, json.dumps(info),
+                            [('Content-Type', 'application/json')])
+
+    def listing(self, names, query):
+        """Apply marker, end_marker, prefix, delimiter and limit."""
+        marker = query.get('marker', '')
+        end_marker = query.get('end_marker')
+        prefix = query.get('prefix', '')
+        delimiter = query.get('delimiter')
+        limit = int(query.get('limit', 10000))
+        result = []
+        for name in sorted(names):
+            if name <= marker or not name.startswith(prefix):
+                continue
+            if end_marker and name >= end_marker:
+                break
+            if delimiter:
+                idx = name.find(delimiter, len(prefix))
+                if idx >= 0:
+                    subdir = name[:idx + 1]
+                    if result and result[-1] == ('subdir', subdir):
+                        continue
+                    if subdir <= marker:
+                        continue
+                    result.append(('subdir', subdir))
+                    if len(result) >= limit:
+                        break
+                    continue
+            result.append(('name', name))
+            if len(result) >= limit:
+                break
+        return result
+
+    def handle_account(self, environ, start_response, method, query):
+        with self.lock:
+            stats = [(name, len(objs), sum(o.size for o in objs.values()))
+                     for name, objs in self.containers.items()]
+        headers = [
+            ('X-Account-Container-Count', str(len(stats))),
+            ('X-Account-Object-Count', str(sum(s[1] for s in stats))),
+            ('X-Account-Bytes-Used', str(sum(s[2] for s in stats)))]
+        if method == 'HEAD':
+            return self.respond(start_response, 204, headers=headers)
+        if method == 'POST' and 'bulk-delete' in query and self.bulk:
+            return self.bulk_delete(environ, start_response)
+        if method == 'POST':
+            self.read_body(environ)
+            return self.respond(start_response, 204, headers=headers)
+        if method != 'GET':
+            return self.respond(start_response, 405)
+        bystat = dict((s[0], s) for s in stats)
+        entries = [{'name': name, 'count': bystat[name][1],
+                    'bytes': bystat[name][2]}
+                   for _, name in self.listing(bystat.keys(), query)]
+        if not entries:
+            return self.respond(start_response, 204, headers=headers)
+        headers.append(('Content-Type', 'application/json; charset=utf-8'))
+        return self.respond(start_response, 200, json.dumps(entries), headers)
+
+    def handle_container(self, environ, start_response, method, container,
+                         query):
+        with self.lock:
+            objects = self.containers.get(container)
+            if method == 'PUT':
+                if 'extract-archive' in query:
+                    pass
+                elif objects is None:
+                    self.containers[container] = {}
+                    return self.respond(start_response, 201)
+                else:
+                    return self.respond(start_response, 202)
+            if method == 'DELETE':
+                if objects is None:
+                    return self.respond(start_response, 404)
+                if objects:
+                    return self.respond(start_response, 409)
+                del self.containers[container]
+                return self.respond(start_response, 204)
+            if objects is None:
+                return self.respond(start_response, 404)
+            objects = dict(objects)
+
+        if method == 'PUT':
+            return self.extract_archive(environ, start_response, container)
+
+        headers = [
+            ('X-Container-Object-Count', str(len(objects))),
+            ('X-Container-Bytes-Used',
+             str(sum(o.size for o in objects.values())))]
+        if method == 'HEAD':
+            return self.respond(start_response, 204, headers=headers)
+        if method != 'GET':
+            return self.respond(start_response, 405)
+
+        entries = []
+        for kind, name in self.listing(objects.keys(), query):
+            if kind == 'subdir':
+                entries.append({'subdir': name})
+                continue
+            obj = objects[name]
+            entries.append({'name': name,
+                            'bytes': obj.size,
+                            'hash': obj.etag,
+                            'content_type': obj.content_type,
+                            'last_modified': iso_date(obj.timestamp)})
+        if not entries:
+            return self.respond(start_response, 204, headers=headers)
+        headers.append(('Content-Type', 'application/json; charset=utf-8'))
+        return self.respond(start_response, 200, json.dumps(entries), headers)
+
+    def get_object(self, container, obj):
+        with self.lock:
+            return self.containers.get(container, {}).get(obj)
+
+    def object_body(self, obj):
+        if obj.manifest is None:
+            return obj.data
+        chunks = []
+        for seg in obj.manifest:
+            container, _, name = seg['path'].lstrip('/').partition('/')
+            segment = self.get_object(container, name)
+            chunks.append(segment.data if segment else '')
+        return ''.join(chunks)
+
+    def handle_object(self, environ, start_response, method, container, name,
+                      query):
+        if method == 'PUT':
+            return self.put_object(environ, start_response, container, name,
+                                   query)
+        if method == 'COPY':
+            dest = urllib.unquote(environ.get('HTTP_DESTINATION', ''))
+            dest_container, _, dest_name = dest.lstrip('/').partition('/')
+            return self.copy_object(start_response, container, name,
+                                    dest_container, dest_name)
+        obj = self.get_object(container, name)
+        if obj is None:
+            return self.respond(start_response, 404)
+        if method == 'DELETE':
+            with self.lock:
+                self.containers[container].pop(name, None)
+            if obj.manifest is not None and \
+                    query.get('multipart-manifest') == 'delete':
+                for seg in obj.manifest:
+                    seg_container, _, seg_name = \
+                        seg['path'].lstrip('/').partition('/')
+                    with self.lock:
+                        self.containers.get(seg_container, {}).pop(
+                            seg_name, None)
+            return self.respond(start_response, 204)
+        if method == 'POST':
+            obj.metadata = self.metadata(environ)
+            return self.respond(start_response, 202)
+
+        etag = obj.etag
+        if obj.manifest is not None:
+            etag = '"%s"' % etag
+        headers = [('Content-Type', obj.content_type),
+                   ('Etag', etag),
+                   ('Last-Modified', http_date(obj.timestamp)),
+                   ('X-Timestamp', '%.5f' % obj.timestamp),
+                   ('Accept-Ranges', 'bytes')]
+        if obj.manifest is not None:
+            headers.append(('X-Static-Large-Object', 'True'))
+        for key, value in obj.metadata.items():
+            headers.append(('X-Object-Meta-' + key, value))
+
+        if_none_match = environ.get('HTTP_IF_NONE_MATCH')
+        if_modified_since = environ.get('HTTP_IF_MODIFIED_SINCE')
+        if if_none_match and if_none_match.strip('"') in \
+                (obj.etag, '*'):
+            return self.respond(start_response, 304, headers=headers)
+        if if_modified_since and not if_none_match:
+            since = email.utils.parsedate_tz(if_modified_since)
+            if since and int(obj.timestamp) <= \
+                    email.utils.mktime_tz(since):
+                return self.respond(start_response, 304, headers=headers)
+
+        if method == 'HEAD':
+            headers.append(('Content-Length', str(obj.size)))
+            return self.respond(start_response, 200, headers=headers)
+        if method != 'GET':
+            return self.respond(start_response, 405)
+
+        body = self.object_body(obj)
+        if query.get('multipart-manifest') == 'get' and obj.manifest:
+            body = json.dumps(obj.manifest)
+        byte_range = environ.get('HTTP_RANGE')
+        if byte_range and byte_range.startswith('bytes=') and \
+                ',' not in byte_range:
+            start, _, end = byte_range[6:].partition('-')
+            size = len(body)
+            if start:
+                start = int(start)
+                end = int(end) if end else size - 1
+            else:
+                start = max(size - int(end), 0)
+                end = size - 1
+            end = min(end, size - 1)
+            if start >= size or start > end:
+                headers.append(('Content-Range', 'bytes */%d' % size))
+                return self.respond(start_response, 416, headers=headers)
+            headers.append(('Content-Range',
+                            'bytes %d-%d/%d' % (start, end, size)))
+            return self.respond(start_response, 206, body[start:end + 1],
+                                headers)
+        return self.respond(start_response, 200, body, headers)
+
+    def metadata(self, environ):
+        meta = {}
+        for key, value in environ.items():
+            if key.startswith('HTTP_X_OBJECT_META_'):
+                meta[key[19:].replace('_', '-').title()] = value
+        return meta
+
+    def put_object(self, environ, start_response, container, name, query):
+        with self.lock:
+            if container not in self.containers:
+                return self.respond(start_response, 404)
+        copy_from = environ.get('HTTP_X_COPY_FROM')
+        if copy_from:
+            self.read_body(environ)
+            src_container, _, src_name = \
+                urllib.unquote(copy_from).lstrip('/').partition('/')
+            return self.copy_object(start_response, src_container, src_name,
+                                    container, name)
+
+        body = self.read_body(environ)
+        content_type = environ.get('CONTENT_TYPE') or \
+            'application/octet-stream'
+        manifest = None
+        if query.get('multipart-manifest') == 'put':
+            manifest = []
+            for seg in json.loads(body):
+                seg_container, _, seg_name = \
+                    seg['path'].lstrip('/').partition('/')
+                segment = self.get_object(seg_container, seg_name)
+                if segment is None or segment.etag != seg['etag'] or \
+                        segment.size != seg['size_bytes']:
+                    return self.respond(start_response, 400)
+                manifest.append({'path': seg['path'],
+                                 'etag': seg['etag'],
+                                 'size_bytes': seg['size_bytes']})
+            body = ''
+        obj = FakeObject(body, content_type, self.metadata(environ),
+                         manifest)
+        expected = environ.get('HTTP_ETAG')
+        if manifest is None and expected and expected.strip('"') != obj.etag:
+            return self.respond(start_response, 422)
+        if_none_match = environ.get('HTTP_IF_NONE_MATCH')
+        with self.lock:
+            if if_none_match == '*' and name in self.containers[container]:
+                return self.respond(start_response, 412)
+            self.containers[container][name] = obj
+        etag = obj.etag if manifest is None else '"%s"' % obj.etag
+        return self.respond(start_response, 201, headers=[('Etag', etag)])
+
+    def copy_object(self, start_response, src_container, src_name,
+                    dest_container, dest_name):
+        src = self.get_object(src_container, src_name)
+        if src is None:
+            return self.respond(start_response, 404)
+        # Large objects are copied with the content of their segments
+        copy = FakeObject(self.object_body(src), src.content_type,
+                          dict(src.metadata))
+        with self.lock:
+            if dest_container not in self.containers:
+                return self.respond(start_response, 404)
+            self.containers[dest_container][dest_name] = copy
+        return self.respond(start_response, 201,
+                            headers=[('Etag', copy.etag)])
+
+    def bulk_delete(self, environ, start_response):
+        body = self.read_body(environ)
+        deleted, not_found, errors = 0, 0, []
+        for line in body.splitlines():
+            path = urllib.unquote(line.strip()).lstrip('/')
+            if not path:
+                continue
+            container, _, name = path.partition('/')
+            with self.lock:
+                objects = self.containers.get(container)
+                if objects is None:
+                    not_found += 1
+                elif name:
+                    if objects.pop(name, None) is None:
+                        not_found += 1
+                    else:
+                        deleted += 1
+                elif objects:
+                    errors.append([path, '409 Conflict'])
+                else:
+                    del self.containers[container]
+                    deleted += 1
+        result = {'Number Deleted': deleted,
+                  'Number Not Found': not_found,
+                  'Errors': errors,
+                  'Response Status': '400 Bad Request' if errors else
+                                     '200 OK',
+                  'Response Body': ''}
+        return self.respond(start_response, 200, json.dumps(result),
+                            [('Content-Type', 'application/json')])
+
+    def extract_archive(self, environ, start_response, container):
+        body = self.read_body(environ)
+        created, errors = 0, []
+        archive = tarfile.open(fileobj=StringIO(body), mode='r')
+        for member in archive:
+            if not member.isfile():
+                continue
+            data = archive.extractfile(member).read()
+            content_type = member.pax_headers.get(
+                u'SCHILY.xattr.user.mime_type', u'application/octet-stream')
+            with self.lock:
+                self.containers[container][member.name] = FakeObject(
+                    data, content_type.encode('utf-8'))
+            created += 1
+        result = {'Number Files Created': created,
+                  'Errors': errors,
+                  'Response Status': '201 Created',
+                  'Response Body': ''}
+        return self.respond(start_response, 200, json.dumps(result),
+                            [('Content-Type', 'application/json')])
+
+
+class KeepAliveHeadTask(waitress.task.WSGITask):
+    """Keep connections open after HEAD requests.
+
+    waitress closes the connection whenever fewer bytes than Content-Length
+    were written, which includes every HEAD response. It does so without a
+    'Connection: close' header, so keep-alive clients race against the close.
+    Swift keeps these connections open, and so do we.
+    """
+
+    def execute(self):
+        waitress.task.WSGITask.execute(self)
+        if self.request.command == 'HEAD' and \
+                ('Connection', 'close') not in self.response_headers:
+            self.close_on_finish = False
+
+
+class KeepAliveChannel(waitress.channel.HTTPChannel):
+    task_class = KeepAliveHeadTask
+
+
+class FakeSwiftServer(object):
+    """Serve a FakeSwift app with waitress in a background thread."""
+
+    def __init__(self, app=None, host='127.0.0.1', port=0, threads=16):
+        self.app = app or FakeSwift()
+        self.server = waitress.server.create_server(
+            self.app, host=host, port=port, threads=threads,
+            max_request_body_size=5 * 1024 * 1024 * 1024)
+        self.server.channel_class = KeepAliveChannel
+        self.port = self.server.effective_port
+        self.auth_url = 'http://%s:%s/auth/v1.0' % (host, self.port)
+        self.thread = threading.Thread(target=self.server.run)
+        self.thread.daemon = True
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.close()
+
+
+def main():
+    parser = optparse.OptionParser()
+    parser.add_option('--host', default='127.0.0.1')
+    parser.add_option('--port', type='int', default=8080)
+    parser.add_option('--latency', type='float', default=0.0,
+                      help='Injected latency per request in seconds')
+    options, _ = parser.parse_args()
+    server = FakeSwiftServer(FakeSwift(latency=options.latency),
+                             host=options.host, port=options.port)
+    print 'Serving on %s' % server.auth_url
+    server.server.run()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,95 @@
+# Copyright 2013 Christian Schwede <info@cschwede.de>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import httplib
+import time
+import unittest
+
+from swiftdav import auth
+
+import benchmark
+import fakeswift
+
+
+class TestTokenCache(unittest.TestCase):
+    def setUp(self):
+        self.cache = auth.TokenCache(max_size=2, refresh_margin=10)
+        self.key = self.cache.make_key('http://auth', 'test:tester', 'testing')
+
+    def test_hit_and_miss(self):
+        self.assertEqual(None, self.cache.get(self.key))
+        self.cache.set(self.key, 'http://storage', 'token')
+        self.assertEqual(('http://storage', 'token'), self.cache.get(self.key))
+        stats = self.cache.stats()
+        self.assertEqual(1, stats['hits'])
+        self.assertEqual(1, stats['misses'])
+
+    def test_wrong_password(self):
+        self.cache.set(self.key, 'http://storage', 'token')
+        key = self.cache.make_key('http://auth', 'test:tester', 'wrong')
+        self.assertEqual(None, self.cache.get(key))
+
+    def test_refresh_before_expiry(self):
+        self.cache.set(self.key, 'http://storage', 'token', time.time() + 5)
+        self.assertEqual(None, self.cache.get(self.key))
+
+    def test_invalidate(self):
+        self.cache.set(self.key, 'http://storage', 'token')
+        self.cache.invalidate(self.key)
+        self.assertEqual(None, self.cache.get(self.key))
+
+    def test_lru_eviction(self):
+        keys = [self.cache.make_key('http://auth', 'user%d' % i, 'pw')
+                for i in range(3)]
+        self.cache.set(keys[0], 'http://storage', 'token0')
+        self.cache.set(keys[1], 'http://storage', 'token1')
+        self.cache.get(keys[0])
+        self.cache.set(keys[2], 'http://storage', 'token2')
+        self.assertEqual(None, self.cache.get(keys[1]))
+        self.assertEqual('token0', self.cache.get(keys[0])[1])
+        self.assertEqual(1, self.cache.stats()['evictions'])
+
+    def test_parse_expires(self):
+        self.assertEqual(0, auth.parse_expires('1970-01-01T00:00:00Z'))
+        self.assertEqual(60, auth.parse_expires('1970-01-01T00:01:00.123Z'))
+        self.assertEqual(None, auth.parse_expires('invalid'))
+
+
+class TestRevokedToken(unittest.TestCase):
+    """A token rejected by Swift is dropped from the token cache."""
+
+    def setUp(self):
+        self.stack = benchmark.Stack(head_ttl=60, listing_ttl=60)
+        self.stack.swift.containers['c'] = {
+            'obj': fakeswift.FakeObject('hello', 'text/plain')}
+
+    def tearDown(self):
+        self.stack.stop()
+
+    def request(self, method, path, body=None):
+        conn = httplib.HTTPConnection('127.0.0.1', self.stack.port)
+        conn.request(method, path, body,
+                     {'Authorization': benchmark.AUTHORIZATION})
+        resp = conn.getresponse()
+        data = resp.read()
+        conn.close()
+        return resp.status, data
+
+    def test_get(self):
+        self.assertEqual((200, 'hello'), self.request('GET', '/c/obj'))
+        self.stack.swift.revoke_token()
+        # The object GET is sent without a HEAD of the cached container; it
+        # fails, but doesn't report the object as missing
+        self.assertEqual(401, self.request('GET', '/c/obj')[0])
+        self.assertEqual((200, 'hello'), self.request('GET', '/c/obj'))
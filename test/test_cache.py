@@ -0,0 +1,76 @@
+# Copyright 2013 Christian Schwede <info@cschwede.de>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import unittest
+
+from swiftdav import cache
+
+ACCOUNT = 'http://127.0.0.1/v1/AUTH_test'
+
+
+class TestMetadataCache(unittest.TestCase):
+    def setUp(self):
+        self.cache = cache.MetadataCache(max_size=10)
+        self.keys = {
+            'container': self.cache.head_key(ACCOUNT, 'c'),
+            'object': self.cache.head_key(ACCOUNT, 'c', 'a/b/obj'),
+            'other': self.cache.head_key(ACCOUNT, 'c', 'a/b/other'),
+            'root': self.cache.listing_key(ACCOUNT, 'c', delimiter='/'),
+            'dir': self.cache.listing_key(ACCOUNT, 'c', 'a/b/',
+                                          delimiter='/'),
+            'otherdir': self.cache.listing_key(ACCOUNT, 'c', 'x/',
+                                               delimiter='/'),
+            'account': self.cache.listing_key(ACCOUNT),
+        }
+        for name, key in self.keys.items():
+            self.cache.set(key, name)
+
+    def cached(self):
+        return sorted(name for name, key in self.keys.items()
+                      if self.cache.get(key) is not None)
+
+    def test_hit_and_miss(self):
+        self.assertEqual('object', self.cache.get(self.keys['object']))
+        self.assertEqual(None, self.cache.get(
+            self.cache.head_key(ACCOUNT, 'c', 'missing')))
+        stats = self.cache.stats()
+        self.assertEqual(1, stats['hits'])
+        self.assertEqual(1, stats['misses'])
+
+    def test_account_isolation(self):
+        self.assertEqual(None, self.cache.get(
+            self.cache.head_key(ACCOUNT + '2', 'c', 'a/b/obj')))
+
+    def test_invalidate_object(self):
+        self.cache.invalidate(ACCOUNT, 'c', 'a/b/obj')
+        self.assertEqual(['account', 'other', 'otherdir'], self.cached())
+
+    def test_invalidate_tree(self):
+        self.cache.invalidate(ACCOUNT, 'c', 'a/', tree=True)
+        self.assertEqual(['account', 'otherdir'], self.cached())
+
+    def test_invalidate_container(self):
+        self.cache.invalidate(ACCOUNT, 'c')
+        self.assertEqual([], self.cached())
+
+    def test_ttl(self):
+        self.cache.ttls[cache.HEAD] = -1
+        self.cache.set(self.keys['object'], 'object')
+        self.assertEqual(None, self.cache.get(self.keys['object']))
+
+    def test_lru_eviction(self):
+        self.cache.max_size = 1
+        self.cache.set(self.keys['object'], 'object')
+        self.assertEqual(['object'], self.cached())
+        self.assertEqual(6, self.cache.stats()['evictions'])
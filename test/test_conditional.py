@@ -0,0 +1,65 @@
+# Copyright 2013 Christian Schwede <info@cschwede.de>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import unittest
+
+from swiftdav import swiftdav
+
+HEADERS = {'etag': 'abc', 'last-modified': 'Sat, 29 Oct 1994 19:43:31 GMT'}
+
+
+class TestRevalidation(unittest.TestCase):
+    def test_conditions(self):
+        environ = {'REQUEST_METHOD': 'GET', 'HTTP_IF_NONE_MATCH': '"abc"',
+                   'HTTP_IF_MODIFIED_SINCE': HEADERS['last-modified']}
+        self.assertEqual({'If-None-Match': '"abc"',
+                          'If-Modified-Since': HEADERS['last-modified']},
+                         swiftdav.revalidation(environ))
+
+    def test_other_conditions(self):
+        environ = {'REQUEST_METHOD': 'GET', 'HTTP_IF_NONE_MATCH': '"abc"',
+                   'HTTP_IF_MATCH': '"abc"'}
+        self.assertEqual({}, swiftdav.revalidation(environ))
+        environ = {'REQUEST_METHOD': 'PUT', 'HTTP_IF_NONE_MATCH': '*'}
+        self.assertEqual({}, swiftdav.revalidation(environ))
+
+    def test_if_none_match(self):
+        for value in ('"abc"', '"x", "abc"', 'W/"abc"', '*'):
+            self.assertTrue(swiftdav.not_modified(
+                {'If-None-Match': value}, HEADERS))
+        self.assertFalse(swiftdav.not_modified(
+            {'If-None-Match': '"x"'}, HEADERS))
+        self.assertTrue(swiftdav.not_modified(
+            {'If-None-Match': '"abc"'}, {'etag': '"abc"'}))
+
+    def test_if_modified_since(self):
+        self.assertTrue(swiftdav.not_modified(
+            {'If-Modified-Since': HEADERS['last-modified']}, HEADERS))
+        self.assertTrue(swiftdav.not_modified(
+            {'If-Modified-Since': 'Sun, 30 Oct 1994 19:43:31 GMT'},
+            HEADERS))
+        self.assertFalse(swiftdav.not_modified(
+            {'If-Modified-Since': 'Fri, 28 Oct 1994 19:43:31 GMT'},
+            HEADERS))
+        self.assertFalse(swiftdav.not_modified(
+            {'If-Modified-Since': 'invalid'}, HEADERS))
+
+    def test_if_none_match_overrides_date(self):
+        self.assertFalse(swiftdav.not_modified(
+            {'If-None-Match': '"x"',
+             'If-Modified-Since': HEADERS['last-modified']}, HEADERS))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,112 @@
+# Copyright 2013 Christian Schwede <info@cschwede.de>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from swiftdav import contentcache
+
+
+def headers(data, etag='abc'):
+    return {'content-length': str(len(data)), 'etag': etag,
+            'content-type': 'text/plain', 'date': 'today'}
+
+
+class TestContentCache(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.cache = contentcache.ContentCache(self.path, max_bytes=1000,
+                                               max_object_size=500)
+        self.key = self.cache.make_key('http://swift/v1/AUTH_a', 'c', 'o')
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def fill(self, key, data, etag='abc'):
+        fill = self.cache.start_fill(key, headers(data, etag))
+        for i in range(0, len(data), 7):
+            fill.write(data[i:i + 7])
+        return fill
+
+    def test_fill_and_get(self):
+        self.assertEqual(None, self.cache.get(self.key))
+        fill = self.fill(self.key, 'hello world')
+        self.assertTrue(fill.done)
+        entry = self.cache.get(self.key)
+        self.assertEqual('abc', entry.etag)
+        self.assertFalse('date' in entry.headers)
+        self.assertEqual('text/plain', entry.headers['content-type'])
+        self.assertEqual('hello world', entry.read(100))
+        entry.seek(6)
+        self.assertEqual('wor', entry.read(3))
+        self.cache.use(entry, {'last-modified': 'now',
+                               'content-length': '0'})
+        self.assertEqual('now', entry.headers['last-modified'])
+        self.assertEqual('11', entry.headers['content-length'])
+        entry.close()
+        stats = self.cache.stats()
+        self.assertEqual(1, stats['hits'])
+        self.assertEqual(1, stats['fills'])
+
+    def test_incomplete_fill(self):
+        fill = self.cache.start_fill(self.key, headers('hello world'))
+        fill.write('hello')
+        fill.abort()
+        self.assertEqual(None, self.cache.get(self.key))
+        self.assertEqual([], os.listdir(os.path.join(self.path,
+                                                     self.key[:2])))
+
+    def test_single_filler(self):
+        fill = self.cache.start_fill(self.key, headers('hello'))
+        self.assertEqual(None, self.cache.start_fill(self.key,
+                                                     headers('hello')))
+        fill.abort()
+        self.assertNotEqual(None, self.cache.start_fill(self.key,
+                                                        headers('hello')))
+
+    def test_stale_fill(self):
+        self.cache.start_fill(self.key, headers('hello'))
+        self.cache.fill_timeout = -1
+        self.assertNotEqual(None, self.cache.start_fill(self.key,
+                                                        headers('hello')))
+
+    def test_not_cacheable(self):
+        self.assertEqual(None, self.cache.start_fill(self.key, headers('')))
+        self.assertEqual(None, self.cache.start_fill(self.key,
+                                                     headers('x' * 501)))
+        self.assertEqual(None, self.cache.start_fill(
+            self.key, {'etag': 'abc'}))
+
+    def test_lru_eviction(self):
+        keys = [self.cache.make_key('a', 'c', str(i)) for i in range(3)]
+        for key in keys[:2]:
+            self.fill(key, 'x' * 400)
+        self.cache.use(self.cache.get(keys[0]))
+        self.fill(keys[2], 'x' * 400)
+        self.assertEqual(None, self.cache.get(keys[1]))
+        self.assertNotEqual(None, self.cache.get(keys[0]))
+        self.assertTrue(self.cache.stats()['bytes'] <= 1000)
+        self.assertEqual(1, self.cache.stats()['evictions'])
+
+    def test_load(self):
+        self.fill(self.key, 'hello')
+        cache = contentcache.ContentCache(self.path)
+        self.assertEqual(1, cache.stats()['entries'])
+        self.assertEqual('hello', cache.get(self.key).read(5))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,218 @@
+# Copyright 2013 Christian Schwede <info@cschwede.de>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import hashlib
+import json
+import threading
+import unittest
+
+from wsgidav import dav_error
+
+from swiftdav import pool
+from swiftdav import swiftdav
+
+STORAGE_URL = 'http://127.0.0.1/v1/AUTH_test'
+
+
+class DummySocket(object):
+    def setsockopt(self, *args):
+        pass
+
+
+class DummyResponse(object):
+    reason = 'Created'
+    will_close = False
+
+    def __init__(self, status=201, etag=None):
+        self.status = status
+        self.etag = etag
+
+    def read(self):
+        return ''
+
+    def getheader(self, name, default=None):
+        if name.lower() == 'etag' and self.etag:
+            return self.etag
+        return default
+
+    def getheaders(self):
+        return []
+
+    def isclosed(self):
+        return True
+
+
+class DummyConnection(object):
+    """Records the requests and the data sent on it."""
+
+    def __init__(self, log, lock, response):
+        self.log = log
+        self.lock = lock
+        self.response = response
+        self.sent = []
+        self.sock = DummySocket()
+
+    def request(self, method, path, body=None, headers=None):
+        with self.lock:
+            self.log.append((method, path, body and str(bytearray(body)),
+                             headers))
+
+    def send(self, data):
+        self.sent.append(str(bytearray(data)))
+
+    def getresponse(self):
+        return self.response
+
+    def close(self):
+        pass
+
+
+class TestUploadFile(unittest.TestCase):
+    def setUp(self):
+        self.requests = []
+        self.connections = []
+        self.response = DummyResponse()
+        lock = threading.Lock()
+
+        def create():
+            conn = DummyConnection(self.requests, lock, self.response)
+            self.connections.append(conn)
+            return conn
+        self.conn_pool = pool.ConnectionPool(create)
+
+    def upload(self, length, chunks, **kwargs):
+        upload = swiftdav.UploadFile(STORAGE_URL, 'token', 'c', 'obj', length,
+                                     conn_pool=self.conn_pool, **kwargs)
+        for chunk in chunks:
+            upload.write(chunk)
+        upload.close()
+        return upload
+
+    def test_chunk_framing(self):
+        large = 'x' * (swiftdav.SMALL_CHUNK + 1)
+        self.upload(None, ['abc', '', large])
+        sent = self.connections[0].sent
+        self.assertEqual(['3\r\nabc', '\r\n%x\r\n' % len(large), large,
+                          '\r\n0\r\n\r\n'], sent)
+
+    def test_segments(self):
+        self.upload(10, ['abcde', 'fghij'], segment_size=4,
+                    segment_threshold=0)
+        segments = sorted((path.rsplit('/', 1)[1], body)
+                          for method, path, body, _ in self.requests
+                          if '/c_segments/obj/' in path)
+        self.assertEqual([('00000000', 'abcd'), ('00000001', 'efgh'),
+                          ('00000002', 'ij')], segments)
+        manifest = json.loads(self.requests[-1][2])
+        self.assertEqual([4, 4, 2], [s['size_bytes'] for s in manifest])
+
+    def test_single_segment_stays_object(self):
+        self.upload(None, ['abcd'], segment_size=4)
+        self.assertEqual([('PUT', '/v1/AUTH_test/c/obj', 'abcd')],
+                         [request[:3] for request in self.requests])
+
+    def test_etag_verified(self):
+        self.response.etag = hashlib.md5('abcdef').hexdigest()
+        self.upload(6, ['abc', 'def'])
+        self.response.etag = '"%s"' % hashlib.md5('abc').hexdigest()
+        upload = swiftdav.UploadFile(STORAGE_URL, 'token', 'c', 'obj', 6,
+                                     conn_pool=self.conn_pool)
+        upload.write('abcdef')
+        try:
+            upload.close()
+            self.fail('ETag mismatch not detected')
+        except dav_error.DAVError as ex:
+            self.assertEqual(502, ex.value)
+
+    def test_error_status(self):
+        self.response.status = 503
+        for length, chunks, kwargs in ((3, ['abc'], {}),
+                                       (None, ['abc'], {'segment_size': 4})):
+            upload = swiftdav.UploadFile(STORAGE_URL, 'token', 'c', 'obj',
+                                         length, conn_pool=self.conn_pool,
+                                         **kwargs)
+            for chunk in chunks:
+                upload.write(chunk)
+            try:
+                upload.close()
+                self.fail('Error status not detected')
+            except dav_error.DAVError as ex:
+                self.assertEqual(503, ex.value)
+
+    def test_incomplete_upload_discarded(self):
+        upload = swiftdav.UploadFile(STORAGE_URL, 'token', 'c', 'obj', 10,
+                                     conn_pool=self.conn_pool)
+        upload.write('abcde')
+        self.assertRaises(dav_error.DAVError, upload.close)
+        # Without the last chunk Swift discards the object
+        self.assertEqual(['5\r\nabcde'], self.connections[0].sent)
+
+    def test_content_md5(self):
+        etag = hashlib.md5('abc').hexdigest()
+        self.response.etag = etag
+        self.upload(3, ['abc'], etag=etag)
+        self.assertEqual(etag, self.requests[0][3]['ETag'])
+
+        upload = swiftdav.UploadFile(STORAGE_URL, 'token', 'c', 'obj', 3,
+                                     conn_pool=self.conn_pool, etag=etag)
+        del self.connections[0].sent[:]
+        upload.write('abd')
+        try:
+            upload.finish()
+            self.fail('Content-MD5 mismatch not detected')
+        except swiftdav.client.ClientException as ex:
+            self.assertEqual(400, ex.http_status)
+        self.assertEqual(['3\r\nabd'], self.connections[0].sent)
+
+    def test_buffered_object_sends_etag(self):
+        self.upload(None, ['abcd'], segment_size=4)
+        self.assertEqual(hashlib.md5('abcd').hexdigest(),
+                         self.requests[0][3]['ETag'])
+
+    def test_parse_content_md5(self):
+        etag = hashlib.md5('abc').hexdigest()
+        for value in ('kAFQmDzST7DWlj99KOF/cg==', etag, etag.upper()):
+            self.assertEqual(etag, swiftdav.content_md5(
+                {'HTTP_CONTENT_MD5': value}))
+        self.assertEqual(None, swiftdav.content_md5({}))
+        for value in ('abc', 'kAFQmDzST7DWlj99KOF/'):
+            self.assertRaises(dav_error.DAVError, swiftdav.content_md5,
+                              {'HTTP_CONTENT_MD5': value})
+
+class TestGetDownload(unittest.TestCase):
+    def setUp(self):
+        self.requests = []
+        self.response = DummyResponse()
+        lock = threading.Lock()
+        conn_pool = pool.ConnectionPool(
+            lambda: DummyConnection(self.requests, lock, self.response))
+        provider = swiftdav.SwiftProvider()
+        provider.pools.get = lambda *args, **kwargs: conn_pool
+        environ = {'wsgidav.provider': provider,
+                   'swift_storage_url': STORAGE_URL,
+                   'swift_auth_token': 'token',
+                   'REQUEST_METHOD': 'GET', 'PATH_INFO': '/c/obj'}
+        self.collection = swiftdav.ObjectCollection('c', environ)
+
+    def test_missing(self):
+        self.response.status = 404
+        self.assertEqual(None, self.collection.get_download('obj'))
+
+    def test_error_status(self):
+        for status in (401, 500, 503):
+            self.response.status = status
+            with self.assertRaises(dav_error.DAVError) as cm:
+                self.collection.get_download('obj')
+            self.assertEqual(status, cm.exception.value)
+        self.assertEqual(3, len(self.requests))
@@ -41,6 +41,7 @@ class TestSwiftDav(unittest.TestCase):
             self.filen2 + '/',
             self.filen2 + '/a',
             self.filen2 + '/a/b',
+            self.filen2 + '/a/b/',
             self.filen2 + '/a/b/c',
         ]
 
@@ -93,6 +94,29 @@ class TestSwiftDav(unittest.TestCase):
         self.assertEqual(200, response)
         self.assertEqual(self.data, response.content)
 
+    def test_read_range(self):
+        self.swiftclient.put_container(self.dirname)
+        self.swiftclient.put_object(self.dirname, self.filename, self.data)
+
+        response = self.webdav.get(self.fullname, {'Range': 'bytes=1-3'})
+        self.assertEqual(206, response)
+        self.assertEqual(self.data[1:4], response.content)
+
+        response = self.webdav.get(self.fullname, {'Range': 'bytes=-2'})
+        self.assertEqual(206, response)
+        self.assertEqual(self.data[-2:], response.content)
+
+        # Like wsgidav, only the merged range with the highest offset is
+        # served, whatever the order in the header
+        for ranges in ('bytes=0-0,3-4', 'bytes=3-4,0-0'):
+            response = self.webdav.get(self.fullname, {'Range': ranges})
+            self.assertEqual(206, response)
+            self.assertEqual(self.data[3:5], response.content)
+
+        response = self.webdav.get(self.fullname, {'Range': 'bytes=0-1,1-2'})
+        self.assertEqual(206, response)
+        self.assertEqual(self.data[0:3], response.content)
+
     def test_delete_file(self):
         self.swiftclient.put_container(self.dirname)
         self.swiftclient.put_object(self.dirname, self.filename, self.data)
@@ -103,6 +127,30 @@ class TestSwiftDav(unittest.TestCase):
                           self.swiftclient.head_object,
                           self.dirname, self.filename)
 
+    def test_delete_non_empty_pseudofolder(self):
+        self.swiftclient.put_container(self.dirname)
+        self.swiftclient.put_object(self.dirname, self.filen2 + '/', '',
+                                    content_type='application/directory')
+        self.swiftclient.put_object(self.dirname, self.filen2 + '/a/b',
+                                    self.data)
+        self.swiftclient.put_object(self.dirname, self.filename, self.data)
+
+        response = self.webdav.delete(self.dirname + '/' + self.filen2 + '/')
+        self.assertEqual(204, response)
+        _, objects = self.swiftclient.get_container(self.dirname)
+        self.assertEqual([self.filename], [obj['name'] for obj in objects])
+
+    def test_delete_non_empty_container(self):
+        self.swiftclient.put_container(self.dirname)
+        self.swiftclient.put_object(self.dirname, self.filen2 + '/a/b',
+                                    self.data)
+
+        response = self.webdav.delete(self.dirname + '/')
+        self.assertEqual(204, response)
+        self.assertRaises(swiftclient.ClientException,
+                          self.swiftclient.head_container,
+                          self.dirname)
+
     def test_move_container(self):
 		self.swiftclient.put_container(self.dirname)
 		response = self.webdav.move(self.dirname + '/', self.dirn2 + '/')
@@ -129,10 +177,40 @@ class TestSwiftDav(unittest.TestCase):
         self.webdav.mkcol(self.dirname)
         self.webdav.mkcol(self.dirname + '/' + self.filename + '/')
         self.webdav.put(self.dirname + '/' + self.filename + '/a', self.data)
-        self.assertRaises(tinydav.HTTPUserError,
-                          self.webdav.move,
-                          self.dirname + '/' + self.filename + '/',
-                          self.dirname + '/' + self.filen2 + '/')
+        response = self.webdav.move(self.dirname + '/' + self.filename + '/',
+                                    self.dirname + '/' + self.filen2 + '/')
+        self.assertEqual(201, response)
+
+        header, body = self.swiftclient.get_object(self.dirname,
+                                                   self.filen2 + '/a')
+        self.assertEqual(self.data, body)
+        self.assertRaises(swiftclient.ClientException,
+                          self.swiftclient.head_object,
+                          self.dirname, self.filename + '/a')
+
+    def test_copy_file(self):
+        self.swiftclient.put_container(self.dirname)
+        self.swiftclient.put_object(self.dirname, self.filename, self.data,
+                                    content_type='text/plain')
+
+        response = self.webdav.copy(self.fullname, self.fullname2)
+        self.assertEqual(201, response)
+        header, body = self.swiftclient.get_object(self.dirname, self.filen2)
+        self.assertEqual(self.data, body)
+        self.assertEqual('text/plain', header.get('content-type'))
+        self.assertTrue(self.swiftclient.head_object(self.dirname,
+                                                     self.filename))
+
+    def test_copy_container(self):
+        self.swiftclient.put_container(self.dirname)
+        self.swiftclient.put_object(self.dirname, self.filen2 + '/a/b',
+                                    self.data)
+
+        response = self.webdav.copy(self.dirname + '/', self.dirn2 + '/')
+        self.assertEqual(204, response)
+        header, body = self.swiftclient.get_object(self.dirn2,
+                                                   self.filen2 + '/a/b')
+        self.assertEqual(self.data, body)
 
     def test_upload_with_match_and_since(self):
         self.swiftclient.put_container(self.dirname)
@@ -171,6 +249,24 @@ class TestSwiftDav(unittest.TestCase):
         self.assertTrue(etag in resp.content)
         self.assertTrue(creationdate in resp.content)
 
+    def test_propfind_infinity(self):
+        self.swiftclient.put_container(self.dirname)
+        self.swiftclient.put_object(self.dirname, self.filename, self.data)
+        # testfile2/ and testfile2/a/ have no marker objects
+        self.swiftclient.put_object(self.dirname, self.filen2 + '/a/b/', '',
+                                    content_type='application/directory')
+        self.swiftclient.put_object(self.dirname, self.filen2 + '/a/b/c',
+                                    self.data)
+
+        resp = self.webdav.propfind(self.dirname + '/', depth='infinity')
+        self.assertEqual(207, resp)
+        prefix = '/%s/' % self.dirname
+        self.assertEqual(
+            [prefix, prefix + self.filename, prefix + self.filen2 + '/',
+             prefix + self.filen2 + '/a/', prefix + self.filen2 + '/a/b/',
+             prefix + self.filen2 + '/a/b/c'],
+            sorted(status.href for status in resp))
+
     @nottest
     def test_upload_bigfile(self):
         # Speed depends highly on the used Swift cluster (remote, SSD, ...)
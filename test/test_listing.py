@@ -0,0 +1,131 @@
+# Copyright 2013 Christian Schwede <info@cschwede.de>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import unittest
+
+from swiftdav import cache
+from swiftdav import pool
+from swiftdav import swiftdav
+
+
+class DummyProvider(object):
+    def __init__(self):
+        self.pools = pool.PoolManager()
+        self.metadata = cache.MetadataCache()
+
+
+class TestListing(unittest.TestCase):
+    def setUp(self):
+        self.names = ['obj%02d' % i for i in range(25)]
+        self.calls = []
+        self.environ = {'wsgidav.provider': DummyProvider(),
+                        'swift_storage_url': 'http://127.0.0.1/v1/AUTH_t'}
+
+    def get_container(self, _url, _token, container, limit=None,
+                      marker=None, http_conn=None):
+        self.calls.append(marker)
+        names = [n for n in self.names if marker is None or n > marker]
+        return {}, [{'name': n} for n in names[:limit]]
+
+    def listing(self, **kwargs):
+        orig = swiftdav.client.get_container
+        swiftdav.client.get_container = self.get_container
+        try:
+            for entry in swiftdav.iter_listing(self.environ, 'c', **kwargs):
+                yield entry['name']
+        finally:
+            swiftdav.client.get_container = orig
+
+    def test_pages(self):
+        self.assertEqual(self.names, list(self.listing(page_size=10)))
+        self.assertEqual([None, 'obj09', 'obj19'], self.calls)
+
+    def test_exact_page(self):
+        self.names = self.names[:20]
+        self.assertEqual(self.names, list(self.listing(page_size=10)))
+        self.assertEqual([None, 'obj09', 'obj19'], self.calls)
+
+    def test_stop_early(self):
+        for _ in self.listing(page_size=10):
+            break
+        self.assertEqual([None], self.calls)
+
+    def test_cached_pages(self):
+        list(self.listing(page_size=10))
+        self.assertEqual(self.names, list(self.listing(page_size=10)))
+        self.assertEqual(3, len(self.calls))
+
+
+class TestObjectInfo(unittest.TestCase):
+    def test_listing_time(self):
+        self.assertEqual(782847811, swiftdav.parse_listing_time(
+            u'1994-10-22T17:43:31.123456'))
+        self.assertEqual(782847811, swiftdav.parse_listing_time(
+            '1994-10-22T17:43:31'))
+        for value in (None, '', '1994-10-22 17:43:31', '1994-13-22T17:43:31'):
+            self.assertEqual(None, swiftdav.parse_listing_time(value))
+
+    def test_from_listing(self):
+        info = swiftdav.ObjectInfo.from_listing(
+            {u'name': u'o', u'bytes': 5, u'hash': u'abc',
+             u'content_type': u'text/plain',
+             u'last_modified': u'1994-10-22T17:43:31.123456'})
+        self.assertEqual(5, info.size)
+        self.assertEqual('text/plain', info.content_type)
+        self.assertEqual('abc', info.etag)
+        self.assertEqual(782847811, info.modified)
+
+    def test_from_headers(self):
+        info = swiftdav.ObjectInfo.from_headers(
+            {'content-length': '5', 'etag': '"abc"',
+             'last-modified': 'Sat, 22 Oct 1994 17:43:31 GMT'})
+        self.assertEqual(5, info.size)
+        self.assertEqual('application/octet-stream', info.content_type)
+        self.assertEqual('abc', info.etag)
+        self.assertEqual(782847811, info.modified)
+        info = swiftdav.ObjectInfo.from_headers({})
+        self.assertEqual((None, None, None),
+                         (info.size, info.etag, info.modified))
+
+
+class TestContainerStats(unittest.TestCase):
+    def test_from_listing(self):
+        stats = swiftdav.ContainerStats.from_listing(
+            {u'name': u'c', u'count': 3, u'bytes': 42,
+             u'last_modified': u'1994-10-22T17:43:31.123456'})
+        self.assertEqual((3, 42, 782847811),
+                         (stats.count, stats.size, stats.created))
+        stats = swiftdav.ContainerStats.from_listing(
+            {u'name': u'c', u'count': 3, u'bytes': 42})
+        self.assertEqual(None, stats.created)
+
+    def test_from_headers(self):
+        stats = swiftdav.ContainerStats.from_headers(
+            {'x-container-object-count': '3',
+             'x-container-bytes-used': '42',
+             'x-timestamp': '782847811.12345'})
+        self.assertEqual((3, 42, 782847811.12345),
+                         (stats.count, stats.size, stats.created))
+        stats = swiftdav.ContainerStats.from_headers({})
+        self.assertEqual((None, None, None),
+                         (stats.count, stats.size, stats.created))
+
+    def test_quota_used_bytes(self):
+        stats = swiftdav.ContainerStats(3, 42, None)
+        collection = swiftdav.ObjectCollection(
+            'c', {'wsgidav.provider': DummyProvider()}, path='/c',
+            stats=stats)
+        self.assertEqual('42', collection.getPropertyValue(
+            swiftdav.QUOTA_USED_BYTES))
+        self.assertEqual(None, collection.getCreationDate())
@@ -0,0 +1,94 @@
+# Copyright 2013 Christian Schwede <info@cschwede.de>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import time
+import unittest
+
+from swiftdav import metrics
+
+
+class DummyProvider(object):
+    def __init__(self):
+        self.metrics = metrics.Metrics()
+
+
+class TestMetrics(unittest.TestCase):
+    def setUp(self):
+        self.provider = DummyProvider()
+        self.registry = self.provider.metrics
+        self.environ = {'wsgidav.provider': self.provider,
+                        'REQUEST_METHOD': 'PROPFIND',
+                        'PATH_INFO': '/c/'}
+        self.headers = None
+
+    def app(self, environ, start_response):
+        metrics.record(environ, 'get_container', time.time(), 200)
+        metrics.record(environ, 'head_object', time.time(), 404)
+        start_response('207 Multi-Status', [])
+        return ['body']
+
+    def start_response(self, status, headers, exc_info=None):
+        self.headers = dict(headers)
+
+    def call(self, debug=False):
+        middleware = metrics.MetricsMiddleware(self.app, self.registry, debug)
+        result = middleware(self.environ, self.start_response)
+        body = ''.join(result)
+        if hasattr(result, 'close'):
+            result.close()
+        return body
+
+    def test_status_class(self):
+        self.assertEqual('2xx', metrics.status_class(206))
+        self.assertEqual('4xx', metrics.status_class('404'))
+        self.assertEqual('error', metrics.status_class(None))
+
+    def test_record(self):
+        metrics.record(self.environ, 'put_object', time.time() - 0.02, 201,
+                       100)
+        text = self.registry.render()
+        self.assertTrue('swiftdav_backend_requests_total{operation='
+                        '"put_object",status="2xx"} 1' in text)
+        self.assertTrue('swiftdav_backend_request_seconds_bucket{operation='
+                        '"put_object",le="0.01"} 0' in text)
+        self.assertTrue('swiftdav_backend_request_seconds_bucket{operation='
+                        '"put_object",le="+Inf"} 1' in text)
+        self.assertTrue('swiftdav_backend_bytes_total{operation='
+                        '"put_object"} 100' in text)
+
+    def test_request_trace(self):
+        self.assertEqual('body', self.call())
+        trace = self.environ[metrics.TRACE_KEY]
+        self.assertEqual(2, trace.count)
+        self.assertEqual(None, trace.calls)
+        self.assertFalse('X-Backend-Calls' in self.headers)
+        text = self.registry.render()
+        self.assertTrue('swiftdav_requests_total{method="PROPFIND",'
+                        'status="2xx"} 1' in text)
+        self.assertTrue('swiftdav_backend_requests_total{operation='
+                        '"head_object",status="4xx"} 1' in text)
+
+    def test_debug_headers(self):
+        self.call(debug=True)
+        self.assertEqual('2', self.headers['X-Backend-Calls'])
+        self.assertEqual(2, len(self.environ[metrics.TRACE_KEY].calls))
+
+    def test_metrics_endpoint(self):
+        self.registry.add_collector('cache', lambda: {'hits': 3})
+        self.environ.update(REQUEST_METHOD='GET',
+                            PATH_INFO=metrics.METRICS_PATH)
+        body = self.call()
+        self.assertTrue(self.headers['Content-Type'].startswith('text/plain'))
+        self.assertTrue('swiftdav_cache_hits 3\n' in body)
+        self.assertFalse(metrics.TRACE_KEY in self.environ)
@@ -0,0 +1,101 @@
+# Copyright 2013 Christian Schwede <info@cschwede.de>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import threading
+import unittest
+
+from swiftdav import pool
+
+
+class DummyConnection(object):
+    def __init__(self):
+        self.closed = False
+        self.healthy = True
+
+    def close(self):
+        self.closed = True
+
+
+class TestConnectionPool(unittest.TestCase):
+    def setUp(self):
+        self.pool = pool.ConnectionPool(DummyConnection, max_size=1,
+                                        check=lambda conn: conn.healthy)
+
+    def test_reuse(self):
+        conn = self.pool.get()
+        self.pool.put(conn)
+        self.assertTrue(conn is self.pool.get())
+        self.assertEqual(1, self.pool.created)
+        self.assertEqual(1, self.pool.reused)
+
+    def test_max_size(self):
+        conn1 = self.pool.get()
+        conn2 = self.pool.get()
+        self.assertFalse(conn1 is conn2)
+        self.pool.put(conn1)
+        self.pool.put(conn2)
+        self.assertFalse(conn1.closed)
+        self.assertTrue(conn2.closed)
+
+    def test_idle_timeout(self):
+        self.pool.idle_timeout = -1
+        conn = self.pool.get()
+        self.pool.put(conn)
+        self.assertFalse(conn is self.pool.get())
+        self.assertTrue(conn.closed)
+
+    def test_health_check(self):
+        conn = self.pool.get()
+        conn.healthy = False
+        self.pool.put(conn)
+        self.assertFalse(conn is self.pool.get())
+        self.assertTrue(conn.closed)
+
+    def test_manager(self):
+        manager = pool.PoolManager()
+        self.assertTrue(manager.get('http://127.0.0.1:8080/v1/AUTH_a') is
+                        manager.get('http://127.0.0.1:8080/v1/AUTH_b'))
+        self.assertFalse(manager.get('http://127.0.0.1:8080/v1/AUTH_a') is
+                         manager.get('http://127.0.0.1:8080/v1/AUTH_a',
+                                     raw=True))
+
+
+class TestMaxConnections(unittest.TestCase):
+    def setUp(self):
+        self.pool = pool.ConnectionPool(DummyConnection, max_size=1,
+                                        max_connections=2)
+        self.pool.reclaim_interval = 0.01
+
+    def test_limit(self):
+        conn1 = self.pool.get()
+        conn2 = self.pool.get()
+        waiter = threading.Thread(target=self.pool.get)
+        waiter.start()
+        waiter.join(0.05)
+        self.assertTrue(waiter.is_alive())
+        self.pool.discard(conn1)
+        waiter.join(1)
+        self.assertFalse(waiter.is_alive())
+        self.assertEqual(2, self.pool.in_use)
+        self.pool.put(conn2)
+        self.pool.put(conn2)
+        self.assertEqual(1, self.pool.in_use)
+
+    def test_reclaim_collected(self):
+        self.pool.get()
+        self.pool.get()
+        conn = self.pool.get()
+        self.assertEqual(1, self.pool.in_use)
+        self.pool.put(conn)
+        self.assertEqual(0, self.pool.in_use)
@@ -0,0 +1,99 @@
+# Copyright 2013 Christian Schwede <info@cschwede.de>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import unittest
+from xml.etree import ElementTree
+
+from wsgidav import property_manager
+
+from swiftdav import propfind
+from swiftdav import swiftdav
+
+
+class DummyProvider(object):
+    lockManager = None
+
+    def __init__(self):
+        self.propManager = property_manager.PropertyManager()
+        self.mountPath = self.sharePath = ''
+
+
+def parse(response):
+    """Return {status: {property name: text}} of a <D:response>."""
+    root = ElementTree.fromstring(
+        '<D:multistatus xmlns:D="DAV:">%s</D:multistatus>' % response)
+    result = {}
+    for propstat in root.iter('{DAV:}propstat'):
+        status = propstat.find('{DAV:}status').text
+        result[status] = dict((prop.tag, prop.text)
+                              for prop in propstat.find('{DAV:}prop'))
+    return result
+
+
+class TestRenderResponse(unittest.TestCase):
+    def setUp(self):
+        self.provider = DummyProvider()
+        environ = {'wsgidav.provider': self.provider}
+        self.res = swiftdav.ObjectResource(
+            'c', 'a&b', environ, info=swiftdav.ObjectInfo(
+                5, u'text/plain', 'abc', 782847811))
+
+    def test_element(self):
+        self.assertEqual('<D:getetag/>', propfind.element('{DAV:}getetag'))
+        self.assertEqual('<X:p xmlns:X="urn:&lt;x&gt;">a &amp; b</X:p>',
+                         propfind.element('{urn:<x>}p', u'a & b'))
+        self.assertEqual('<p/>', propfind.element('p'))
+
+    def test_requested_properties(self):
+        self.assertEqual(None, propfind.requested_properties(''))
+        self.assertEqual(None, propfind.requested_properties(
+            '<D:propfind xmlns:D="DAV:"><D:allprop/></D:propfind>'))
+        self.assertEqual(['{DAV:}getetag', '{urn:x}p'],
+                         propfind.requested_properties(
+                             '<D:propfind xmlns:D="DAV:" xmlns:X="urn:x">'
+                             '<D:prop><D:getetag/><X:p/></D:prop>'
+                             '</D:propfind>'))
+        for body in ('<D:propfind xmlns:D="DAV:"><D:propname/></D:propfind>',
+                     '<invalid'):
+            self.assertRaises(ValueError, propfind.requested_properties,
+                              body)
+
+    def test_allprop(self):
+        self.provider.propManager.writeProperty(
+            '/c/a%26b', '{urn:x}p', '<X:p xmlns:X="urn:x">v</X:p>')
+        result = parse(propfind.render_response(self.res, None))
+        self.assertEqual(['200 OK'], [s.split(' ', 1)[1] for s in result])
+        props = result.values()[0]
+        self.assertEqual({'{DAV:}resourcetype': None,
+                          '{DAV:}creationdate': '1994-10-22T17:43:31Z',
+                          '{DAV:}getcontentlength': '5',
+                          '{DAV:}getcontenttype': 'text/plain',
+                          '{DAV:}getlastmodified':
+                              'Sat, 22 Oct 1994 17:43:31 GMT',
+                          '{DAV:}displayname': 'a&b',
+                          '{DAV:}getetag': 'abc',
+                          '{urn:x}p': 'v'}, props)
+
+    def test_named(self):
+        response = propfind.render_response(
+            self.res, ['{DAV:}getetag', '{urn:x}missing'])
+        self.assertTrue('<D:href>/c/a%26b</D:href>' in response)
+        self.assertEqual(
+            {'HTTP/1.1 200 OK': {'{DAV:}getetag': 'abc'},
+             'HTTP/1.1 404 Not Found': {'{urn:x}missing': None}},
+            parse(response))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,105 @@
+# Copyright 2013 Christian Schwede <info@cschwede.de>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import threading
+import unittest
+
+from swiftdav import readahead
+
+
+class TestBudget(unittest.TestCase):
+    def test_acquire_release(self):
+        budget = readahead.Budget(10)
+        self.assertTrue(budget.try_acquire(6))
+        self.assertFalse(budget.try_acquire(6))
+        budget.release(6)
+        self.assertTrue(budget.try_acquire(10))
+
+
+class TestPrefetcher(unittest.TestCase):
+    def setUp(self):
+        self.blocks = ['a', 'b', 'c']
+        self.fetched = []
+
+    def fetch(self, index):
+        self.fetched.append(index)
+        if index < len(self.blocks):
+            return self.blocks[index]
+        return ''
+
+    def read_all(self, prefetcher):
+        data = []
+        while True:
+            block = prefetcher.get()
+            if not block:
+                return data
+            data.append(block)
+
+    def test_sequential(self):
+        prefetcher = readahead.Prefetcher(self.fetch, 1, 2)
+        self.assertEqual(self.blocks, self.read_all(prefetcher))
+        self.assertEqual('', prefetcher.get())
+        self.assertTrue(prefetcher.close())
+        self.assertEqual([0, 1, 2, 3], self.fetched)
+
+    def test_parallel_with_count(self):
+        prefetcher = readahead.Prefetcher(self.fetch, 1, 2, workers=3,
+                                          count=3)
+        self.assertEqual(self.blocks, self.read_all(prefetcher))
+        self.assertTrue(prefetcher.close())
+        self.assertEqual([0, 1, 2], sorted(self.fetched))
+
+    def test_window(self):
+        release = threading.Event()
+
+        def fetch(index):
+            self.fetched.append(index)
+            release.wait(1)
+            return 'x'
+
+        prefetcher = readahead.Prefetcher(fetch, 1, 2, workers=4, count=10)
+        prefetcher.get()
+        self.assertTrue(len(self.fetched) <= 3)
+        release.set()
+        self.assertTrue(prefetcher.close())
+
+    def test_budget(self):
+        budget = readahead.Budget(0)
+        prefetcher = readahead.Prefetcher(self.fetch, 1, 3, budget=budget)
+        # The block the reader waits for is fetched without budget
+        self.assertEqual(self.blocks, self.read_all(prefetcher))
+        self.assertTrue(prefetcher.close())
+        self.assertEqual(0, budget.used)
+
+    def test_budget_released(self):
+        budget = readahead.Budget(10)
+        prefetcher = readahead.Prefetcher(self.fetch, 1, 3, budget=budget)
+        self.assertEqual('a', prefetcher.get())
+        self.assertTrue(prefetcher.close())
+        self.assertEqual(0, budget.used)
+
+    def test_error_in_order(self):
+        def fetch(index):
+            if index == 1:
+                raise IOError('failed')
+            return 'x'
+
+        prefetcher = readahead.Prefetcher(fetch, 1, 3, workers=2, count=3)
+        self.assertEqual('x', prefetcher.get())
+        self.assertRaises(IOError, prefetcher.get)
+        prefetcher.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
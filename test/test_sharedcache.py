@@ -0,0 +1,66 @@
+# Copyright 2013 Christian Schwede <info@cschwede.de>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+from swiftdav import sharedcache
+
+ACCOUNT = 'http://127.0.0.1/v1/AUTH_test'
+
+
+class TestSharedCache(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, 'cache.sock')
+        self.server = sharedcache.CacheServer(self.path)
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        self.metadata = sharedcache.SharedMetadataCache(self.path)
+        self.tokens = sharedcache.SharedTokenCache(self.path)
+
+    def tearDown(self):
+        self.metadata.conn_pool.close()
+        self.tokens.conn_pool.close()
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.tmpdir)
+
+    def test_metadata(self):
+        key = self.metadata.listing_key(ACCOUNT, 'c', 'a/', delimiter='/')
+        page = [{'name': u'a/\xe4', 'bytes': 1}, {'subdir': u'a/b/'}]
+        self.metadata.set(key, page)
+        self.assertEqual(page, self.metadata.get(key))
+        other = sharedcache.SharedMetadataCache(self.path)
+        self.assertEqual(page, other.get(key))
+        self.metadata.invalidate(ACCOUNT, 'c', 'a/x')
+        self.assertEqual(None, other.get(key))
+        self.assertEqual(1, other.stats()['invalidations'])
+        other.conn_pool.close()
+
+    def test_tokens(self):
+        key = self.tokens.make_key('http://auth', 'test:tester', 'testing')
+        self.tokens.set(key, 'http://storage', 'token', None)
+        self.assertEqual(('http://storage', 'token'), self.tokens.get(key))
+
+    def test_server_unavailable(self):
+        self.server.shutdown()
+        self.server.server_close()
+        cache = sharedcache.SharedTokenCache(self.path)
+        self.assertEqual(None, cache.get(('key', )))
+        self.assertEqual({}, cache.stats())
@@ -0,0 +1,225 @@
+# Copyright 2013 Christian Schwede <info@cschwede.de>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import shutil
+import tarfile
+import tempfile
+import unittest
+from cStringIO import StringIO
+
+from wsgidav import dav_error
+
+from swiftdav import spool
+from swiftdav import swiftdav
+
+ACCOUNT = 'http://swift/v1/AUTH_a'
+
+
+class DummyUploader(object):
+    def __init__(self, failures=None):
+        self.batches = []
+        self.failures = failures or {}
+
+    def __call__(self, environ, container, entries):
+        self.batches.append((container, [(entry.name, entry.data)
+                                         for entry in entries]))
+        return [(entry, self.failures[entry.name]) for entry in entries
+                if entry.name in self.failures]
+
+
+class TestUploadSpool(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.spool = spool.UploadSpool(self.path, max_object_size=100,
+                                       batch_size=2)
+        self.environ = {'swift_storage_url': ACCOUNT}
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def files(self):
+        return sorted(name for _, _, names in os.walk(self.path)
+                      for name in names if not name.startswith('.'))
+
+    def test_accepts(self):
+        self.assertTrue(self.spool.accepts('0'))
+        self.assertTrue(self.spool.accepts('100'))
+        self.assertFalse(self.spool.accepts('101'))
+        self.assertFalse(self.spool.accepts(None))
+
+    def test_add_and_get(self):
+        self.assertEqual(None, self.spool.get(ACCOUNT, 'c', 'a.txt'))
+        writer = self.spool.open(ACCOUNT, 'c', 'a.txt')
+        writer.write('hello ')
+        writer.write('world')
+        writer.close()
+        spooled = self.spool.get(ACCOUNT, 'c', 'a.txt')
+        self.assertEqual('text/plain', spooled.headers['content-type'])
+        self.assertEqual('11', spooled.headers['content-length'])
+        self.assertEqual('5eb63bbbe01eeed093cb22bb8f5acdc3',
+                         spooled.headers['etag'])
+        self.assertEqual('hello world', spooled.read())
+        spooled.seek(6)
+        self.assertEqual('wor', spooled.read(3))
+        self.assertEqual(['c'], [entry.container for entry in
+                                 self.spool.listing(ACCOUNT, 'c', 'a')])
+        self.assertEqual([], self.spool.listing(ACCOUNT, 'c', 'b'))
+
+    def test_abort(self):
+        writer = self.spool.open(ACCOUNT, 'c', 'o')
+        writer.write('data')
+        writer.abort()
+        writer.close()
+        self.assertEqual([], self.files())
+
+    def test_verified_upload(self):
+        etag = '5eb63bbbe01eeed093cb22bb8f5acdc3'
+        for length, md5 in ((12, None), (11, etag[::-1])):
+            writer = self.spool.open(ACCOUNT, 'c', 'o', length, md5)
+            writer.write('hello world')
+            self.assertRaises(dav_error.DAVError, writer.close)
+        self.assertEqual([], self.files())
+        writer = self.spool.open(ACCOUNT, 'c', 'o', 11, etag)
+        writer.write('hello world')
+        writer.close()
+        self.assertEqual(etag, self.spool.get(ACCOUNT, 'c', 'o').headers[
+            'etag'])
+
+    def test_flush(self):
+        for name in ('o1', 'o2', 'o3'):
+            self.spool.add(ACCOUNT, 'c', name, name)
+        self.spool.add(ACCOUNT, 'd', 'o4', 'o4')
+        self.spool.add('http://other/v1/AUTH_b', 'c', 'o5', 'o5')
+        uploader = DummyUploader()
+        self.assertEqual(0, self.spool.flush(self.environ, uploader))
+        self.assertEqual(
+            [('c', [('o1', 'o1'), ('o2', 'o2')]), ('c', [('o3', 'o3')]),
+             ('d', [('o4', 'o4')])],
+            sorted(uploader.batches))
+        self.assertEqual(1, len(self.files()))
+        stats = self.spool.stats()
+        self.assertEqual((1, 2, 4, 3, 5),
+                         (stats['pending'], stats['pending_bytes'],
+                          stats['flushed'], stats['batches'],
+                          stats['spooled']))
+
+    def test_flush_prefix(self):
+        self.spool.add(ACCOUNT, 'c', 'a/o1', 'o1')
+        self.spool.add(ACCOUNT, 'c', 'b/o2', 'o2')
+        uploader = DummyUploader()
+        self.spool.flush(self.environ, uploader, 'c', 'a/')
+        self.assertEqual([('c', [('a/o1', 'o1')])], uploader.batches)
+        self.assertEqual(None, self.spool.get(ACCOUNT, 'c', 'a/o1'))
+        self.assertNotEqual(None, self.spool.get(ACCOUNT, 'c', 'b/o2'))
+
+    def test_failures(self):
+        for name in ('retry', 'drop', 'expired'):
+            self.spool.add(ACCOUNT, 'c', name, name)
+        self.spool.remember(self.environ)
+        environ = self.spool.accounts[ACCOUNT]
+        uploader = DummyUploader({'retry': 503, 'drop': 403, 'expired': 401})
+        self.assertEqual(2, self.spool.flush(environ, uploader))
+        self.assertEqual(['retry', 'expired'], [
+            name for name in ('retry', 'drop', 'expired')
+            if self.spool.get(ACCOUNT, 'c', name) is not None])
+        self.assertEqual(1, self.spool.stats()['failed'])
+        # A new token is needed after a 401
+        self.assertEqual({}, self.spool.accounts)
+        # The refused object is kept, but not uploaded again
+        failed, = os.listdir(os.path.join(self.path, spool.FAILED))
+        entry = spool.SpoolEntry.read(
+            None, os.path.join(self.path, spool.FAILED, failed), True)
+        self.assertEqual(('drop', 'drop'), (entry.name, entry.data))
+        self.assertEqual(2, len(self.spool.scan()))
+
+    def test_newer_version_while_flushing(self):
+        self.spool.add(ACCOUNT, 'c', 'o', 'old')
+        entry, = self.spool.listing(ACCOUNT, 'c')
+        claimed = self.spool.claim(entry)
+        self.assertEqual('old', claimed.data)
+        self.spool.add(ACCOUNT, 'c', 'o', 'new')
+        # Not uploaded before the running upload is done
+        self.assertEqual(None, self.spool.claim(entry))
+        self.assertEqual('new', self.spool.get(ACCOUNT, 'c', 'o').read())
+        self.spool.release(claimed, True)
+        self.assertEqual('new', self.spool.claim(entry).data)
+
+    def test_failed_upload_is_spooled_again(self):
+        self.spool.add(ACCOUNT, 'c', 'o', 'data')
+        entry, = self.spool.listing(ACCOUNT, 'c')
+        claimed = self.spool.claim(entry)
+        self.assertEqual('data', self.spool.get(ACCOUNT, 'c', 'o').read())
+        self.spool.release(claimed, False)
+        self.assertEqual([entry.key], self.files())
+
+    def test_discard(self):
+        self.spool.add(ACCOUNT, 'c', 'a/o1', 'o1')
+        self.spool.add(ACCOUNT, 'c', 'a/o2', 'o2')
+        self.spool.add(ACCOUNT, 'c', 'b', 'b')
+        self.spool.discard(ACCOUNT, 'c', 'b')
+        self.assertEqual(None, self.spool.get(ACCOUNT, 'c', 'b'))
+        self.spool.discard(ACCOUNT, 'c', 'a/', tree=True)
+        self.assertEqual([], self.files())
+        self.assertEqual([], self.spool.listing(ACCOUNT, 'c'))
+
+    def test_scan(self):
+        self.spool.add(ACCOUNT, 'c', 'o', 'data')
+        other = spool.UploadSpool(self.path)
+        self.assertEqual([], other.listing(ACCOUNT, 'c'))
+        (entry, flushing), = other.scan()
+        self.assertEqual(('c', 'o'), (entry.container, entry.name))
+        self.assertFalse(flushing)
+        self.assertEqual(['o'], [listed.name for listed in
+                                 other.listing(ACCOUNT, 'c')])
+
+    def test_stale_flushing(self):
+        self.spool.add(ACCOUNT, 'c', 'o', 'data')
+        entry, = self.spool.listing(ACCOUNT, 'c')
+        self.spool.claim(entry)
+        self.assertEqual([(True, )], [(flushing, ) for _, flushing
+                                     in self.spool.scan()])
+        self.spool.flush_timeout = -1
+        self.assertEqual([(False, )], [(flushing, ) for _, flushing
+                                      in self.spool.scan()])
+        self.assertEqual([entry.key], self.files())
+
+
+class TestArchive(unittest.TestCase):
+    def test_archive_safe(self):
+        self.assertTrue(swiftdav.archive_safe('a/b.txt'))
+        for name in ('a/', '/a', 'a//b', './a', 'a/../b'):
+            self.assertFalse(swiftdav.archive_safe(name))
+
+    def test_spooled_archive(self):
+        entries = [spool.SpoolEntry('k', ACCOUNT, 'c', name, {
+            'content-type': ctype}, 782847811, data)
+            for name, ctype, data in (
+                ('a/b.txt', 'text/plain', 'hello'),
+                ('\xc3\xa4.bin', 'application/octet-stream', ''))]
+        archive = tarfile.open(
+            fileobj=StringIO(swiftdav.spooled_archive(entries)))
+        members = archive.getmembers()
+        self.assertEqual([u'a/b.txt', u'\xe4.bin'],
+                         [member.name.decode('utf-8') for member in members])
+        self.assertEqual(
+            [u'text/plain', u'application/octet-stream'],
+            [member.pax_headers['SCHILY.xattr.user.mime_type']
+             for member in members])
+        self.assertEqual('hello', archive.extractfile(members[0]).read())
+        self.assertEqual(782847811, members[0].mtime)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,179 @@
+# Copyright 2013 Christian Schwede <info@cschwede.de>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from wsgidav import dav_error
+from wsgidav import lock_manager
+
+from swiftdav import sqlstore
+
+
+def new_lock(timeout=60, scope='exclusive', depth='infinity'):
+    return {'type': 'write', 'scope': scope, 'depth': depth,
+            'owner': '<owner>tester</owner>', 'timeout': timeout,
+            'principal': 'tester'}
+
+
+class TestSQLiteLockStorage(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, 'locks.db')
+        self.storage = sqlstore.SQLiteLockStorage(self.path)
+        self.storage.open()
+
+    def tearDown(self):
+        self.storage.close()
+        shutil.rmtree(self.tmpdir)
+
+    def test_create_and_get(self):
+        lock = self.storage.create('/c/a/', new_lock())
+        self.assertEqual('/c/a', lock['root'])
+        stored = self.storage.get(lock['token'])
+        self.assertEqual(lock, stored)
+        self.assertTrue(isinstance(stored['owner'], str))
+        self.assertTrue(self.storage.delete(lock['token']))
+        self.assertEqual(None, self.storage.get(lock['token']))
+        self.assertFalse(self.storage.delete(lock['token']))
+
+    def test_persistent(self):
+        lock = self.storage.create('/c/a', new_lock())
+        storage = sqlstore.SQLiteLockStorage(self.path)
+        storage.open()
+        self.assertEqual(lock, storage.get(lock['token']))
+
+    def test_lock_list(self):
+        tokens = [self.storage.create(path, new_lock(depth='0'))['token']
+                  for path in ('/c/a', '/c/a/b', '/c/a/b/c', '/c/ab')]
+        self.assertEqual([tokens[0]], self.storage.getLockList(
+            '/c/a', True, False, True))
+        self.assertEqual(sorted(tokens[:3]), sorted(self.storage.getLockList(
+            '/c/a', True, True, True)))
+        self.assertEqual(sorted(tokens[1:3]), sorted(
+            lock['token'] for lock in self.storage.getLockList(
+                '/c/a', False, True, False)))
+
+    def assertLocked(self, path, lock, storage=None):
+        try:
+            (storage or self.storage).create(path, lock)
+            self.fail('Lock on %s not refused' % path)
+        except dav_error.DAVError as ex:
+            self.assertEqual(dav_error.HTTP_LOCKED, ex.value)
+
+    def test_conflicts(self):
+        # Another process sharing the database
+        other = sqlstore.SQLiteLockStorage(self.path)
+        other.open()
+        self.storage.create('/c/a', new_lock())
+        self.assertLocked('/c/a', new_lock(scope='shared', depth='0'), other)
+        self.assertLocked('/c/a/b', new_lock(depth='0'), other)
+        self.assertLocked('/c', new_lock(), other)
+        other.create('/c', new_lock(depth='0'))
+        other.create('/c/ab', new_lock())
+
+    def test_shared_locks(self):
+        self.storage.create('/c/a', new_lock(scope='shared'))
+        self.storage.create('/c/a', new_lock(scope='shared'))
+        self.storage.create('/c/a/b', new_lock(scope='shared'))
+        self.assertLocked('/c/a/b', new_lock(depth='0'))
+        self.assertEqual(3, len(self.storage.getLockList('/c/a', True, True,
+                                                         True)))
+
+    def test_expired_lock_does_not_conflict(self):
+        self.storage.create('/c/a', new_lock())
+        self.storage.db.execute('UPDATE locks SET expire = ?',
+                                (time.time() - 1, ))
+        self.storage.create('/c/a', new_lock())
+
+    def test_expiry(self):
+        lock = self.storage.create('/c/a', new_lock())
+        self.storage.db.execute('UPDATE locks SET expire = ?',
+                                (time.time() - 1, ))
+        self.assertEqual([], self.storage.getLockList('/c/a', True, True,
+                                                      True))
+        self.assertEqual(None, self.storage.get(lock['token']))
+
+    def test_cleanup(self):
+        self.storage.create('/c/a', new_lock())
+        self.storage.db.execute('UPDATE locks SET expire = ?',
+                                (time.time() - 1, ))
+        self.storage.cleanup()
+        self.assertEqual(0, self.storage.db.execute(
+            'SELECT COUNT(*) FROM locks').fetchone()[0])
+
+    def test_refresh(self):
+        lock = self.storage.create('/c/a', new_lock(timeout=10))
+        refreshed = self.storage.refresh(lock['token'], 100)
+        self.assertEqual(100, refreshed['timeout'])
+        self.assertEqual(refreshed, self.storage.get(lock['token']))
+
+    def test_lock_manager(self):
+        manager = lock_manager.LockManager(
+            sqlstore.SQLiteLockStorage(self.path))
+        lock = manager.acquire('/c/a', 'write', 'exclusive', 'infinity',
+                               '<owner/>', 60, 'tester', [])
+        self.assertTrue(manager.isUrlLocked('/c/a'))
+        self.assertEqual(1, len(manager.getIndirectUrlLockList('/c/a/b')))
+        manager.release(lock['token'])
+        self.assertFalse(manager.isUrlLocked('/c/a'))
+
+
+class TestSQLitePropertyManager(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, 'props.db')
+        self.props = sqlstore.SQLitePropertyManager(self.path)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_write_and_remove(self):
+        self.props.writeProperty('/c/a', '{ns:}p', '<p>1</p>')
+        self.props.writeProperty('/c/a', '{ns:}p', '<p>2</p>')
+        self.props.writeProperty('/c/a', '{ns:}q', '<q/>', dryRun=True)
+        self.assertEqual(['{ns:}p'], self.props.getProperties('/c/a'))
+        self.assertEqual('<p>2</p>', self.props.getProperty('/c/a', '{ns:}p'))
+        self.props.removeProperty('/c/a', '{ns:}p')
+        self.assertEqual(None, self.props.getProperty('/c/a', '{ns:}p'))
+
+    def test_copy(self):
+        self.props.writeProperty('/c/a', 'p', '1')
+        self.props.writeProperty('/c/b', 'q', '2')
+        self.props.copyProperties('/c/a', '/c/b')
+        self.assertEqual(['p'], self.props.getProperties('/c/b'))
+        self.assertEqual(['p'], self.props.getProperties('/c/a'))
+
+    def test_move_with_children(self):
+        for url in ('/c/a', '/c/a/x', '/c/a/x/y', '/c/ab'):
+            self.props.writeProperty(url, 'p', url)
+        self.props.moveProperties('/c/a', '/d/b', True)
+        self.assertEqual([], self.props.getProperties('/c/a/x'))
+        self.assertEqual('/c/a/x/y', self.props.getProperty('/d/b/x/y', 'p'))
+        self.assertEqual('/c/a', self.props.getProperty('/d/b', 'p'))
+        self.assertEqual('/c/ab', self.props.getProperty('/c/ab', 'p'))
+
+    def test_shared(self):
+        self.props.writeProperty('/c/a', 'p', '1')
+        other = sqlstore.SQLitePropertyManager(self.path)
+        self.assertEqual('1', other.getProperty('/c/a', 'p'))
+        other.removeProperties('/c/a')
+        self.assertEqual([], self.props.getProperties('/c/a'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,347 @@
+# Copyright 2013 Christian Schwede <info@cschwede.de>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import shutil
+import tempfile
+import unittest
+
+from swiftdav import cache
+from swiftdav import pool
+from swiftdav import spool
+from swiftdav import swiftdav
+
+ACCOUNT = 'http://127.0.0.1/v1/AUTH_test'
+
+FUNCTIONS = ('get_account', 'get_container', 'head_object', 'put_object',
+             'delete_object', 'delete_container')
+
+
+class DummyProvider(object):
+    lockManager = None
+    propManager = None
+    tree_workers = 2
+    upload_spool = None
+
+    def __init__(self, capabilities=None):
+        self.pools = pool.PoolManager()
+        self.metadata = cache.MetadataCache()
+        self.capabilities = capabilities or {}
+        self.mountPath = self.sharePath = ''
+
+    def get_capabilities(self, _environ):
+        return self.capabilities
+
+
+class FakeClient(object):
+    """In-memory replacement of the swiftclient functions for trees.
+
+    containers maps container names to {object name: headers}. Requests
+    listed in failures as (method, container, name) fail with that status.
+    """
+
+    def __init__(self, containers):
+        self.containers = containers
+        self.failures = {}
+        self.requests = []
+
+    def request(self, method, container, name=None, query_string=None):
+        self.requests.append((method, container, name, query_string))
+        status = self.failures.get((method, container, name))
+        if status:
+            raise swiftdav.client.ClientException('Failed',
+                                                  http_status=status)
+        if container not in self.containers or \
+                name is not None and method != 'PUT' and \
+                name not in self.containers[container]:
+            raise swiftdav.client.ClientException('Not found',
+                                                  http_status=404)
+        return self.containers[container]
+
+    @staticmethod
+    def page(names, limit, prefix, marker):
+        return [name for name in sorted(names)
+                if name.startswith(prefix or '') and
+                name > (marker or '')][:limit]
+
+    def get_account(self, _url, _token, limit=None, prefix=None,
+                    marker=None, http_conn=None):
+        return {}, [{'name': name} for name in self.page(
+            self.containers, limit, prefix, marker)]
+
+    def get_container(self, _url, _token, container, limit=None, prefix=None,
+                      marker=None, delimiter=None, http_conn=None):
+        objects = self.request('GET', container)
+        names = objects
+        if delimiter:
+            names = set()
+            for name in objects:
+                head, sep, _ = name[len(prefix or ''):].partition(delimiter)
+                names.add((prefix or '') + head + sep)
+        return {}, [{'subdir': name} if name not in objects else
+                    {'name': name, 'bytes': 0, 'hash': 'x',
+                     'last_modified': '2014-06-02T00:00:00.000000',
+                     'content_type': objects[name].get(
+                         'content-type', 'application/octet-stream')}
+                    for name in self.page(names, limit, prefix, marker)]
+
+    def head_object(self, _url, _token, container, name, http_conn=None):
+        return dict(self.request('HEAD', container, name)[name])
+
+    def put_object(self, _url, _token, container, name, contents=None,
+                   content_type=None, headers=None, query_string=None,
+                   http_conn=None):
+        objects = self.request('PUT', container, name, query_string)
+        copy_from = (headers or {}).get('X-Copy-From')
+        if copy_from:
+            src_container, _, src_name = swiftdav.urllib.unquote(
+                copy_from).lstrip('/').partition('/')
+            objects[name] = dict(self.containers[src_container][src_name])
+        else:
+            objects[name] = {'content-type': content_type or
+                             'application/octet-stream'}
+
+    def delete_object(self, _url, _token, container, name, http_conn=None,
+                      query_string=None):
+        objects = self.request('DELETE', container, name, query_string)
+        del objects[name]
+        if query_string == 'multipart-manifest=delete':
+            segments = self.containers[container + '_segments']
+            for segment in list(segments):
+                if segment.startswith(name + '/'):
+                    del segments[segment]
+
+    def delete_container(self, _url, _token, container, http_conn=None):
+        if self.request('DELETE', container):
+            raise swiftdav.client.ClientException('Conflict',
+                                                  http_status=409)
+        del self.containers[container]
+
+
+class TreeTestCase(unittest.TestCase):
+    def setUp(self):
+        self.provider = DummyProvider()
+        self.environ = {'wsgidav.provider': self.provider,
+                        'swift_storage_url': ACCOUNT}
+        self.swift = FakeClient({})
+        self.orig = dict((name, getattr(swiftdav.client, name))
+                         for name in FUNCTIONS)
+        for name in FUNCTIONS:
+            setattr(swiftdav.client, name, getattr(self.swift, name))
+
+    def tearDown(self):
+        for name, func in self.orig.items():
+            setattr(swiftdav.client, name, func)
+
+    def names(self, container):
+        return sorted(self.swift.containers[container])
+
+
+class TestSegments(TreeTestCase):
+    def setUp(self):
+        super(TestSegments, self).setUp()
+        large = {'x-static-large-object': 'True'}
+        self.swift.containers.update({
+            'c': {'d/': {'content-type': 'application/directory'},
+                  'd/x': dict(large), 'd/y': dict(large), 'z': dict(large)},
+            'c_segments': dict((name, {}) for name in (
+                'd/x/slo/1.0/10/00000000', 'd/x/slo/1.0/10/00000001',
+                'd/y/slo/1.0/10/00000000', 'z/slo/1.0/10/00000000',
+                'z/slo/2.0/10/00000000'))})
+
+    def test_delete_large_object(self):
+        res = swiftdav.ObjectResource('c', 'd/x', self.environ)
+        res.delete()
+        self.assertTrue(('DELETE', 'c', 'd/x', 'multipart-manifest=delete')
+                        in self.swift.requests)
+        self.assertEqual(['d/y/slo/1.0/10/00000000', 'z/slo/1.0/10/00000000',
+                          'z/slo/2.0/10/00000000'], self.names('c_segments'))
+
+    def test_delete_moved_manifest(self):
+        # The copy of the manifest still uses the segments
+        res = swiftdav.ObjectResource('c', 'd/x', self.environ)
+        res.shared_segments = True
+        res.delete()
+        self.assertEqual(5, len(self.names('c_segments')))
+
+    def test_delete_old_segments(self):
+        swiftdav.delete_old_segments(self.environ, 'c', 'z', 'z/slo/2.0/10')
+        self.assertEqual(['d/x/slo/1.0/10/00000000',
+                          'd/x/slo/1.0/10/00000001',
+                          'd/y/slo/1.0/10/00000000', 'z/slo/2.0/10/00000000'],
+                         self.names('c_segments'))
+        swiftdav.delete_old_segments(self.environ, 'c', 'z')
+        self.assertEqual(3, len(self.names('c_segments')))
+
+    def test_no_segment_container(self):
+        del self.swift.containers['c_segments']
+        swiftdav.delete_old_segments(self.environ, 'c', 'z')
+        self.assertFalse(any(request[1] == 'c_segments'
+                             for request in self.swift.requests))
+
+    def test_delete_tree(self):
+        self.assertEqual([], swiftdav.delete_tree(self.environ, 'c', 'd/'))
+        self.assertEqual(['z'], self.names('c'))
+        self.assertEqual(['z/slo/1.0/10/00000000', 'z/slo/2.0/10/00000000'],
+                         self.names('c_segments'))
+
+    def test_delete_container(self):
+        swiftdav.delete_tree(self.environ, 'c', '')
+        self.assertFalse('c_segments' in self.swift.containers)
+
+    def test_move_tree(self):
+        self.swift.containers['c']['e/'] = {}
+        self.swift.failures[('PUT', 'c', 'e/y')] = 503
+        errors = swiftdav.copy_tree(self.environ, 'c', 'd/', 'c', 'e/',
+                                    move=True)
+        self.assertEqual(['/c/d/y'], [path for path, _ in errors])
+        # The segments of the object not moved are kept
+        self.assertEqual(['d/y/slo/1.0/10/00000000', 'z/slo/1.0/10/00000000',
+                          'z/slo/2.0/10/00000000'], self.names('c_segments'))
+
+
+class DummyResponse(object):
+    def __init__(self, status, result=None):
+        self.status = status
+        self.body = json.dumps(result) if result is not None else ''
+
+
+class TestPartialFailures(TreeTestCase):
+    def setUp(self):
+        super(TestPartialFailures, self).setUp()
+        self.swift.containers['c'] = {
+            'd/': {'content-type': 'application/directory'},
+            'd/x': {}, 'd/\xc3\xa4': {}}
+        self.bulk_requests = []
+        self.bulk_response = None
+        self.orig_raw_request = swiftdav.raw_request
+        swiftdav.raw_request = self.raw_request
+
+    def tearDown(self):
+        super(TestPartialFailures, self).tearDown()
+        swiftdav.raw_request = self.orig_raw_request
+
+    def raw_request(self, _environ, operation, method, path, body=None,
+                    headers=None):
+        self.bulk_requests.append((operation, method, path, body))
+        return self.bulk_response
+
+    def result(self, errors):
+        return [(path, error.value) for path, error in errors]
+
+    def test_copy(self):
+        self.swift.failures[('PUT', 'c', 'e/x')] = 507
+        errors = swiftdav.copy_tree(self.environ, 'c', 'd/', 'c', 'e/')
+        self.assertEqual([('/c/d/x', 507)], self.result(errors))
+        self.assertEqual(['d/', 'd/x', 'd/\xc3\xa4', 'e/', 'e/\xc3\xa4'],
+                         self.names('c'))
+
+    def test_delete(self):
+        self.swift.failures[('DELETE', 'c', 'd/\xc3\xa4')] = 403
+        res = swiftdav.ObjectCollection('c', self.environ, prefix='d')
+        self.assertEqual([('/c/d/%C3%A4', 403)], self.result(res.delete()))
+        self.assertEqual(['d/\xc3\xa4'], self.names('c'))
+
+    def test_bulk_delete(self):
+        self.provider.capabilities = {
+            'bulk_delete': {'max_deletes_per_request': 100}}
+        self.bulk_response = DummyResponse(200, {
+            'Response Status': '400 Bad Request',
+            'Number Deleted': 2,
+            'Errors': [['/c/d/%C3%A4', '409 Conflict']]})
+        errors = swiftdav.delete_tree(self.environ, 'c', 'd/')
+        self.assertEqual([('/c/d/%C3%A4', 409)], self.result(errors))
+        (operation, method, path, body), = self.bulk_requests
+        self.assertEqual(('bulk_delete', 'POST', '/v1/AUTH_test?bulk-delete'),
+                         (operation, method, path))
+        self.assertEqual(['/c/d/', '/c/d/x', '/c/d/%C3%A4'],
+                         body.split('\n'))
+
+    def test_failed_bulk_delete(self):
+        # The objects are deleted one by one instead
+        self.provider.capabilities = {
+            'bulk_delete': {'max_deletes_per_request': 100}}
+        self.bulk_response = DummyResponse(503)
+        self.assertEqual([], swiftdav.delete_tree(self.environ, 'c', 'd/'))
+        self.assertEqual([], self.names('c'))
+        self.assertRaises(swiftdav.client.ClientException,
+                          swiftdav.bulk_delete, self.environ, 'c', ['d/x'])
+
+
+class TestFolderMarkers(TreeTestCase):
+    def setUp(self):
+        super(TestFolderMarkers, self).setUp()
+        self.swift.containers['c'] = {
+            'm': {'content-type': 'application/directory'},
+            'm/a': {}, 'mx': {}}
+
+    def test_delete(self):
+        res = swiftdav.ObjectCollection('c', self.environ, prefix='m')
+        self.assertEqual([], res.delete())
+        self.assertEqual(['mx'], self.names('c'))
+
+    def test_move(self):
+        self.assertEqual([], swiftdav.copy_tree(self.environ, 'c', 'm/', 'c',
+                                                'n/', move=True))
+        self.assertEqual(['mx', 'n/a'], self.names('c'))
+
+    def test_failed_move_keeps_marker(self):
+        self.swift.failures[('PUT', 'c', 'n/a')] = 503
+        swiftdav.copy_tree(self.environ, 'c', 'm/', 'c', 'n/', move=True)
+        self.assertEqual(['m', 'm/a', 'mx'], self.names('c'))
+
+    def test_copy(self):
+        swiftdav.copy_tree(self.environ, 'c', 'm/', 'c', 'n/')
+        self.assertEqual(['m', 'm/a', 'mx', 'n/a'], self.names('c'))
+
+    def test_delete_without_marker(self):
+        self.swift.containers['c']['m'] = {}
+        swiftdav.delete_tree(self.environ, 'c', 'm/')
+        self.assertEqual(['m', 'mx'], self.names('c'))
+
+
+class TestSpooledMembers(TreeTestCase):
+    def setUp(self):
+        super(TestSpooledMembers, self).setUp()
+        self.path = tempfile.mkdtemp()
+        self.provider.upload_spool = spool.UploadSpool(self.path)
+        self.swift.containers['c'] = {
+            'd/': {'content-type': 'application/directory'},
+            'd/a': {}, 'd/c': {}}
+        for name in ('d/b', 'd/c', 'd/e/f'):
+            self.provider.upload_spool.add(ACCOUNT, 'c', name, 'spooled')
+        self.res = swiftdav.ObjectCollection('c', self.environ, prefix='d')
+
+    def tearDown(self):
+        super(TestSpooledMembers, self).tearDown()
+        shutil.rmtree(self.path)
+
+    def test_depth_1(self):
+        self.assertEqual(
+            [('d/a', 0), ('d/b', 7), ('d/c', 7), ('d/e', None)],
+            sorted((res.objectname, res.getContentLength()) if
+                   not res.isCollection else (res.prefix.rstrip('/'), None)
+                   for res in self.res.iter_members()))
+
+    def test_depth_infinity(self):
+        self.assertEqual(
+            [('d/a', 0), ('d/b', 7), ('d/c', 7), ('d/e', None),
+             ('d/e/f', 7)],
+            [(res.objectname, res.getContentLength()) if
+             not res.isCollection else (res.prefix.rstrip('/'), None)
+             for res in self.res.iter_tree()])
+
+
+if __name__ == '__main__':
+    unittest.main()
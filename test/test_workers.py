@@ -0,0 +1,78 @@
+# Copyright 2013 Christian Schwede <info@cschwede.de>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import threading
+import time
+import unittest
+
+from swiftdav import workers
+
+
+class TestChainParallel(unittest.TestCase):
+    def test_order(self):
+        def factory(i):
+            def items():
+                # Later iterables finish first
+                time.sleep(0.01 * (5 - i))
+                return range(i * 10, i * 10 + 3)
+            return items
+        result = workers.chain_parallel((factory(i) for i in range(5)), 3,
+                                        queue_size=2)
+        self.assertEqual([i * 10 + j for i in range(5) for j in range(3)],
+                         list(result))
+
+    def test_parallel(self):
+        started = []
+        all_started = threading.Event()
+
+        def factory(i):
+            def items():
+                started.append(i)
+                if len(started) == 3:
+                    all_started.set()
+                all_started.wait(1)
+                yield i
+            return items
+        result = workers.chain_parallel((factory(i) for i in range(3)), 3)
+        self.assertEqual([0, 1, 2], list(result))
+        self.assertTrue(all_started.is_set())
+
+    def test_error(self):
+        def failing():
+            yield 1
+            raise ValueError('listing failed')
+        result = workers.chain_parallel([lambda: [0], failing, lambda: [2]],
+                                        2)
+        self.assertEqual(0, next(result))
+        self.assertEqual(1, next(result))
+        self.assertRaises(ValueError, next, result)
+
+    def test_close(self):
+        produced = []
+
+        def endless():
+            while True:
+                produced.append(None)
+                yield len(produced)
+        result = workers.chain_parallel([endless], 1, queue_size=5)
+        self.assertEqual(1, next(result))
+        result.close()
+        time.sleep(workers.POLL_INTERVAL * 3)
+        count = len(produced)
+        time.sleep(workers.POLL_INTERVAL * 3)
+        self.assertEqual(count, len(produced))
+
+
+if __name__ == '__main__':
+    unittest.main()